@@ -0,0 +1,76 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+from db import DB_BUSY_TIMEOUT, DB_STATEMENT_CACHE
+from metrics import SQLITE_LOCK_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDatabase:
+    """asyncio access to a SQLite file, for the ASGI server (asgi.py).
+
+    aiosqlite runs each connection on a thread of its own, so queries never
+    block the event loop. Reads share one connection; writes go through a
+    second one, and write blocks hold a lock so that coroutines cannot
+    interleave statements inside each other's transactions. Connections use
+    the same WAL settings as db.py, so they coexist with the Flask routes'
+    pooled connections in the same process.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.database = os.path.basename(path)
+        self._reader = None
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(self.path, timeout=DB_BUSY_TIMEOUT,
+                                       cached_statements=DB_STATEMENT_CACHE, isolation_level=None)
+        await conn.execute('PRAGMA journal_mode=WAL')
+        await conn.execute('PRAGMA synchronous=NORMAL')
+        await conn.execute(f'PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}')
+        return conn
+
+    async def open(self):
+        self._reader = await self._connect()
+        self._writer = await self._connect()
+        logger.info(f"Opened async SQLite connections to {self.path}")
+
+    async def close(self):
+        for conn in (self._reader, self._writer):
+            if conn is not None:
+                await conn.close()
+        self._reader = self._writer = None
+
+    async def fetchone(self, sql, params=()):
+        async with self._reader.execute(sql, params) as c:
+            return await c.fetchone()
+
+    async def fetchall(self, sql, params=()):
+        async with self._reader.execute(sql, params) as c:
+            return await c.fetchall()
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Yield the write connection inside BEGIN IMMEDIATE; commit when the block ends.
+
+        The transaction is rolled back if the block raises. The wait for
+        SQLite's write lock is reported like db.cursor() does.
+        """
+        async with self._write_lock:
+            start = time.perf_counter()
+            await self._writer.execute('BEGIN IMMEDIATE')
+            SQLITE_LOCK_WAIT_SECONDS.labels(self.database).observe(time.perf_counter() - start)
+            try:
+                yield self._writer
+                await self._writer.execute('COMMIT')
+            except BaseException:
+                await self._writer.execute('ROLLBACK')
+                raise
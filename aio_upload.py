@@ -0,0 +1,300 @@
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+
+from upload_pipeline import (plan_upload, describe_plan, observe_plan, head_size, is_single_put, upload_result,
+                             existing_result, copy_part_ranges, format_file_size, CHUNK_SIZE, MIN_MULTIPART_SIZE, MAX_COPY_SIZE,
+                             TEMP_KEY_PREFIX)
+from metrics import UPLOAD_STAGE_SECONDS, UPLOAD_BYTES, UPLOADS_IN_FLIGHT, UPLOAD_PARTS_IN_FLIGHT
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBudget:
+    """Upload buffer memory a process may hold at once, shared by all uploads.
+
+    Under a blocking server the worker count bounds how many uploads hold
+    buffers; an asyncio server accepts any number, so each upload reserves
+    its worst case here before reading and waits, leaving the rest of its
+    body unread in the socket, while the budget is spent. An upload takes a
+    single reservation, so uploads cannot deadlock waiting on each other.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._waiters = []
+
+    async def acquire(self, size):
+        """Reserve `size` bytes (at most the whole limit); returns the amount reserved."""
+        size = min(size, self.limit)
+        while self.used + size > self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                self._waiters.remove(waiter)
+        self.used += size
+        return size
+
+    def release(self, size):
+        self.used -= size
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+async def stream_upload(s3, form, bucket, key_for_hash, file_size=None,
+                        part_size=CHUNK_SIZE, threshold=MIN_MULTIPART_SIZE, content_type=None,
+                        workers=None, memory_budget=None, find_existing=None, budget=None):
+    """asyncio counterpart of upload_pipeline.stream_upload.
+
+    `s3` is an aiobotocore client and `form` an AsyncStreamingForm opened on
+    the file. The file is hashed chunk by chunk as it arrives, then sent
+    with a single PUT, or for large files as multipart parts to a temporary
+    key that is copied to `key_for_hash(hash)` once the hash is known. The
+    plan, deduplication through the awaitable `find_existing(hash)`, and
+    the result come from the same upload_pipeline helpers as the blocking
+    version's; only the I/O differs. With a MemoryBudget
+    as `budget`, the upload first reserves the most it can buffer.
+    """
+    plan = plan_upload(file_size, part_size=part_size, threshold=threshold,
+                       workers=workers, memory_budget=memory_budget)
+    logger.info(f"Upload plan: {describe_plan(plan)}")
+    observe_plan(plan)
+    reserved = await budget.acquire(upload_reservation(plan)) if budget else 0
+    try:
+        with UPLOADS_IN_FLIGHT.track_inprogress():
+            return await _stream_upload(s3, form, bucket, key_for_hash, plan, content_type, find_existing)
+    finally:
+        if budget:
+            budget.release(reserved)
+
+
+def upload_reservation(plan):
+    """Most bytes an upload following `plan` buffers at once."""
+    file_size = plan['file_size']
+    # The head read to tell a small file from a large one, then for a large
+    # file up to max_in_flight parts while the head is still being consumed
+    reserve = head_size(plan)
+    if plan['multipart']:
+        reserve += plan['max_in_flight'] * plan['part_size']
+    return reserve if file_size is None else min(reserve, file_size + 1)
+
+
+async def _stream_upload(s3, form, bucket, key_for_hash, plan, content_type, find_existing):
+    file_size = plan['file_size']
+    hasher = hashlib.sha256()
+    extra_args = {'ContentType': content_type} if content_type else {}
+
+    head = await read_part(form, head_size(plan), hasher)
+    if is_single_put(plan, head):
+        filehash = hasher.hexdigest()
+        existing = existing_result(filehash, await find_existing(filehash) if find_existing else None,
+                                   len(head), plan)
+        if existing:
+            return existing
+
+        key = key_for_hash(filehash)
+        logger.info(f"Using regular upload for file ({format_file_size(len(head))})")
+        with UPLOAD_STAGE_SECONDS.labels('upload_part').time():
+            await s3.put_object(Bucket=bucket, Key=key, Body=head, **extra_args)
+        UPLOAD_BYTES.labels('sent').inc(len(head))
+        return upload_result(filehash, key, len(head), plan)
+
+    logger.info(f"Using multipart upload for large file ({format_file_size(file_size)})")
+    temp_key = f"{TEMP_KEY_PREFIX}{uuid.uuid4().hex}"
+    parts = iter_parts(form, plan['part_size'], head, hasher)
+    # As in upload_pipeline, the head must not outlive the parts it fills
+    del head
+    response = await multipart_upload(
+        s3, parts, bucket, temp_key,
+        file_size=file_size, content_type=content_type,
+        workers=plan['workers'], max_in_flight=plan['max_in_flight']
+    )
+    bytes_uploaded = response['size']
+    filehash = hasher.hexdigest()
+
+    with UPLOAD_STAGE_SECONDS.labels('move').time():
+        try:
+            existing = existing_result(filehash, await find_existing(filehash) if find_existing else None,
+                                       bytes_uploaded, plan, uploaded=True)
+            if existing:
+                return existing
+
+            key = key_for_hash(filehash)
+            await copy_object(s3, bucket, temp_key, key, bytes_uploaded, part_size=plan['part_size'],
+                              content_type=content_type)
+        finally:
+            await delete_object(s3, bucket, temp_key, response.get('VersionId'))
+
+    logger.info(f"Multipart upload completed: {key}")
+    return upload_result(filehash, key, bytes_uploaded, plan)
+
+
+async def read_part(form, size, hasher):
+    """Read up to `size` bytes of the file, hashing each chunk as it arrives.
+
+    The buffer grows with the data rather than being allocated up front, so
+    many concurrent small uploads only hold the bytes they actually sent.
+    """
+    buffer = bytearray()
+    hash_seconds = 0.0
+    while len(buffer) < size:
+        data = await form.read(size - len(buffer))
+        if not data:
+            break
+        start = time.perf_counter()
+        hasher.update(data)
+        hash_seconds += time.perf_counter() - start
+        buffer += data
+    if buffer:
+        UPLOAD_BYTES.labels('received').inc(len(buffer))
+        UPLOAD_STAGE_SECONDS.labels('hash').observe(hash_seconds)
+    return buffer
+
+
+async def iter_parts(form, part_size, head, hasher):
+    """Yield consecutive `part_size` parts of the file, starting with `head`.
+
+    Like upload_pipeline.iter_parts, the head is released once copied.
+    """
+    head = memoryview(head) if len(head) else None
+    while True:
+        part = bytearray()
+        if head is not None:
+            part += head[:part_size]
+            used, head = head, head[part_size:]
+            used.release()
+            if not len(head):
+                head.release()
+                head = None
+        if len(part) < part_size:
+            part += await read_part(form, part_size - len(part), hasher)
+        if not part:
+            return
+        yield part
+
+
+async def multipart_upload(s3, parts, bucket, key, file_size=None, content_type=None,
+                           workers=4, max_in_flight=1):
+    """Upload an async iterator of parts to `key` with B2's multipart API.
+
+    Up to `workers` parts are PUT concurrently, and reading stops while
+    `max_in_flight` parts are already waiting or being sent, which bounds
+    the memory one upload holds. Returns the complete_multipart_upload
+    response plus the uploaded size.
+    """
+    extra_args = {'ContentType': content_type} if content_type else {}
+    response = await s3.create_multipart_upload(Bucket=bucket, Key=key, **extra_args)
+    upload_id = response['UploadId']
+    logger.info(f"Started multipart upload: {upload_id} ({workers} workers, {max_in_flight} parts in flight)")
+
+    slots = asyncio.Semaphore(max_in_flight)
+    senders = asyncio.Semaphore(workers)
+    failed = asyncio.Event()
+    bytes_uploaded = 0
+
+    async def upload_one(part_number, data):
+        nonlocal bytes_uploaded
+        try:
+            async with senders:
+                with UPLOAD_PARTS_IN_FLIGHT.track_inprogress(), UPLOAD_STAGE_SECONDS.labels('upload_part').time():
+                    response = await s3.upload_part(Bucket=bucket, Key=key, PartNumber=part_number,
+                                                    UploadId=upload_id, Body=data)
+            UPLOAD_BYTES.labels('sent').inc(len(data))
+            bytes_uploaded += len(data)
+            if file_size:
+                logger.info(f"Upload progress: {bytes_uploaded / file_size * 100:.1f}% "
+                            f"({format_file_size(bytes_uploaded)}/{format_file_size(file_size)})")
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        except BaseException:
+            failed.set()
+            raise
+        finally:
+            slots.release()
+
+    tasks = []
+    try:
+        while True:
+            # A slot is taken before reading, so at most max_in_flight parts exist
+            await slots.acquire()
+            if failed.is_set():
+                break
+            try:
+                data = await parts.__anext__()
+            except StopAsyncIteration:
+                break
+            tasks.append(asyncio.ensure_future(upload_one(len(tasks) + 1, data)))
+
+        completed_parts = await asyncio.gather(*tasks)
+
+        with UPLOAD_STAGE_SECONDS.labels('complete').time():
+            response = await s3.complete_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': completed_parts}
+            )
+    except BaseException as e:
+        # Also reached when the client disconnects or the request is cancelled
+        logger.error(f"Multipart upload failed: {e!r}")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            await s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            logger.info(f"Aborted multipart upload: {upload_id}")
+        except Exception:
+            pass
+        raise
+
+    response['size'] = bytes_uploaded
+    return response
+
+
+async def copy_object(s3, bucket, source_key, dest_key, size, part_size=CHUNK_SIZE, content_type=None):
+    """Server-side copy within the bucket, using a multipart copy above 5GB."""
+    source = {'Bucket': bucket, 'Key': source_key}
+    if size <= MAX_COPY_SIZE:
+        await s3.copy_object(Bucket=bucket, Key=dest_key, CopySource=source)
+        return
+
+    extra_args = {'ContentType': content_type} if content_type else {}
+    response = await s3.create_multipart_upload(Bucket=bucket, Key=dest_key, **extra_args)
+    upload_id = response['UploadId']
+    try:
+        parts = []
+        for part_number, copy_range in copy_part_ranges(size, part_size):
+            response = await s3.upload_part_copy(
+                Bucket=bucket,
+                Key=dest_key,
+                PartNumber=part_number,
+                UploadId=upload_id,
+                CopySource=source,
+                CopySourceRange=copy_range
+            )
+            parts.append({'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']})
+
+        await s3.complete_multipart_upload(Bucket=bucket, Key=dest_key, UploadId=upload_id,
+                                           MultipartUpload={'Parts': parts})
+    except BaseException:
+        try:
+            await s3.abort_multipart_upload(Bucket=bucket, Key=dest_key, UploadId=upload_id)
+        except Exception:
+            pass
+        raise
+
+
+async def delete_object(s3, bucket, key, version_id=None):
+    """Delete an object, removing the stored version itself when B2 reported one."""
+    try:
+        if version_id:
+            await s3.delete_object(Bucket=bucket, Key=key, VersionId=version_id)
+        else:
+            await s3.delete_object(Bucket=bucket, Key=key)
+    except Exception as e:
+        logger.warning(f"Failed to delete temporary object {key}: {e}")
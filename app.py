@@ -1,15 +1,28 @@
 import os
-import hashlib
-import sqlite3
 import logging
 import re
 from flask import Flask, request, jsonify, render_template_string, render_template, Response, url_for
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from boto3.session import Session
 from dotenv import load_dotenv
-from io import BytesIO
 from datetime import datetime
+import db
+from download_counts import DownloadCounter
+from cache import LRUCache
+from health import HealthMonitor
+from raw_downloads import cached_object_response
+from disk_cache import DiskCache, DISK_CACHE_DIR
+from pagination import fetch_page, iter_rows, page_size, ndjson_lines, json_array, InvalidCursor
+from search_index import init_fts, is_hash_query, match_expression
+from upload_pipeline import (stream_upload, normalize_sha256, format_file_size, CHUNK_SIZE, MIN_MULTIPART_SIZE,
+                             UPLOAD_WORKERS)
+import upload_sessions
+from upload_sessions import init_upload_sessions, UploadSessionError
+from form_stream import StreamingForm, FormStreamError
+from batch_upload import upload_batch, iter_form_files, iter_tar_files, TAR_MIMETYPES, BATCH_UPLOAD_WORKERS
+from clients import LazyClient, b2_client
+import metrics
+from metrics import UPLOAD_STAGE_SECONDS
 
 # Configure logging
 logging.basicConfig(
@@ -18,108 +31,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Helper functions
-def format_file_size(size_bytes):
-    """Format file size in human readable format."""
-    if size_bytes is None:
-        return "Unknown"
-    
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-        if size_bytes < 1024.0:
-            return f"{size_bytes:.1f} {unit}"
-        size_bytes /= 1024.0
-    return f"{size_bytes:.1f} PB"
-
-def calculate_file_hash_chunked(file_obj, chunk_size=8192):
-    """Calculate SHA256 hash of a file using chunked reading to save memory."""
-    hasher = hashlib.sha256()
-    file_obj.seek(0)
-    
-    while True:
-        chunk = file_obj.read(chunk_size)
-        if not chunk:
-            break
-        hasher.update(chunk)
-    
-    file_obj.seek(0)  # Reset file pointer
-    return hasher.hexdigest()
-
-def upload_large_file_multipart(file_obj, bucket, key, file_size):
-    """Upload large files using B2's multipart upload API."""
-    try:
-        # Initialize multipart upload
-        response = s3.create_multipart_upload(
-            Bucket=bucket,
-            Key=key
-        )
-        upload_id = response['UploadId']
-        logger.info(f"Started multipart upload: {upload_id}")
-        
-        # Upload parts
-        parts = []
-        part_number = 1
-        bytes_uploaded = 0
-        
-        file_obj.seek(0)
-        
-        while bytes_uploaded < file_size:
-            # Calculate part size (last part might be smaller)
-            remaining = file_size - bytes_uploaded
-            part_size = min(CHUNK_SIZE, remaining)
-            
-            # Read chunk
-            chunk_data = file_obj.read(part_size)
-            
-            logger.info(f"Uploading part {part_number} ({format_file_size(part_size)})")
-            
-            # Upload part
-            response = s3.upload_part(
-                Bucket=bucket,
-                Key=key,
-                PartNumber=part_number,
-                UploadId=upload_id,
-                Body=chunk_data
-            )
-            
-            parts.append({
-                'PartNumber': part_number,
-                'ETag': response['ETag']
-            })
-            
-            bytes_uploaded += part_size
-            part_number += 1
-            
-            # Log progress
-            progress = (bytes_uploaded / file_size) * 100
-            logger.info(f"Upload progress: {progress:.1f}% ({format_file_size(bytes_uploaded)}/{format_file_size(file_size)})")
-        
-        # Complete multipart upload
-        response = s3.complete_multipart_upload(
-            Bucket=bucket,
-            Key=key,
-            UploadId=upload_id,
-            MultipartUpload={'Parts': parts}
-        )
-        
-        logger.info(f"Multipart upload completed: {key}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Multipart upload failed: {e}")
-        
-        # Try to abort the upload
-        try:
-            s3.abort_multipart_upload(
-                Bucket=bucket,
-                Key=key,
-                UploadId=upload_id
-            )
-            logger.info(f"Aborted multipart upload: {upload_id}")
-        except:
-            pass
-            
-        raise e
-
 # Load environment variables
 load_dotenv()
 B2_KEY_ID = os.getenv('B2_KEY_ID')
@@ -145,64 +56,104 @@ logger.info("Environment variables loaded successfully")
 
 # SQLite setup
 DB_PATH = 'metadata.db'
+
+# /f/<hash> lookups cached in process, keyed by lowercase prefix and full hash
+METADATA_CACHE_SIZE = int(os.getenv('METADATA_CACHE_SIZE', 10000))  # Entries
+METADATA_CACHE_TTL = float(os.getenv('METADATA_CACHE_TTL', 60))  # Seconds
+
+# Bump whenever create_schema changes so existing databases are migrated
+SCHEMA_VERSION = 1
+
+def create_schema(c):
+    """Create or upgrade all tables, indexes and triggers using an open cursor."""
+    # Create table with all columns we need
+    c.execute('''CREATE TABLE IF NOT EXISTS files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        filename TEXT NOT NULL,
+        original_filename TEXT,
+        filehash TEXT NOT NULL,
+        file_size INTEGER,
+        mime_type TEXT,
+        url TEXT NOT NULL,
+        upload_ip TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        download_count INTEGER DEFAULT 0
+    )''')
+    
+    # Create index for faster hash lookups
+    c.execute('CREATE INDEX IF NOT EXISTS idx_filehash ON files(filehash)')
+    
+    # Keyset pagination index for /files, newest first
+    c.execute('CREATE INDEX IF NOT EXISTS idx_files_created ON files(created_at, id)')
+    
+    # Resumable chunked upload sessions
+    init_upload_sessions(c)
+    
+    # Check if we need to add columns for existing databases
+    c.execute("PRAGMA table_info(files)")
+    existing_columns = [column[1] for column in c.fetchall()]
+    
+    # Add missing columns
+    columns_to_add = [
+        ('original_filename', 'TEXT'),
+        ('file_size', 'INTEGER'),
+        ('mime_type', 'TEXT'),
+        ('upload_ip', 'TEXT'),
+        ('download_count', 'INTEGER DEFAULT 0')
+    ]
+    
+    for col_name, col_type in columns_to_add:
+        if col_name not in existing_columns:
+            c.execute(f'ALTER TABLE files ADD COLUMN {col_name} {col_type}')
+            logger.info(f"Added {col_name} column to existing database")
+    
+    # Full-text index behind /search
+    init_fts(c, 'files', ['original_filename', 'filename'])
+    
+    # Trigger-maintained row count, so health checks avoid COUNT(*)
+    db.init_row_counter(c, 'files')
+
 def init_db():
-    """Initialize the database with all necessary columns."""
+    """Initialize the database; a no-op once the schema is at SCHEMA_VERSION."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        # Create table with all columns we need
-        c.execute('''CREATE TABLE IF NOT EXISTS files (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            filename TEXT NOT NULL,
-            original_filename TEXT,
-            filehash TEXT NOT NULL,
-            file_size INTEGER,
-            mime_type TEXT,
-            url TEXT NOT NULL,
-            upload_ip TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            download_count INTEGER DEFAULT 0
-        )''')
-        
-        # Create index for faster hash lookups
-        c.execute('CREATE INDEX IF NOT EXISTS idx_filehash ON files(filehash)')
-        
-        # Check if we need to add columns for existing databases
-        c.execute("PRAGMA table_info(files)")
-        existing_columns = [column[1] for column in c.fetchall()]
-        
-        # Add missing columns
-        columns_to_add = [
-            ('original_filename', 'TEXT'),
-            ('file_size', 'INTEGER'),
-            ('mime_type', 'TEXT'),
-            ('upload_ip', 'TEXT'),
-            ('download_count', 'INTEGER DEFAULT 0')
-        ]
-        
-        for col_name, col_type in columns_to_add:
-            if col_name not in existing_columns:
-                c.execute(f'ALTER TABLE files ADD COLUMN {col_name} {col_type}')
-                logger.info(f"Added {col_name} column to existing database")
-        
-        conn.commit()
-        conn.close()
-        logger.info("Database initialized successfully")
+        if db.migrate(DB_PATH, 'app', SCHEMA_VERSION, create_schema):
+            logger.info("Database initialized successfully")
     except Exception as e:
         logger.error(f"Database initialization failed: {e}")
         raise
 
 init_db()
 
-# Boto3 S3 client
-session = Session()
-s3 = session.client(
-    service_name='s3',
-    aws_access_key_id=B2_KEY_ID,
-    aws_secret_access_key=B2_APPLICATION_KEY,
-    endpoint_url=B2_ENDPOINT
-)
+# Only found files are cached: a miss must not hide a file that another
+# worker has just stored
+file_cache = LRUCache(METADATA_CACHE_SIZE, METADATA_CACHE_TTL)
+
+# Buffered download_count increments, flushed in batches; a flush drops the
+# cached lookups whose stored count it changed
+download_counter = DownloadCounter(
+    DB_PATH,
+    on_flush=lambda filehashes: file_cache.invalidate(
+        *(filehash[:i] for filehash in filehashes for i in range(8, len(filehash) + 1))))
+
+# Boto3 S3 client, built on first use so importing the app stays fast.
+# Parallel part uploads and batch upload workers each hold a connection from the pool
+s3 = LazyClient(lambda: b2_client(B2_ENDPOINT, B2_KEY_ID, B2_APPLICATION_KEY,
+                                  max_pool_connections=max(10, UPLOAD_WORKERS * 2,
+                                                           BATCH_UPLOAD_WORKERS + UPLOAD_WORKERS)))
+
+# Local copies of hot objects, served with sendfile instead of from B2
+disk_cache = DiskCache(DISK_CACHE_DIR, s3, B2_BUCKET) if DISK_CACHE_DIR else None
+
+def check_database():
+    """Readiness check: SQLite answers, reporting the maintained file count."""
+    return db.row_count(DB_PATH, 'files')
+
+def check_b2():
+    """Readiness check: the bucket is reachable with our credentials."""
+    s3.head_bucket(Bucket=B2_BUCKET)
+
+# Readiness checks run in the background; probes read the cached result
+health_monitor = HealthMonitor({'database': check_database, 'b2': check_b2})
 
 app = Flask(__name__)
 
@@ -224,166 +175,417 @@ class StreamConsumingMiddleware:
         self.app = app
 
     def __call__(self, environ, start_response):
-        # For uploads, don't buffer the entire request
-        if environ.get('REQUEST_METHOD') == 'POST' and '/upload' in environ.get('PATH_INFO', ''):
+        # For uploads, don't buffer the entire request. Only bodies without a
+        # Content-Length are read to EOF; doing that to the rest hangs servers
+        # (like werkzeug's) that pass the raw socket through as wsgi.input
+        if (environ.get('REQUEST_METHOD') == 'POST' and '/upload' in environ.get('PATH_INFO', '')
+                and not environ.get('CONTENT_LENGTH')):
             environ['wsgi.input_terminated'] = True
         return self.app(environ, start_response)
 
 # Apply streaming middleware
 app.wsgi_app = StreamConsumingMiddleware(app.wsgi_app)
 
-# B2 multipart upload configuration
-CHUNK_SIZE = 100 * 1024 * 1024  # 100MB chunks for multipart uploads
-MIN_MULTIPART_SIZE = 100 * 1024 * 1024  # Use multipart for files > 100MB
-
 # Error handler for file too large - removed since we have no limit
 # @app.errorhandler(413)
 # def request_entity_too_large(error):
 #     return jsonify({'error': 'File too large. Maximum size is 100MB'}), 413
 
+def build_public_url(s3_key):
+    """Construct the public B2 download URL for an object key."""
+    # For B2, the public URL format is: https://fNNN.backblazeb2.com/file/BUCKET_NAME/KEY
+    # Extract the file number from endpoint (e.g., f005 from s3.us-east-005.backblazeb2.com)
+    if B2_ENDPOINT:
+        match = re.search(r's3\.(.+?)\.backblazeb2\.com', B2_ENDPOINT)
+        if match:
+            region = match.group(1)
+            # Convert us-east-005 to f005 (keep the leading zeros!)
+            file_num = 'f' + region.split('-')[-1]
+            return f"https://{file_num}.backblazeb2.com/file/{B2_BUCKET}/{s3_key}"
+        # Fallback to constructed URL
+        return f"{B2_ENDPOINT}/{B2_BUCKET}/{s3_key}"
+    return f"https://f005.backblazeb2.com/file/{B2_BUCKET}/{s3_key}"
+
+def store_file_metadata(s3_key, original_filename, filehash, file_size, mime_type, url, upload_ip):
+    """Insert the metadata row for an uploaded file."""
+    with UPLOAD_STAGE_SECONDS.labels('db_write').time(), db.cursor(DB_PATH) as c:
+        c.execute('''INSERT INTO files 
+                    (filename, original_filename, filehash, file_size, mime_type, url, upload_ip) 
+                    VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                  (s3_key, original_filename, filehash, file_size, mime_type, url, upload_ip))
+    
+    # Any cached prefix of the new hash may now resolve differently
+    file_cache.invalidate(*(filehash[:i] for i in range(8, len(filehash) + 1)))
+
+def store_batch_metadata(rows):
+    """Insert the metadata rows of a batch upload in a single transaction."""
+    if not rows:
+        return
+    with UPLOAD_STAGE_SECONDS.labels('db_write').time(), db.cursor(DB_PATH) as c:
+        c.executemany('''INSERT INTO files 
+                        (filename, original_filename, filehash, file_size, mime_type, url, upload_ip) 
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+    
+    file_cache.invalidate(*(row[2][:i] for row in rows for i in range(8, len(row[2]) + 1)))
+
+def find_file_by_hash(filehash):
+    """Return the stored object for an exact SHA-256, using idx_filehash."""
+    with db.cursor(DB_PATH) as c:
+        c.execute('''SELECT filename, original_filename, file_size, url, mime_type
+                     FROM files WHERE filehash = ? LIMIT 1''', (filehash,))
+        row = c.fetchone()
+    
+    if not row:
+        return None
+    return {
+        'filename': row[0],
+        'original_filename': row[1] or row[0],
+        'file_size': row[2],
+        'url': row[3],
+        'mime_type': row[4]
+    }
+
+def upload_response(original_filename, filehash, file_size, url, deduplicated=False):
+    """JSON body returned after a successful upload."""
+    return {
+        'filename': original_filename, 
+        'hash': filehash,
+        'hash_short': filehash[:8],
+        'size': format_file_size(file_size),
+        'url': url,
+        'info_url': f"/f/{filehash[:8]}",
+        'deduplicated': deduplicated
+    }
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/health')
 def health_check():
-    """Health check endpoint for monitoring."""
-    try:
-        # Check database connection
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('SELECT COUNT(*) FROM files')
-        file_count = c.fetchone()[0]
-        conn.close()
-        
-        # Check B2 connection
-        s3.list_buckets()
-        
-        return jsonify({
-            'status': 'healthy',
-            'timestamp': datetime.utcnow().isoformat(),
-            'file_count': file_count,
-            'version': '2.5.0'  # Large file support version
-        }), 200
-    except Exception as e:
-        logger.error(f"Health check failed: {e}")
+    """Health check endpoint for monitoring, served from the cached readiness checks."""
+    snapshot = health_monitor.snapshot()
+    if not snapshot['healthy']:
+        failed = [name for name, check in snapshot['checks'].items() if not check['ok']]
         return jsonify({
             'status': 'unhealthy',
-            'error': str(e),
+            'error': snapshot.get('error') or f"Failed checks: {', '.join(failed)}",
+            'checks': snapshot['checks'],
             'timestamp': datetime.utcnow().isoformat()
         }), 503
+    
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.utcnow().isoformat(),
+        'file_count': snapshot['checks']['database'].get('value', 0),
+        'file_cache': file_cache.stats(),
+        'disk_cache': disk_cache.stats() if disk_cache else None,
+        'checked_at': snapshot['checked_at'],
+        'version': '2.5.0'  # Large file support version
+    }), 200
+
+@app.route('/health/live')
+def liveness():
+    """Liveness probe: the worker is serving requests. Does no I/O."""
+    return jsonify({'status': 'alive'}), 200
+
+@app.route('/health/ready')
+def readiness():
+    """Readiness probe: last result of the background database and B2 checks."""
+    snapshot = health_monitor.snapshot()
+    snapshot['status'] = 'ready' if snapshot['healthy'] else 'unready'
+    return jsonify(snapshot), 200 if snapshot['healthy'] else 503
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus metrics, summed across worker processes under gunicorn."""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
     try:
-        if 'file' not in request.files:
+        # Clients that send the SHA-256 up front skip re-sending stored content;
+        # checked before the body is read so it is never parsed
+        client_hash = normalize_sha256(request.headers.get('X-File-SHA256'))
+        if client_hash:
+            existing = find_file_by_hash(client_hash)
+            if existing:
+                logger.info(f"Upload skipped, content already stored: {client_hash[:8]}")
+                return jsonify(upload_response(existing['original_filename'], client_hash,
+                                               existing['file_size'], existing['url'], deduplicated=True))
+        
+        # The body is parsed as it arrives and the file's bytes go straight
+        # into the hash-and-upload pipeline, so B2 transfer overlaps receiving
+        # and nothing is spooled to memory or a temp file first
+        form = StreamingForm(request.stream, request.content_type, request.content_length)
+        if not form.open_file('file'):
             return jsonify({'error': 'No file part'}), 400
-        file = request.files['file']
-        if file.filename == '':
+        if not form.filename:
             return jsonify({'error': 'No selected file'}), 400
         
         # Sanitize filename for security
-        safe_filename = secure_filename(file.filename)
+        safe_filename = secure_filename(form.filename)
         if not safe_filename:
             safe_filename = 'unnamed_file'
         
-        # Check file size before reading
-        file.seek(0, 2)  # Seek to end
-        file_size = file.tell()
-        file.seek(0)  # Reset to beginning
+        # The exact size is only known once the part ends; Content-Length
+        # bounds it, which is all the upload plan needs
+        size_hint = form.size_hint()
+        logger.info(f"Upload attempt: {safe_filename} (up to {format_file_size(size_hint)})")
         
-        logger.info(f"Upload attempt: {safe_filename} ({format_file_size(file_size)})")
-        
-        # Validate file size
-        if file_size == 0:
+        if form.at_eof():
             return jsonify({'error': 'File is empty'}), 400
         
         # Get file metadata
-        mime_type = file.mimetype
+        mime_type = form.content_type or 'application/octet-stream'
         original_filename = safe_filename
         upload_ip = request.remote_addr or 'unknown'
         
-        # Calculate hash using chunked reading (memory efficient)
-        logger.info(f"Calculating hash for {safe_filename}")
-        filehash = calculate_file_hash_chunked(file)
-        
-        # Create S3 key with hash prefix and sanitized filename
-        s3_key = f"{filehash[:8]}_{safe_filename}"
-        
-        logger.info(f"Uploading to B2: {s3_key} (size: {format_file_size(file_size)})")
+        # Hash and upload in a single pass; the key depends on the hash, so
+        # large files go to a temporary key and are renamed once it is known
+        existing = {}
+        
+        def find_existing(filehash):
+            existing['file'] = find_file_by_hash(filehash)
+            return existing['file']['filename'] if existing['file'] else None
+        
+        result = stream_upload(
+            s3,
+            form,
+            B2_BUCKET,
+            lambda filehash: f"{filehash[:8]}_{safe_filename}",
+            file_size=size_hint,
+            part_size=CHUNK_SIZE,
+            threshold=MIN_MULTIPART_SIZE,
+            content_type=mime_type,
+            find_existing=find_existing
+        )
+        form.finish()
+        UPLOAD_STAGE_SECONDS.labels('receive').observe(form.receive_seconds)
+        filehash = result['hash']
+        s3_key = result['key']
+        file_size = result['size']
         
-        # Choose upload method based on file size
-        if file_size > MIN_MULTIPART_SIZE:
-            # Use multipart upload for large files
-            logger.info(f"Using multipart upload for large file ({format_file_size(file_size)})")
-            upload_large_file_multipart(file, B2_BUCKET, s3_key, file_size)
-        else:
-            # Use regular upload for smaller files
-            logger.info(f"Using regular upload for file ({format_file_size(file_size)})")
-            file.seek(0)  # Reset to beginning
-            s3.upload_fileobj(
-                Fileobj=file,
-                Bucket=B2_BUCKET,
-                Key=s3_key
-            )
+        if result['deduplicated']:
+            logger.info(f"File already stored: {original_filename} - Hash: {filehash[:8]}")
+            return jsonify(upload_response(original_filename, filehash, file_size,
+                                           existing['file']['url'], deduplicated=True))
         
         logger.info(f"B2 upload successful: {s3_key}")
         
-        # Construct public URL - using the correct B2 format
-        # For B2, the public URL format is: https://fNNN.backblazeb2.com/file/BUCKET_NAME/KEY
-        # Extract the file number from endpoint (e.g., f005 from s3.us-east-005.backblazeb2.com)
-        if B2_ENDPOINT:
-            match = re.search(r's3\.(.+?)\.backblazeb2\.com', B2_ENDPOINT)
-            if match:
-                region = match.group(1)
-                # Convert us-east-005 to f005 (keep the leading zeros!)
-                file_num = 'f' + region.split('-')[-1]
-                url = f"https://{file_num}.backblazeb2.com/file/{B2_BUCKET}/{s3_key}"
-            else:
-                # Fallback to constructed URL
-                url = f"{B2_ENDPOINT}/{B2_BUCKET}/{s3_key}"
-        else:
-            url = f"https://f005.backblazeb2.com/file/{B2_BUCKET}/{s3_key}"
-        
-        # Store metadata
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('''INSERT INTO files 
-                    (filename, original_filename, filehash, file_size, mime_type, url, upload_ip) 
-                    VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                  (s3_key, original_filename, filehash, file_size, mime_type, url, upload_ip))
-        conn.commit()
-        conn.close()
+        url = build_public_url(s3_key)
+        store_file_metadata(s3_key, original_filename, filehash, file_size, mime_type, url, upload_ip)
         
         logger.info(f"File uploaded successfully: {original_filename} ({format_file_size(file_size)}) - Hash: {filehash[:8]}")
         
-        return jsonify({
-            'filename': original_filename, 
-            'hash': filehash,
-            'hash_short': filehash[:8],
-            'size': format_file_size(file_size),
-            'url': url,
-            'info_url': f"/f/{filehash[:8]}"
-        })
+        return jsonify(upload_response(original_filename, filehash, file_size, url))
+    except FormStreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         logger.error(f"Upload failed for {safe_filename if 'safe_filename' in locals() else 'unknown'}: {str(e)}")
         logger.exception("Full traceback:")
         return jsonify({'error': f'Upload failed: {str(e)}'}), 500
 
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch_files():
+    """Upload many files in one request and return a manifest with a result per file.
+    
+    The body is multipart/form-data with any number of file parts, or a
+    (optionally compressed) tar stream. Files are hashed and sent to B2 by
+    a pool of workers while the rest of the body is read, and the metadata
+    rows of the whole batch are inserted in one transaction.
+    """
+    try:
+        form = None
+        if request.mimetype in TAR_MIMETYPES:
+            files = iter_tar_files(request.stream)
+        else:
+            form = StreamingForm(request.stream, request.content_type, request.content_length)
+            files = iter_form_files(form)
+        upload_ip = request.remote_addr or 'unknown'
+        
+        def find_existing(filehash):
+            existing = find_file_by_hash(filehash)
+            return existing['filename'] if existing else None
+        
+        results, error = upload_batch(s3, files, B2_BUCKET, find_existing=find_existing)
+        if form is not None:
+            UPLOAD_STAGE_SECONDS.labels('receive').observe(form.receive_seconds)
+        if not results and not error:
+            return jsonify({'error': 'No files in batch'}), 400
+        
+        manifest = []
+        rows = []
+        counts = {'uploaded': 0, 'deduplicated': 0, 'failed': 0}
+        for entry in results:
+            upload = entry.get('upload')
+            if upload is None:
+                item = {'status': 'failed', 'error': entry['error']}
+            else:
+                url = build_public_url(upload['key'])
+                item = upload_response(entry['filename'], upload['hash'], upload['size'], url,
+                                       deduplicated=upload['deduplicated'])
+                item['status'] = 'deduplicated' if upload['deduplicated'] else 'uploaded'
+                if not upload['deduplicated']:
+                    rows.append((upload['key'], entry['filename'], upload['hash'], upload['size'],
+                                 entry['content_type'], url, upload_ip))
+            item['name'] = entry['name']
+            counts[item['status']] += 1
+            manifest.append(item)
+        
+        # Files already in B2 are recorded even when the body broke off later
+        store_batch_metadata(rows)
+        
+        logger.info(f"Batch upload: {counts['uploaded']} uploaded, {counts['deduplicated']} deduplicated, "
+                    f"{counts['failed']} failed")
+        body = dict(counts, files=manifest)
+        if error:
+            body['error'] = str(error)
+            return jsonify(body), error.status_code
+        return jsonify(body), 207 if counts['failed'] else 200
+    except FormStreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        logger.error(f"Batch upload failed: {str(e)}")
+        logger.exception("Full traceback:")
+        return jsonify({'error': f'Batch upload failed: {str(e)}'}), 500
+
+def session_response(session):
+    """JSON description of a resumable upload session."""
+    return {
+        'session_id': session['id'],
+        'filename': session['filename'],
+        'file_size': session['file_size'],
+        'part_size': session['part_size'],
+        'part_count': session['part_count'],
+        'status': session['status'],
+        'completed_parts': [part['part_number'] for part in session.get('parts', [])],
+        'bytes_received': session.get('bytes_received', 0),
+        'parts_url': f"/upload/sessions/{session['id']}/parts",
+        'complete_url': f"/upload/sessions/{session['id']}/complete"
+    }
+
+@app.route('/upload/preflight')
+def upload_preflight():
+    """Tell a client whether content with this SHA-256 and size is already stored."""
+    filehash = normalize_sha256(request.args.get('sha256'))
+    if not filehash:
+        return jsonify({'error': 'sha256 must be a 64-character hex digest'}), 400
+    file_size = request.args.get('size', type=int)
+    
+    existing = find_file_by_hash(filehash)
+    if existing and (file_size is None or existing['file_size'] == file_size):
+        response = upload_response(existing['original_filename'], filehash, existing['file_size'],
+                                   existing['url'], deduplicated=True)
+        response['exists'] = True
+        return jsonify(response)
+    return jsonify({'exists': False, 'hash': filehash})
+
+@app.route('/upload/sessions', methods=['POST'])
+def create_upload_session():
+    """Start a resumable upload; the client then PUTs each part separately."""
+    data = request.get_json(silent=True) or {}
+    safe_filename = secure_filename(data.get('filename') or '') or 'unnamed_file'
+    try:
+        file_size = int(data.get('size') or 0)
+        
+        # Known content needs no session at all
+        client_hash = normalize_sha256(data.get('sha256'))
+        existing = find_file_by_hash(client_hash) if client_hash else None
+        if existing and existing['file_size'] == file_size:
+            logger.info(f"Upload skipped, content already stored: {client_hash[:8]}")
+            response = upload_response(safe_filename, client_hash, file_size, existing['url'], deduplicated=True)
+            response['status'] = 'complete'
+            return jsonify(response)
+        
+        session = upload_sessions.create_session(
+            DB_PATH, s3, B2_BUCKET, safe_filename, file_size,
+            mime_type=data.get('mime_type') or 'application/octet-stream',
+            upload_ip=request.remote_addr or 'unknown'
+        )
+        return jsonify(session_response(session)), 201
+    except (UploadSessionError, ValueError) as e:
+        return jsonify({'error': str(e)}), getattr(e, 'status_code', 400)
+    except Exception as e:
+        logger.error(f"Failed to create upload session for {safe_filename}: {e}")
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+
+@app.route('/upload/sessions/<session_id>', methods=['GET'])
+def get_upload_session(session_id):
+    """Report which parts of a session have been stored, so clients can resume."""
+    try:
+        return jsonify(session_response(upload_sessions.get_session(DB_PATH, session_id)))
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status_code
+
+@app.route('/upload/sessions/<session_id>/parts/<int:part_number>', methods=['PUT'])
+def put_upload_part(session_id, part_number):
+    """Receive one part as the raw request body and forward it to B2."""
+    try:
+        part = upload_sessions.upload_part(DB_PATH, s3, B2_BUCKET, session_id, part_number, request.stream)
+        return jsonify(part)
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        logger.error(f"Failed to upload part {part_number} of session {session_id}: {e}")
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+
+@app.route('/upload/sessions/<session_id>/complete', methods=['POST'])
+def complete_upload_session(session_id):
+    """Assemble all parts and register the file, as /upload does."""
+    try:
+        session = upload_sessions.get_session(DB_PATH, session_id)
+        safe_filename = session['filename']
+        existing = {}
+        
+        def find_existing(filehash):
+            existing['file'] = find_file_by_hash(filehash)
+            return existing['file']['filename'] if existing['file'] else None
+        
+        result = upload_sessions.complete_session(
+            DB_PATH, s3, B2_BUCKET, session_id,
+            lambda filehash: f"{filehash[:8]}_{safe_filename}",
+            find_existing=find_existing
+        )
+        if result['deduplicated']:
+            return jsonify(upload_response(safe_filename, result['hash'], result['size'],
+                                           existing['file']['url'], deduplicated=True))
+        
+        url = build_public_url(result['key'])
+        if not result['already_completed']:
+            store_file_metadata(result['key'], safe_filename, result['hash'], result['size'],
+                                session['mime_type'], url, session['upload_ip'])
+            logger.info(f"File uploaded successfully: {safe_filename} ({format_file_size(result['size'])}) - Hash: {result['hash'][:8]}")
+        return jsonify(upload_response(safe_filename, result['hash'], result['size'], url))
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        logger.error(f"Failed to complete upload session {session_id}: {e}")
+        logger.exception("Full traceback:")
+        return jsonify({'error': f'Upload failed: {str(e)}'}), 500
+
+@app.route('/upload/sessions/<session_id>', methods=['DELETE'])
+def abort_upload_session(session_id):
+    """Cancel a session and discard the parts stored so far."""
+    try:
+        upload_sessions.abort_session(DB_PATH, s3, B2_BUCKET, session_id)
+        return jsonify({'session_id': session_id, 'status': 'aborted'})
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status_code
+
 @app.route('/files')
 def list_files():
-    """List recent files with full metadata."""
+    """List recent files with full metadata, one keyset page at a time."""
+    limit = page_size(request.args.get('limit'))
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('''SELECT filename, original_filename, filehash, file_size, 
-                            mime_type, created_at, download_count 
-                     FROM files 
-                     ORDER BY created_at DESC 
-                     LIMIT 50''')
+        rows, next_cursor = fetch_page(DB_PATH, 'files',
+                                       '''filename, original_filename, filehash, file_size, 
+                                          mime_type, created_at, download_count''',
+                                       'created_at', request.args.get('cursor'), limit)
         
         files = []
-        for row in c.fetchall():
+        for row in rows:
             files.append({
                 'filename': row[0],
                 'original_filename': row[1] or row[0],
@@ -392,18 +594,17 @@ def list_files():
                 'size': format_file_size(row[3]) if row[3] else 'Unknown',
                 'mime_type': row[4] or 'application/octet-stream',
                 'created_at': row[5],
-                'download_count': row[6] or 0,
+                'download_count': download_counter.live_count(row[2], row[6]),
                 'info_url': f"/f/{row[2][:8]}" if row[2] else ''
             })
         
-        conn.close()
-        
         # Check if this is an API request (Accept: application/json)
         if request.headers.get('Accept') == 'application/json' or request.path.endswith('.json'):
             response = jsonify({
                 'files': files,
                 'count': len(files),
-                'limit': 50
+                'limit': limit,
+                'next_cursor': next_cursor
             })
             
             # Add rate limit headers (informational)
@@ -414,8 +615,10 @@ def list_files():
             return response
         else:
             # Return HTML template for browser requests
-            return render_template('files.html', files=files)
+            return render_template('files.html', files=files, next_cursor=next_cursor, limit=limit)
             
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error listing files: {e}")
         if request.headers.get('Accept') == 'application/json':
@@ -423,41 +626,86 @@ def list_files():
         else:
             return render_template('files.html', files=[], error='Failed to load files')
 
+@app.route('/files/export')
+def export_files():
+    """Stream every file's metadata as NDJSON (default) or a JSON array."""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'json'):
+        return jsonify({'error': 'format must be ndjson or json'}), 400
+    
+    def records():
+        for row in iter_rows(DB_PATH, 'files',
+                             '''filename, original_filename, filehash, file_size, mime_type, 
+                                url, created_at, download_count''',
+                             'created_at'):
+            yield {
+                'filename': row[0],
+                'original_filename': row[1] or row[0],
+                'hash': row[2],
+                'size': row[3],
+                'mime_type': row[4],
+                'url': row[5],
+                'created_at': row[6],
+                'download_count': download_counter.live_count(row[2], row[7])
+            }
+    
+    if fmt == 'json':
+        return Response(json_array(records()), mimetype='application/json')
+    return Response(ndjson_lines(records()), mimetype='application/x-ndjson')
+
+@app.route('/raw/<filehash>', methods=['GET', 'HEAD'])
+def raw_file(filehash):
+    """Stream file content through the app, with Range and If-None-Match support."""
+    # Only a full hash is accepted: a prefix could later match a second
+    # file, which would break the immutable caching below
+    filehash = normalize_sha256(filehash)
+    if not filehash:
+        return jsonify({'error': 'A full SHA-256 hash is required'}), 400
+    
+    try:
+        stored = find_file_by_hash(filehash)
+        if not stored:
+            return jsonify({'error': 'File not found'}), 404
+        
+        return cached_object_response(disk_cache, s3, B2_BUCKET, stored['filename'], filehash, stored['file_size'],
+                                      request, content_type=stored['mime_type'], filename=stored['original_filename'])
+    except Exception as e:
+        logger.error(f"Error streaming file {filehash}: {e}")
+        return jsonify({'error': 'Failed to stream file'}), 500
+
 @app.route('/f/<hash_prefix>')
 def get_file_by_hash(hash_prefix):
     """Retrieve file by hash prefix (minimum 8 characters)."""
     if len(hash_prefix) < 8:
         return jsonify({'error': 'Hash prefix must be at least 8 characters'}), 400
     
+    key = hash_prefix.lower()
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        # Find files matching the hash prefix
-        c.execute('''SELECT filename, original_filename, filehash, file_size, mime_type, url, created_at 
-                    FROM files WHERE filehash LIKE ? ORDER BY created_at DESC''', 
-                    (hash_prefix + '%',))
-        
-        results = c.fetchall()
-        
-        if not results:
-            conn.close()
-            return render_template('file_not_found.html', hash_prefix=hash_prefix)
+        # Cached rows are shared between requests, so they are kept as a tuple
+        results = file_cache.get(key)
+        if results is None:
+            # Find files matching the hash prefix (an index range scan on idx_filehash)
+            with db.cursor(DB_PATH) as c:
+                c.execute('''SELECT filename, original_filename, filehash, file_size, mime_type, url, created_at, download_count 
+                            FROM files WHERE filehash >= ? AND filehash < ? ORDER BY created_at DESC''', 
+                            db.prefix_range(key))
+                results = c.fetchall()
+            
+            if not results:
+                return render_template('file_not_found.html', hash_prefix=hash_prefix)
+            
+            results = tuple(results)
+            file_cache.set(key, results)
+            if len(results) == 1:
+                file_cache.set(results[0][2], results)
         
         if len(results) == 1:
             # Single match - show file info page
             file_data = results[0]
             
-            # Increment download count
-            c.execute('UPDATE files SET download_count = download_count + 1 WHERE filehash = ?', 
-                     (file_data[2],))
-            conn.commit()
-            
-            # Get updated download count
-            c.execute('SELECT download_count FROM files WHERE filehash = ?', (file_data[2],))
-            download_count = c.fetchone()[0] or 0
-            
-            conn.close()
+            # Increment download count; the write is batched in the background
+            pending = download_counter.increment(file_data[2])
+            download_count = (file_data[7] or 0) + pending
             
             return render_template('file_info.html', 
                 filename=file_data[0],
@@ -472,7 +720,6 @@ def get_file_by_hash(hash_prefix):
             )
         else:
             # Multiple matches - show disambiguation page
-            conn.close()
             return render_template('disambiguation.html', hash_prefix=hash_prefix, files=results)
             
     except Exception as e:
@@ -488,17 +735,29 @@ def search_files():
         return render_template('search.html', query='', results=[], total=0)
     
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        # Search in both filename and hash
-        search_pattern = f'%{query}%'
-        c.execute('''SELECT filename, original_filename, filehash, file_size, url, created_at, download_count
-                    FROM files 
-                    WHERE original_filename LIKE ? OR filehash LIKE ? OR filename LIKE ?
-                    ORDER BY created_at DESC
-                    LIMIT 50''', 
-                    (search_pattern, search_pattern, search_pattern))
+        rows = []
+        with db.cursor(DB_PATH) as c:
+            # Hash-like queries use the hash index
+            if is_hash_query(query):
+                c.execute('''SELECT filename, original_filename, filehash, file_size, url, created_at, download_count
+                            FROM files 
+                            WHERE filehash >= ? AND filehash < ?
+                            ORDER BY created_at DESC
+                            LIMIT 50''', 
+                            db.prefix_range(query.lower()))
+                rows = c.fetchall()
+            
+            # Otherwise (or if no hash matched) rank filename matches with bm25
+            match = match_expression(query)
+            if not rows and match:
+                c.execute('''SELECT f.filename, f.original_filename, f.filehash, f.file_size, f.url, f.created_at, f.download_count
+                            FROM files_fts
+                            JOIN files f ON f.id = files_fts.rowid
+                            WHERE files_fts MATCH ?
+                            ORDER BY bm25(files_fts, 10.0, 1.0)
+                            LIMIT 50''', 
+                            (match,))
+                rows = c.fetchall()
         
         results = [{
             'filename': row[0],
@@ -508,10 +767,8 @@ def search_files():
             'file_size': format_file_size(row[3]) if row[3] else 'Unknown',
             'url': row[4],
             'created_at': row[5],
-            'download_count': row[6] or 0
-        } for row in c.fetchall()]
-        
-        conn.close()
+            'download_count': download_counter.live_count(row[2], row[6])
+        } for row in rows]
         
         return render_template('search.html', 
                              query=query, 
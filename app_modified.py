@@ -1,17 +1,24 @@
 import os
-import hashlib
-import sqlite3
 import logging
 import re
 from flask import Flask, request, jsonify, render_template_string, render_template, Response, url_for, send_from_directory
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from boto3.session import Session
 from dotenv import load_dotenv
-from io import BytesIO
 from datetime import datetime
-import openai
 import json
+import db
+from pagination import fetch_page, iter_rows, page_size, ndjson_lines, InvalidCursor
+from presigned import PresignedUrlCache
+from tagging import TaggingQueue, init_tagging_jobs, openai_tagger
+from search_index import init_fts, is_hash_query, match_expression
+from upload_pipeline import stream_upload, normalize_sha256, format_file_size, UPLOAD_WORKERS
+import upload_sessions
+from upload_sessions import init_upload_sessions, UploadSessionError
+from form_stream import StreamingForm, FormStreamError
+from clients import LazyClient, b2_client
+import metrics
+from metrics import UPLOAD_STAGE_SECONDS
 
 # Configure logging
 logging.basicConfig(
@@ -25,163 +32,38 @@ load_dotenv()
 
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor'])
 
 # Configuration
 BUCKET_NAME = os.getenv('B2_BUCKET', 'my-uploads')
-CHUNK_SIZE = 100 * 1024 * 1024  # 100MB chunks
 UPLOAD_FOLDER = 'uploads'
 DATABASE = 'uploads.db'
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx', 'xls', 'xlsx', 'zip', 'mp4', 'mov', 'avi'}
 
-# Initialize OpenAI client for AI tagging
-if os.getenv('OPENAI_API_KEY'):
+def create_openai_client():
+    """Build the OpenAI client; the SDK is imported here as it is slow to load."""
     from openai import OpenAI
-    openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-
-# Initialize B2 client
-session = Session()
-s3 = session.client(
-    service_name='s3',
-    endpoint_url=os.getenv('B2_ENDPOINT'),
-    aws_access_key_id=os.getenv('B2_KEY_ID'),
-    aws_secret_access_key=os.getenv('B2_APPLICATION_KEY'),
-    config=None
-)
+    return OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
-# Helper functions
-def format_file_size(size_bytes):
-    """Format file size in human readable format."""
-    if size_bytes is None:
-        return "Unknown"
-    
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-        if size_bytes < 1024.0:
-            return f"{size_bytes:.1f} {unit}"
-        size_bytes /= 1024.0
-    return f"{size_bytes:.1f} PB"
-
-def calculate_file_hash_chunked(file_obj, chunk_size=8192):
-    """Calculate SHA256 hash of a file using chunked reading to save memory."""
-    hasher = hashlib.sha256()
-    file_obj.seek(0)
-    
-    while True:
-        chunk = file_obj.read(chunk_size)
-        if not chunk:
-            break
-        hasher.update(chunk)
-    
-    file_obj.seek(0)  # Reset file pointer
-    return hasher.hexdigest()
+# OpenAI client for AI tagging, built when the first job runs
+openai_client = LazyClient(create_openai_client) if os.getenv('OPENAI_API_KEY') else None
 
-def generate_ai_tags(description, filename):
-    """Generate AI tags based on file description and name."""
-    if not os.getenv('OPENAI_API_KEY') or not description:
-        return []
-    
-    try:
-        prompt = f"""Given this file description and filename, generate 5-8 relevant tags that would help categorize and find this file later.
+# B2 client, built on the first request that talks to B2
+s3 = LazyClient(lambda: b2_client(os.getenv('B2_ENDPOINT'), os.getenv('B2_KEY_ID'),
+                                  os.getenv('B2_APPLICATION_KEY'),
+                                  max_pool_connections=max(10, UPLOAD_WORKERS * 2)))
 
-Filename: {filename}
-Description: {description}
+# Signed download URLs are reused while most of their lifetime remains
+presigned_urls = PresignedUrlCache(s3, BUCKET_NAME)
 
-Return only the tags as a JSON array of strings, nothing else."""
+# Most URLs a single bulk-sign request may ask for
+MAX_BULK_SIGN = 200
 
-        response = openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that generates relevant tags for files."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=100
-        )
-        
-        tags_text = response.choices[0].message.content.strip()
-        tags = json.loads(tags_text)
-        return tags[:8]  # Limit to 8 tags
-    except Exception as e:
-        logger.error(f"Error generating AI tags: {e}")
-        return []
+# Bump whenever create_schema changes so existing databases are migrated
+SCHEMA_VERSION = 1
 
-def upload_large_file_multipart(file_obj, bucket, key, file_size):
-    """Upload large files using B2's multipart upload API."""
-    try:
-        # Initialize multipart upload
-        response = s3.create_multipart_upload(
-            Bucket=bucket,
-            Key=key
-        )
-        upload_id = response['UploadId']
-        logger.info(f"Started multipart upload: {upload_id}")
-        
-        # Upload parts
-        parts = []
-        part_number = 1
-        bytes_uploaded = 0
-        
-        file_obj.seek(0)
-        
-        while bytes_uploaded < file_size:
-            # Calculate part size (last part might be smaller)
-            remaining = file_size - bytes_uploaded
-            part_size = min(CHUNK_SIZE, remaining)
-            
-            # Read chunk
-            chunk_data = file_obj.read(part_size)
-            
-            logger.info(f"Uploading part {part_number} ({format_file_size(part_size)})")
-            
-            # Upload part
-            response = s3.upload_part(
-                Bucket=bucket,
-                Key=key,
-                PartNumber=part_number,
-                UploadId=upload_id,
-                Body=chunk_data
-            )
-            
-            parts.append({
-                'PartNumber': part_number,
-                'ETag': response['ETag']
-            })
-            
-            bytes_uploaded += part_size
-            part_number += 1
-            
-            # Log progress
-            progress = (bytes_uploaded / file_size) * 100
-            logger.info(f"Upload progress: {progress:.1f}% ({format_file_size(bytes_uploaded)}/{format_file_size(file_size)})")
-        
-        # Complete multipart upload
-        response = s3.complete_multipart_upload(
-            Bucket=bucket,
-            Key=key,
-            UploadId=upload_id,
-            MultipartUpload={'Parts': parts}
-        )
-        
-        logger.info(f"Multipart upload completed: {key}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Multipart upload error: {e}")
-        # Abort the upload if it fails
-        try:
-            s3.abort_multipart_upload(
-                Bucket=bucket,
-                Key=key,
-                UploadId=upload_id
-            )
-        except:
-            pass
-        raise e
-
-def init_db():
-    """Initialize the database."""
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
+def create_schema(c):
+    """Create all tables and indexes using an open cursor."""
     c.execute('''CREATE TABLE IF NOT EXISTS uploads
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
                   hash TEXT UNIQUE NOT NULL,
@@ -192,31 +74,63 @@ def init_db():
                   description TEXT,
                   tags TEXT,
                   b2_file_id TEXT)''')
-    conn.commit()
-    conn.close()
+    init_upload_sessions(c)
+    init_fts(c, 'uploads', ['filename', 'description', 'tags'])
+    init_tagging_jobs(c)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_uploads_upload_date ON uploads(upload_date, id)')
+
+def init_db():
+    """Initialize the database, skipped once the schema is at SCHEMA_VERSION."""
+    db.migrate(DATABASE, 'app_modified', SCHEMA_VERSION, create_schema)
 
 def save_file_metadata(file_hash, filename, size, content_type, description=None, tags=None, b2_file_id=None):
     """Save file metadata to database."""
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    
     # Convert tags list to JSON string
     tags_json = json.dumps(tags) if tags else '[]'
     
-    c.execute('''INSERT OR REPLACE INTO uploads 
-                 (hash, filename, size, upload_date, content_type, description, tags, b2_file_id)
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-              (file_hash, filename, size, datetime.now().isoformat(), content_type, description, tags_json, b2_file_id))
-    conn.commit()
-    conn.close()
+    # An upsert rather than INSERT OR REPLACE: REPLACE deletes the old row
+    # without firing the delete trigger that keeps uploads_fts in sync
+    with UPLOAD_STAGE_SECONDS.labels('db_write').time(), db.cursor(DATABASE) as c:
+        c.execute('''INSERT INTO uploads 
+                     (hash, filename, size, upload_date, content_type, description, tags, b2_file_id)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                     ON CONFLICT(hash) DO UPDATE SET
+                       filename = excluded.filename, size = excluded.size, upload_date = excluded.upload_date,
+                       content_type = excluded.content_type, description = excluded.description,
+                       tags = excluded.tags, b2_file_id = excluded.b2_file_id''',
+                  (file_hash, filename, size, datetime.now().isoformat(), content_type, description, tags_json, b2_file_id))
+
+def object_key(file_hash, filename):
+    """B2 object key for an upload."""
+    return f"{file_hash}/{secure_filename(filename)}"
+
+def get_files_metadata(file_hashes):
+    """Get {hash: (filename, size)} for many hashes in one query."""
+    if not file_hashes:
+        return {}
+    placeholders = ', '.join('?' * len(file_hashes))
+    with db.cursor(DATABASE) as c:
+        c.execute(f'SELECT hash, filename, size FROM uploads WHERE hash IN ({placeholders})', list(file_hashes))
+        rows = c.fetchall()
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+def set_file_tags(file_hash, tags):
+    """Store AI tags for an upload once its tagging job finishes."""
+    with db.cursor(DATABASE) as c:
+        c.execute('UPDATE uploads SET tags = ? WHERE hash = ?', (json.dumps(tags), file_hash))
+
+def queue_tagging(file_hash, filename, description):
+    """Queue AI tagging for a new upload; returns the tagging status for the response."""
+    if not tagging_queue or not description:
+        return 'skipped'
+    tagging_queue.enqueue(file_hash, filename, description)
+    return 'pending'
 
 def get_file_metadata(file_hash):
     """Get file metadata from database."""
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute('SELECT * FROM uploads WHERE hash = ?', (file_hash,))
-    row = c.fetchone()
-    conn.close()
+    with db.cursor(DATABASE) as c:
+        c.execute('SELECT * FROM uploads WHERE hash = ?', (file_hash,))
+        row = c.fetchone()
     
     if row:
         return {
@@ -232,28 +146,59 @@ def get_file_metadata(file_hash):
         }
     return None
 
-def get_recent_uploads(limit=10):
-    """Get recent uploads from database."""
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute('''SELECT hash, filename, size, upload_date, description, tags 
-                 FROM uploads 
-                 ORDER BY upload_date DESC 
-                 LIMIT ?''', (limit,))
-    rows = c.fetchall()
-    conn.close()
+UPLOAD_LIST_COLUMNS = 'hash, filename, size, upload_date, description, tags'
+
+def upload_summary(row):
+    """Listing entry for a row selected with UPLOAD_LIST_COLUMNS."""
+    return {
+        'hash': row[0],
+        'filename': row[1],
+        'size': row[2],
+        'upload_date': row[3],
+        'description': row[4],
+        'tags': json.loads(row[5]) if row[5] else []
+    }
+
+def get_recent_uploads(limit=10, cursor=None):
+    """Get a page of recent uploads and the cursor for the next page."""
+    rows, next_cursor = fetch_page(DATABASE, 'uploads', UPLOAD_LIST_COLUMNS, 'upload_date', cursor, limit)
+    return [upload_summary(row) for row in rows], next_cursor
+
+def search_uploads(query, limit=20):
+    """Search uploads by hash prefix, or by filename, description and tags."""
+    rows = []
+    with db.cursor(DATABASE) as c:
+        if is_hash_query(query):
+            c.execute(f'''SELECT {UPLOAD_LIST_COLUMNS} 
+                         FROM uploads 
+                         WHERE hash >= ? AND hash < ?
+                         LIMIT ?''', (*db.prefix_range(query.lower()), limit))
+            rows = c.fetchall()
+        
+        match = match_expression(query)
+        if not rows and match:
+            c.execute('''SELECT u.hash, u.filename, u.size, u.upload_date, u.description, u.tags 
+                         FROM uploads_fts
+                         JOIN uploads u ON u.id = uploads_fts.rowid
+                         WHERE uploads_fts MATCH ?
+                         ORDER BY bm25(uploads_fts, 10.0, 2.0, 5.0)
+                         LIMIT ?''', (match, limit))
+            rows = c.fetchall()
     
-    uploads = []
-    for row in rows:
-        uploads.append({
-            'hash': row[0],
-            'filename': row[1],
-            'size': row[2],
-            'upload_date': row[3],
-            'description': row[4],
-            'tags': json.loads(row[5]) if row[5] else []
-        })
-    return uploads
+    return [upload_summary(row) for row in rows]
+
+def existing_file_response(file_hash, existing):
+    """Upload response for content that is already stored."""
+    return {
+        'success': True,
+        'hash': file_hash,
+        'filename': existing['filename'],
+        'size': format_file_size(existing['size']),
+        'tags': existing['tags'],
+        'message': 'File already exists',
+        'shareUrl': f"/f/{file_hash[:8]}",
+        'deduplicated': True
+    }
 
 @app.route('/')
 def index():
@@ -275,89 +220,217 @@ def serve_static(path):
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
     """Handle file upload with AI tagging."""
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
-    
-    file = request.files['file']
-    description = request.form.get('description', '')
-    
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-    
-    # Read file into memory
-    file_data = BytesIO(file.read())
-    file_size = file_data.tell()
-    file_data.seek(0)
-    
-    # Calculate hash
-    file_hash = calculate_file_hash_chunked(file_data)
-    logger.info(f"File hash: {file_hash}, Size: {format_file_size(file_size)}")
-    
-    # Check if file already exists
-    existing = get_file_metadata(file_hash)
+    # Clients that send the SHA-256 up front skip re-sending stored content;
+    # checked before the body is read so it is never parsed
+    client_hash = normalize_sha256(request.headers.get('X-File-SHA256'))
+    existing = get_file_metadata(client_hash) if client_hash else None
     if existing:
+        logger.info(f"Upload skipped, content already stored: {client_hash[:8]}")
+        return jsonify(existing_file_response(client_hash, existing))
+    
+    try:
+        # The file's bytes go from the request body straight into the upload
+        # pipeline as they arrive, without spooling to memory or a temp file
+        form = StreamingForm(request.stream, request.content_type, request.content_length)
+        if not form.open_file('file'):
+            return jsonify({'error': 'No file part'}), 400
+        if not form.filename:
+            return jsonify({'error': 'No selected file'}), 400
+        filename = form.filename
+        content_type = form.content_type or 'application/octet-stream'
+        
+        # Hash and upload in one pass with at most a few parts in memory;
+        # stored content is detected from the hash and not uploaded again
+        existing = {}
+        
+        def find_existing(file_hash):
+            existing['metadata'] = get_file_metadata(file_hash)
+            if existing['metadata']:
+                return object_key(file_hash, existing['metadata']['filename'])
+            return None
+        
+        # Content-Length bounds the file's size, which is all the plan needs
+        result = stream_upload(
+            s3,
+            form,
+            BUCKET_NAME,
+            lambda file_hash: object_key(file_hash, filename),
+            file_size=form.size_hint(),
+            content_type=content_type,
+            find_existing=find_existing
+        )
+        # The description may follow the file in the body
+        description = form.finish().get('description', '')
+        UPLOAD_STAGE_SECONDS.labels('receive').observe(form.receive_seconds)
+        file_hash = result['hash']
+        logger.info(f"File hash: {file_hash}, Size: {format_file_size(result['size'])}")
+        
+        if result['deduplicated']:
+            return jsonify(existing_file_response(file_hash, existing['metadata']))
+        
+        # Save metadata; AI tags are filled in by the tagging queue
+        save_file_metadata(
+            file_hash,
+            filename,
+            result['size'],
+            content_type,
+            description
+        )
+        tagging = queue_tagging(file_hash, filename, description)
+        
         return jsonify({
             'success': True,
             'hash': file_hash,
-            'filename': existing['filename'],
-            'size': format_file_size(existing['size']),
-            'tags': existing['tags'],
-            'message': 'File already exists',
+            'filename': filename,
+            'size': format_file_size(result['size']),
+            'tags': [],
+            'tagging': tagging,
             'shareUrl': f"/f/{file_hash[:8]}"
         })
+        
+    except FormStreamError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        logger.error(f"Upload error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def session_response(session):
+    """JSON description of a resumable upload session."""
+    return {
+        'sessionId': session['id'],
+        'filename': session['filename'],
+        'fileSize': session['file_size'],
+        'partSize': session['part_size'],
+        'partCount': session['part_count'],
+        'status': session['status'],
+        'completedParts': [part['part_number'] for part in session.get('parts', [])],
+        'bytesReceived': session.get('bytes_received', 0)
+    }
+
+@app.route('/api/upload/preflight')
+def upload_preflight():
+    """Tell a client whether content with this SHA-256 and size is already stored."""
+    file_hash = normalize_sha256(request.args.get('sha256'))
+    if not file_hash:
+        return jsonify({'error': 'sha256 must be a 64-character hex digest'}), 400
+    size = request.args.get('size', type=int)
     
-    # Generate AI tags
-    tags = generate_ai_tags(description, file.filename)
+    existing = get_file_metadata(file_hash)
+    if existing and (size is None or existing['size'] == size):
+        response = existing_file_response(file_hash, existing)
+        response['exists'] = True
+        return jsonify(response)
+    return jsonify({'exists': False, 'hash': file_hash})
+
+@app.route('/api/upload/sessions', methods=['POST'])
+def create_upload_session():
+    """Start a resumable upload; the client then PUTs each part separately."""
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename') or ''
+    if not filename:
+        return jsonify({'error': 'No selected file'}), 400
     
-    # Upload to B2
     try:
-        key = f"{file_hash}/{secure_filename(file.filename)}"
+        # Known content needs no session at all
+        client_hash = normalize_sha256(data.get('sha256'))
+        existing = get_file_metadata(client_hash) if client_hash else None
+        if existing:
+            logger.info(f"Upload skipped, content already stored: {client_hash[:8]}")
+            response = existing_file_response(client_hash, existing)
+            response['status'] = 'complete'
+            return jsonify(response)
         
-        if file_size > CHUNK_SIZE:
-            # Use multipart upload for large files
-            logger.info(f"Using multipart upload for large file: {format_file_size(file_size)}")
-            upload_large_file_multipart(file_data, BUCKET_NAME, key, file_size)
-        else:
-            # Use simple upload for smaller files
-            s3.put_object(
-                Bucket=BUCKET_NAME,
-                Key=key,
-                Body=file_data.getvalue(),
-                ContentType=file.content_type or 'application/octet-stream'
-            )
-        
-        # Save metadata
-        save_file_metadata(
-            file_hash,
-            file.filename,
-            file_size,
-            file.content_type,
-            description,
-            tags
+        session = upload_sessions.create_session(
+            DATABASE, s3, BUCKET_NAME, filename, int(data.get('size') or 0),
+            mime_type=data.get('contentType') or 'application/octet-stream',
+            description=data.get('description', ''),
+            upload_ip=request.remote_addr
+        )
+        return jsonify(session_response(session)), 201
+    except (UploadSessionError, ValueError) as e:
+        return jsonify({'error': str(e)}), getattr(e, 'status_code', 400)
+    except Exception as e:
+        logger.error(f"Upload session error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload/sessions/<session_id>', methods=['GET'])
+def get_upload_session(session_id):
+    """Report which parts of a session have been stored, so clients can resume."""
+    try:
+        return jsonify(session_response(upload_sessions.get_session(DATABASE, session_id)))
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status_code
+
+@app.route('/api/upload/sessions/<session_id>/parts/<int:part_number>', methods=['PUT'])
+def put_upload_part(session_id, part_number):
+    """Receive one part as the raw request body and forward it to B2."""
+    try:
+        part = upload_sessions.upload_part(DATABASE, s3, BUCKET_NAME, session_id, part_number, request.stream)
+        return jsonify(part)
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status_code
+    except Exception as e:
+        logger.error(f"Upload part error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload/sessions/<session_id>/complete', methods=['POST'])
+def complete_upload_session(session_id):
+    """Assemble all parts, tag the file and save its metadata."""
+    try:
+        session = upload_sessions.get_session(DATABASE, session_id)
+        filename = session['filename']
+        existing = {}
+
+        def find_existing(file_hash):
+            existing['metadata'] = get_file_metadata(file_hash)
+            if existing['metadata']:
+                return object_key(file_hash, existing['metadata']['filename'])
+            return None
+
+        result = upload_sessions.complete_session(
+            DATABASE, s3, BUCKET_NAME, session_id,
+            lambda file_hash: object_key(file_hash, filename),
+            find_existing=find_existing
         )
+        file_hash = result['hash']
+        if result['deduplicated'] or result['already_completed']:
+            metadata = existing.get('metadata') or get_file_metadata(file_hash)
+            return jsonify(existing_file_response(file_hash, metadata))
+
+        save_file_metadata(file_hash, filename, result['size'], session['mime_type'], session['description'])
+        tagging = queue_tagging(file_hash, filename, session['description'])
         
         return jsonify({
             'success': True,
             'hash': file_hash,
-            'filename': file.filename,
-            'size': format_file_size(file_size),
-            'tags': tags,
+            'filename': filename,
+            'size': format_file_size(result['size']),
+            'tags': [],
+            'tagging': tagging,
             'shareUrl': f"/f/{file_hash[:8]}"
         })
-        
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status_code
     except Exception as e:
         logger.error(f"Upload error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/upload/sessions/<session_id>', methods=['DELETE'])
+def abort_upload_session(session_id):
+    """Cancel a session and discard the parts stored so far."""
+    try:
+        upload_sessions.abort_session(DATABASE, s3, BUCKET_NAME, session_id)
+        return jsonify({'success': True, 'sessionId': session_id, 'status': 'aborted'})
+    except UploadSessionError as e:
+        return jsonify({'error': str(e)}), e.status_code
+
 @app.route('/f/<hash_prefix>')
 def file_page(hash_prefix):
     """Display file information and download link."""
     # Find file by hash prefix
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute('SELECT * FROM uploads WHERE hash LIKE ?', (hash_prefix + '%',))
-    row = c.fetchone()
-    conn.close()
+    with db.cursor(DATABASE) as c:
+        c.execute('SELECT * FROM uploads WHERE hash >= ? AND hash < ?', db.prefix_range(hash_prefix.lower()))
+        row = c.fetchone()
     
     if not row:
         return "File not found", 404
@@ -382,18 +455,13 @@ def download_file(file_hash):
         return "File not found", 404
     
     try:
-        key = f"{file_hash}/{metadata['filename']}"
-        
-        # Generate presigned URL
-        url = s3.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': BUCKET_NAME, 'Key': key},
-            ExpiresIn=3600  # 1 hour
-        )
+        # Presigned URL, reused from the cache while it has time left
+        url, expires_at = presigned_urls.sign(object_key(file_hash, metadata['filename']))
         
         return jsonify({
             'success': True,
             'download_url': url,
+            'expires_at': expires_at,
             'filename': metadata['filename']
         })
         
@@ -401,20 +469,109 @@ def download_file(file_hash):
         logger.error(f"Download error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/download-urls', methods=['POST'])
+def download_urls():
+    """Presigned download URLs for many hashes in one call, for gallery pages."""
+    data = request.get_json(silent=True) or {}
+    hashes = data.get('hashes')
+    if not isinstance(hashes, list) or not all(isinstance(h, str) for h in hashes):
+        return jsonify({'error': 'hashes must be a list of file hashes'}), 400
+    if len(hashes) > MAX_BULK_SIGN:
+        return jsonify({'error': f'At most {MAX_BULK_SIGN} hashes per request'}), 400
+    
+    try:
+        hashes = list(dict.fromkeys(h.lower() for h in hashes))
+        found = get_files_metadata(hashes)
+        keys = {file_hash: object_key(file_hash, filename) for file_hash, (filename, size) in found.items()}
+        signed = presigned_urls.sign_many(keys.values())
+        urls = {}
+        for file_hash, (filename, size) in found.items():
+            url, expires_at = signed[keys[file_hash]]
+            urls[file_hash] = {
+                'download_url': url,
+                'expires_at': expires_at,
+                'filename': filename,
+                'size': size
+            }
+        
+        return jsonify({
+            'urls': urls,
+            'missing': [h for h in hashes if h not in found]
+        })
+        
+    except Exception as e:
+        logger.error(f"Bulk sign error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/recent')
 def recent_uploads():
     """Get recent uploads."""
-    uploads = get_recent_uploads(20)
-    return jsonify(uploads)
+    try:
+        uploads, next_cursor = get_recent_uploads(page_size(request.args.get('limit'), 20),
+                                                  request.args.get('cursor'))
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # The body stays a plain list; the next page is advertised in a header
+    response = jsonify(uploads)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+@app.route('/api/export')
+def export_uploads():
+    """Stream every upload's metadata as NDJSON."""
+    rows = iter_rows(DATABASE, 'uploads', UPLOAD_LIST_COLUMNS, 'upload_date')
+    return Response(ndjson_lines(upload_summary(row) for row in rows), mimetype='application/x-ndjson')
+
+@app.route('/api/files/<file_hash>/tags')
+def file_tags(file_hash):
+    """Tags for an upload and the state of its AI tagging job."""
+    metadata = get_file_metadata(file_hash.lower())
+    if not metadata:
+        return jsonify({'error': 'File not found'}), 404
+    
+    job = tagging_queue.status(metadata['hash']) if tagging_queue else None
+    return jsonify({
+        'hash': metadata['hash'],
+        'tags': metadata['tags'],
+        'status': job['status'] if job else 'skipped',
+        'attempts': job['attempts'] if job else 0,
+        'error': job['error'] if job else None
+    })
+
+@app.route('/api/search')
+def search():
+    """Full-text search over uploads."""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify([])
+    
+    try:
+        return jsonify(search_uploads(query))
+    except Exception as e:
+        logger.error(f"Search error: {e}")
+        return jsonify({'error': 'Search failed'}), 500
 
 @app.route('/health')
 def health():
     """Health check endpoint."""
     return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus metrics, summed across worker processes under gunicorn."""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
 # Initialize database on startup
 init_db()
 
+# AI tagging runs in background threads so uploads return once stored
+tagging_queue = TaggingQueue(DATABASE, openai_tagger(openai_client), set_file_tags) if openai_client else None
+if tagging_queue:
+    tagging_queue.start()
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
\ No newline at end of file
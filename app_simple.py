@@ -1,12 +1,19 @@
 import os
 import hashlib
-import sqlite3
 import logging
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_from_directory, Response
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from boto3.session import Session
 from datetime import datetime
+import db
+from download_counts import DownloadCounter
+from raw_downloads import cached_object_response
+from disk_cache import DiskCache, DISK_CACHE_DIR
+from pagination import fetch_page, iter_rows, page_size, ndjson_lines, InvalidCursor
+from clients import LazyClient, b2_client
+from upload_pipeline import format_file_size
+import metrics
+from metrics import UPLOAD_STAGE_SECONDS, UPLOAD_BYTES, UPLOADS_IN_FLIGHT
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -28,15 +35,16 @@ if not all([B2_KEY_ID, B2_APPLICATION_KEY, B2_BUCKET, B2_ENDPOINT]):
 
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor'])
 
 # Database setup
 DB_PATH = 'metadata.db'
 
-def init_db():
-    """Initialize the database."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+# Bump whenever create_schema changes so existing databases are migrated
+SCHEMA_VERSION = 1
+
+def create_schema(c):
+    """Create the files table and its indexes using an open cursor."""
     c.execute('''CREATE TABLE IF NOT EXISTS files
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
                   filename TEXT NOT NULL,
@@ -47,25 +55,26 @@ def init_db():
                   url TEXT NOT NULL,
                   upload_date TEXT,
                   download_count INTEGER DEFAULT 0)''')
-    conn.commit()
-    conn.close()
-    logger.info("Database initialized")
+    c.execute('CREATE INDEX IF NOT EXISTS idx_filehash ON files(filehash)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_files_upload_date ON files(upload_date, id)')
+
+def init_db():
+    """Initialize the database, skipped once the schema is at SCHEMA_VERSION."""
+    if db.migrate(DB_PATH, 'app_simple', SCHEMA_VERSION, create_schema):
+        logger.info("Database initialized")
 
 init_db()
 
-# Initialize B2 client
-try:
-    session = Session()
-    s3 = session.client(
-        service_name='s3',
-        endpoint_url=B2_ENDPOINT,
-        aws_access_key_id=B2_KEY_ID,
-        aws_secret_access_key=B2_APPLICATION_KEY
-    )
-    logger.info("B2 client initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize B2 client: {e}")
-    s3 = None
+# Buffered download_count increments, flushed in batches
+download_counter = DownloadCounter(DB_PATH)
+
+# B2 client, built on the first request that talks to B2; None without
+# credentials, so routes can report that storage is not configured
+s3 = LazyClient(lambda: b2_client(B2_ENDPOINT, B2_KEY_ID, B2_APPLICATION_KEY)) \
+    if all([B2_ENDPOINT, B2_KEY_ID, B2_APPLICATION_KEY]) else None
+
+# Local copies of hot objects, served with sendfile instead of from B2
+disk_cache = DiskCache(DISK_CACHE_DIR, s3, B2_BUCKET) if DISK_CACHE_DIR and s3 else None
 
 def calculate_file_hash(file_obj):
     """Calculate SHA256 hash of file."""
@@ -76,16 +85,6 @@ def calculate_file_hash(file_obj):
     file_obj.seek(0)
     return hasher.hexdigest()
 
-def format_file_size(size_bytes):
-    """Format file size in human readable format."""
-    if size_bytes is None:
-        return "Unknown"
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-        if size_bytes < 1024.0:
-            return f"{size_bytes:.1f} {unit}"
-        size_bytes /= 1024.0
-    return f"{size_bytes:.1f} PB"
-
 @app.route('/')
 def index():
     """Serve the main page."""
@@ -106,10 +105,13 @@ def upload_file():
     if not s3:
         return jsonify({'error': 'Storage not configured. Check environment variables.'}), 500
     
-    if 'file' not in request.files:
+    # Parsing the form spools the whole body to memory or a temp file
+    with UPLOAD_STAGE_SECONDS.labels('receive').time():
+        files = request.files
+    if 'file' not in files:
         return jsonify({'error': 'No file part'}), 400
     
-    file = request.files['file']
+    file = files['file']
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
     
@@ -119,32 +121,34 @@ def upload_file():
         file_size = file.tell()
         file.seek(0)
         
+        UPLOAD_BYTES.labels('received').inc(file_size)
+        
         # Calculate hash
-        file_hash = calculate_file_hash(file)
+        with UPLOAD_STAGE_SECONDS.labels('hash').time():
+            file_hash = calculate_file_hash(file)
         logger.info(f"Uploading file: {file.filename}, hash: {file_hash[:8]}, size: {format_file_size(file_size)}")
         
         # Upload to B2
         safe_filename = secure_filename(file.filename)
         s3_key = f"{file_hash[:8]}_{safe_filename}"
         
-        s3.upload_fileobj(
-            Fileobj=file,
-            Bucket=B2_BUCKET,
-            Key=s3_key
-        )
+        with UPLOADS_IN_FLIGHT.track_inprogress(), UPLOAD_STAGE_SECONDS.labels('upload_part').time():
+            s3.upload_fileobj(
+                Fileobj=file,
+                Bucket=B2_BUCKET,
+                Key=s3_key
+            )
+        UPLOAD_BYTES.labels('sent').inc(file_size)
         
         # Construct URL
         url = f"https://f005.backblazeb2.com/file/{B2_BUCKET}/{s3_key}"
         
         # Save to database
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('''INSERT INTO files 
-                    (filename, original_filename, filehash, file_size, mime_type, url, upload_date) 
-                    VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                  (s3_key, file.filename, file_hash, file_size, file.mimetype, url, datetime.now().isoformat()))
-        conn.commit()
-        conn.close()
+        with UPLOAD_STAGE_SECONDS.labels('db_write').time(), db.cursor(DB_PATH) as c:
+            c.execute('''INSERT INTO files 
+                        (filename, original_filename, filehash, file_size, mime_type, url, upload_date) 
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                      (s3_key, file.filename, file_hash, file_size, file.mimetype, url, datetime.now().isoformat()))
         
         return jsonify({
             'success': True,
@@ -158,14 +162,33 @@ def upload_file():
         logger.error(f"Upload error: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/raw/<file_hash>', methods=['GET', 'HEAD'])
+def raw_file(file_hash):
+    """Stream file content from B2, with Range and If-None-Match support."""
+    file_hash = file_hash.lower()
+    if len(file_hash) != 64:
+        return jsonify({'error': 'A full SHA-256 hash is required'}), 400
+    
+    with db.cursor(DB_PATH) as c:
+        c.execute('SELECT filename, original_filename, file_size, mime_type FROM files WHERE filehash = ?', (file_hash,))
+        row = c.fetchone()
+    
+    if not row:
+        return jsonify({'error': 'File not found'}), 404
+    
+    try:
+        return cached_object_response(disk_cache, s3, B2_BUCKET, row[0], file_hash, row[2], request,
+                                      content_type=row[3], filename=row[1])
+    except Exception as e:
+        logger.error(f"Raw download error: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/f/<hash_prefix>')
 def view_file(hash_prefix):
     """View file by hash."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT * FROM files WHERE filehash LIKE ?', (hash_prefix + '%',))
-    row = c.fetchone()
-    conn.close()
+    with db.cursor(DB_PATH) as c:
+        c.execute('SELECT * FROM files WHERE filehash >= ? AND filehash < ?', db.prefix_range(hash_prefix.lower()))
+        row = c.fetchone()
     
     if not row:
         return "File not found", 404
@@ -183,41 +206,48 @@ def view_file(hash_prefix):
 @app.route('/download/<hash_prefix>')
 def download_file(hash_prefix):
     """Generate download URL."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT url FROM files WHERE filehash LIKE ?', (hash_prefix + '%',))
-    row = c.fetchone()
-    
-    # Update download count
-    c.execute('UPDATE files SET download_count = download_count + 1 WHERE filehash LIKE ?', (hash_prefix + '%',))
-    conn.commit()
-    conn.close()
+    with db.cursor(DB_PATH) as c:
+        c.execute('SELECT url, filehash FROM files WHERE filehash >= ? AND filehash < ?', db.prefix_range(hash_prefix.lower()))
+        row = c.fetchone()
     
     if not row:
         return jsonify({'error': 'File not found'}), 404
     
+    # Update download count; the write is batched in the background
+    download_counter.increment(row[1])
+    
     return jsonify({'url': row[0]})
 
+RECENT_COLUMNS = 'filehash, original_filename, file_size, upload_date'
+
+def recent_file(row):
+    """Listing entry for a row selected with RECENT_COLUMNS."""
+    return {
+        'hash': row[0],
+        'filename': row[1],
+        'size': row[2],
+        'upload_date': row[3]
+    }
+
 @app.route('/api/recent')
 def recent_files():
-    """Get recent uploads."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''SELECT filehash, original_filename, file_size, upload_date 
-                 FROM files ORDER BY upload_date DESC LIMIT 20''')
-    rows = c.fetchall()
-    conn.close()
-    
-    files = []
-    for row in rows:
-        files.append({
-            'hash': row[0],
-            'filename': row[1],
-            'size': row[2],
-            'upload_date': row[3]
-        })
+    """Get recent uploads, paged with ?cursor= from the X-Next-Cursor header."""
+    try:
+        rows, next_cursor = fetch_page(DB_PATH, 'files', RECENT_COLUMNS, 'upload_date',
+                                       request.args.get('cursor'), page_size(request.args.get('limit'), 20))
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify(files)
+    response = jsonify([recent_file(row) for row in rows])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+@app.route('/api/export')
+def export_files():
+    """Stream every file's metadata as NDJSON."""
+    rows = iter_rows(DB_PATH, 'files', RECENT_COLUMNS, 'upload_date')
+    return Response(ndjson_lines(recent_file(row) for row in rows), mimetype='application/x-ndjson')
 
 @app.route('/health')
 def health():
@@ -228,6 +258,12 @@ def health():
         'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus metrics, summed across worker processes under gunicorn."""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False) 
\ No newline at end of file
@@ -0,0 +1,293 @@
+"""asyncio serving mode for app.py, for many slow or concurrent clients.
+
+Upload, download and lookup routes (POST /upload, GET /raw/<hash>, GET
+/f/<prefix>) run on the event loop with aiobotocore and aiosqlite, so a
+connection waiting on its client or on B2 holds no thread. Every other
+route is the Flask app, served in a thread pool through a2wsgi. Run with
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+"""
+import os
+import logging
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from flask import render_template, request as flask_request
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import ClientDisconnect
+from starlette.responses import FileResponse, HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.utils import secure_filename
+
+import app as wsgi
+import aio_upload
+import db
+from aio_db import AsyncDatabase
+from aio_upload import MemoryBudget
+from clients import aio_b2_client
+from form_stream import AsyncStreamingForm, FormStreamError
+from metrics import UPLOAD_STAGE_SECONDS
+from raw_downloads import RAW_CHUNK_SIZE, object_headers, not_modified, plan_range
+from upload_pipeline import normalize_sha256, format_file_size, CHUNK_SIZE, MIN_MULTIPART_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Upload buffers all uploads in this process may hold together, and the most
+# one upload may hold; uploads wait (without reading their bodies) for room
+ASGI_MEMORY_BUDGET = int(os.getenv('ASGI_MEMORY_BUDGET', 1024 * 1024 * 1024))  # 1GB
+ASGI_UPLOAD_MEMORY_BUDGET = int(os.getenv('ASGI_UPLOAD_MEMORY_BUDGET', 64 * 1024 * 1024))  # 64MB
+# Each streaming download and part PUT holds a connection to B2
+ASGI_S3_MAX_CONNECTIONS = int(os.getenv('ASGI_S3_MAX_CONNECTIONS', 100))
+# Threads serving the Flask routes
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 16))
+
+database = AsyncDatabase(wsgi.DB_PATH)
+upload_budget = MemoryBudget(ASGI_MEMORY_BUDGET)
+
+# aiobotocore client, opened for the server's lifetime by lifespan()
+s3 = None
+
+
+def create_s3():
+    """Async context manager for the B2 client used by the async routes."""
+    return aio_b2_client(wsgi.B2_ENDPOINT, wsgi.B2_KEY_ID, wsgi.B2_APPLICATION_KEY,
+                         max_pool_connections=ASGI_S3_MAX_CONNECTIONS)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global s3
+    await database.open()
+    try:
+        async with create_s3() as client:
+            s3 = client
+            yield
+    finally:
+        s3 = None
+        await database.close()
+
+
+async def find_file_by_hash(filehash):
+    """Return the stored object for an exact SHA-256, using idx_filehash."""
+    row = await database.fetchone('''SELECT filename, original_filename, file_size, url, mime_type
+                                     FROM files WHERE filehash = ? LIMIT 1''', (filehash,))
+    if not row:
+        return None
+    return {
+        'filename': row[0],
+        'original_filename': row[1] or row[0],
+        'file_size': row[2],
+        'url': row[3],
+        'mime_type': row[4]
+    }
+
+
+async def store_file_metadata(s3_key, original_filename, filehash, file_size, mime_type, url, upload_ip):
+    """Insert the metadata row for an uploaded file."""
+    with UPLOAD_STAGE_SECONDS.labels('db_write').time():
+        async with database.transaction() as conn:
+            await conn.execute('''INSERT INTO files
+                                  (filename, original_filename, filehash, file_size, mime_type, url, upload_ip)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                               (s3_key, original_filename, filehash, file_size, mime_type, url, upload_ip))
+
+    # Any cached prefix of the new hash may now resolve differently
+    wsgi.file_cache.invalidate(*(filehash[:i] for i in range(8, len(filehash) + 1)))
+
+
+async def upload_file(request):
+    """POST /upload, as in app.py, with the body read and sent to B2 without blocking."""
+    try:
+        client_hash = normalize_sha256(request.headers.get('X-File-SHA256'))
+        if client_hash:
+            existing = await find_file_by_hash(client_hash)
+            if existing:
+                logger.info(f"Upload skipped, content already stored: {client_hash[:8]}")
+                return JSONResponse(wsgi.upload_response(existing['original_filename'], client_hash,
+                                                         existing['file_size'], existing['url'], deduplicated=True))
+
+        content_length = request.headers.get('Content-Length')
+        form = AsyncStreamingForm(request.stream(), request.headers.get('Content-Type'),
+                                  int(content_length) if content_length and content_length.isdigit() else None)
+        if not await form.open_file('file'):
+            return JSONResponse({'error': 'No file part'}, status_code=400)
+        if not form.filename:
+            return JSONResponse({'error': 'No selected file'}, status_code=400)
+
+        safe_filename = secure_filename(form.filename) or 'unnamed_file'
+        size_hint = form.size_hint()
+        logger.info(f"Upload attempt: {safe_filename} (up to {format_file_size(size_hint)})")
+
+        if await form.at_eof():
+            return JSONResponse({'error': 'File is empty'}, status_code=400)
+
+        mime_type = form.content_type or 'application/octet-stream'
+        upload_ip = request.client.host if request.client else 'unknown'
+        existing = {}
+
+        async def find_existing(filehash):
+            existing['file'] = await find_file_by_hash(filehash)
+            return existing['file']['filename'] if existing['file'] else None
+
+        result = await aio_upload.stream_upload(
+            s3,
+            form,
+            wsgi.B2_BUCKET,
+            lambda filehash: f"{filehash[:8]}_{safe_filename}",
+            file_size=size_hint,
+            part_size=CHUNK_SIZE,
+            threshold=MIN_MULTIPART_SIZE,
+            content_type=mime_type,
+            memory_budget=ASGI_UPLOAD_MEMORY_BUDGET,
+            find_existing=find_existing,
+            budget=upload_budget
+        )
+        await form.finish()
+        UPLOAD_STAGE_SECONDS.labels('receive').observe(form.receive_seconds)
+        filehash = result['hash']
+        s3_key = result['key']
+        file_size = result['size']
+
+        if result['deduplicated']:
+            logger.info(f"File already stored: {safe_filename} - Hash: {filehash[:8]}")
+            return JSONResponse(wsgi.upload_response(safe_filename, filehash, file_size,
+                                                     existing['file']['url'], deduplicated=True))
+
+        url = wsgi.build_public_url(s3_key)
+        await store_file_metadata(s3_key, safe_filename, filehash, file_size, mime_type, url, upload_ip)
+
+        logger.info(f"File uploaded successfully: {safe_filename} ({format_file_size(file_size)}) - Hash: {filehash[:8]}")
+        return JSONResponse(wsgi.upload_response(safe_filename, filehash, file_size, url))
+    except FormStreamError as e:
+        return JSONResponse({'error': str(e)}, status_code=e.status_code)
+    except ClientDisconnect:
+        logger.warning("Upload abandoned: client disconnected")
+        return Response(status_code=400)
+    except Exception as e:
+        logger.exception(f"Upload failed: {e}")
+        return JSONResponse({'error': f'Upload failed: {str(e)}'}, status_code=500)
+
+
+async def iter_body(body):
+    try:
+        async for chunk in body.iter_chunks(RAW_CHUNK_SIZE):
+            yield chunk
+    finally:
+        body.close()
+
+
+async def raw_file(request):
+    """GET/HEAD /raw/<hash>, as in app.py: content streamed from B2 or the disk cache."""
+    filehash = normalize_sha256(request.path_params['filehash'])
+    if not filehash:
+        return JSONResponse({'error': 'A full SHA-256 hash is required'}, status_code=400)
+
+    try:
+        stored = await find_file_by_hash(filehash)
+        if not stored:
+            return JSONResponse({'error': 'File not found'}, status_code=404)
+
+        content_type = stored['mime_type']
+        headers = object_headers(filehash, stored['original_filename'])
+        if not_modified(request.headers, headers):
+            return Response(status_code=304, headers=headers)
+
+        # As in raw_downloads.cached_object_response: HEAD and Range requests
+        # never wait on a fill, and a full GET that misses fills in the background
+        disk_cache = wsgi.disk_cache
+        if disk_cache and disk_cache.accepts(stored['file_size']) and request.method != 'HEAD':
+            path = disk_cache.get(filehash)
+            if path:
+                return FileResponse(path, headers=headers, media_type=content_type or 'application/octet-stream')
+            if 'Range' not in request.headers:
+                disk_cache.fill_in_background(filehash, stored['filename'])
+
+        size = stored['file_size']
+        if size is None:
+            size = (await s3.head_object(Bucket=wsgi.B2_BUCKET, Key=stored['filename']))['ContentLength']
+
+        status, byte_range = plan_range(request.headers, size, headers)
+        if status == 416 or request.method == 'HEAD':
+            return Response(status_code=status, headers=headers, media_type=content_type)
+
+        params = {'Bucket': wsgi.B2_BUCKET, 'Key': stored['filename']}
+        if byte_range:
+            params['Range'] = byte_range
+        obj = await s3.get_object(**params)
+        return StreamingResponse(iter_body(obj['Body']), status_code=status, headers=headers,
+                                 media_type=content_type or obj.get('ContentType') or 'application/octet-stream')
+    except Exception as e:
+        logger.error(f"Error streaming file {filehash}: {e}")
+        return JSONResponse({'error': 'Failed to stream file'}, status_code=500)
+
+
+def render_page(request, template, **context):
+    """Render one of app.py's templates for a Starlette request."""
+    with wsgi.app.test_request_context(request.url.path, base_url=str(request.base_url)):
+        return HTMLResponse(render_template(template, request=flask_request, **context))
+
+
+async def get_file_by_hash(request):
+    """GET /f/<prefix>, as in app.py, sharing its metadata cache and download counter."""
+    hash_prefix = request.path_params['hash_prefix']
+    if len(hash_prefix) < 8:
+        return JSONResponse({'error': 'Hash prefix must be at least 8 characters'}, status_code=400)
+
+    key = hash_prefix.lower()
+    try:
+        # Cached rows are shared between requests, so they are kept as a tuple
+        results = wsgi.file_cache.get(key)
+        if results is None:
+            results = await database.fetchall(
+                '''SELECT filename, original_filename, filehash, file_size, mime_type, url, created_at, download_count
+                   FROM files WHERE filehash >= ? AND filehash < ? ORDER BY created_at DESC''',
+                db.prefix_range(key))
+
+            if not results:
+                return render_page(request, 'file_not_found.html', hash_prefix=hash_prefix)
+
+            results = tuple(results)
+            wsgi.file_cache.set(key, results)
+            if len(results) == 1:
+                wsgi.file_cache.set(results[0][2], results)
+
+        if len(results) > 1:
+            return render_page(request, 'disambiguation.html', hash_prefix=hash_prefix, files=results)
+
+        file_data = results[0]
+        pending = wsgi.download_counter.increment(file_data[2])
+
+        return render_page(request, 'file_info.html',
+            filename=file_data[0],
+            original_filename=file_data[1],
+            filehash=file_data[2],
+            file_size=format_file_size(file_data[3]) if file_data[3] else 'Unknown',
+            mime_type=file_data[4],
+            url=file_data[5],
+            created_at=file_data[6],
+            download_count=(file_data[7] or 0) + pending
+        )
+    except Exception as e:
+        logger.error(f"Error retrieving file by hash: {e}")
+        return JSONResponse({'error': 'Failed to retrieve file'}, status_code=500)
+
+
+app = Starlette(
+    routes=[
+        Route('/upload', upload_file, methods=['POST']),
+        Route('/raw/{filehash}', raw_file, methods=['GET', 'HEAD']),
+        Route('/f/{hash_prefix}', get_file_by_hash),
+        Mount('/', app=WSGIMiddleware(wsgi.app, workers=ASGI_WSGI_THREADS)),
+    ],
+    # Same policy as the Flask app's flask-cors setup, applied to every route
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'],
+                           allow_headers=['Content-Type'])],
+    lifespan=lifespan
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
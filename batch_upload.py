@@ -0,0 +1,227 @@
+import os
+import io
+import logging
+import mimetypes
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.utils import secure_filename
+
+from form_stream import FormStreamError, RECEIVE_CHUNK_SIZE
+from upload_pipeline import stream_upload, read_up_to, PartBody, CHUNK_SIZE, MIN_MULTIPART_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Buffered batch files hashed and sent to B2 at the same time, shared by all
+# batch requests of a process
+BATCH_UPLOAD_WORKERS = int(os.getenv('BATCH_UPLOAD_WORKERS', 8))
+# Files up to this size are read into memory and handed to the workers while
+# the body is still being read; larger ones are streamed through one at a time
+BATCH_BUFFER_SIZE = int(os.getenv('BATCH_BUFFER_SIZE', 8 * 1024 * 1024))  # 8MB
+# Most files accepted in one batch request
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', 10000))
+
+# Request types read as a tar stream rather than multipart/form-data
+TAR_MIMETYPES = {'application/x-tar', 'application/tar', 'application/x-gtar',
+                 'application/gzip', 'application/x-gzip', 'application/x-compressed-tar',
+                 'application/x-bzip2', 'application/x-bzip', 'application/x-bzip2-compressed-tar',
+                 'application/x-xz', 'application/x-xz-compressed-tar'}
+
+# The request body itself could not be read, so the batch cannot go on
+_BODY_ERRORS = (FormStreamError, tarfile.TarError, ClientDisconnected)
+
+_pool = ThreadPoolExecutor(max_workers=BATCH_UPLOAD_WORKERS, thread_name_prefix='b2-batch')
+
+
+def iter_form_files(form):
+    """Yield (name, content_type, stream, size) for every file part of a StreamingForm.
+
+    Multipart parts carry no length, so `size` is always None.
+    """
+    while form.open_file(None):
+        # Browsers send a part without a filename for an empty file input
+        if form.filename:
+            yield form.filename, form.content_type, form, None
+
+
+def iter_tar_files(stream):
+    """Yield (name, content_type, stream, size) for every regular file of a tar stream.
+
+    The archive is read front to back as it arrives and may be gzip, bzip2
+    or xz compressed. Each member must be read before asking for the next.
+    """
+    try:
+        with tarfile.open(fileobj=stream, mode='r|*') as tar:
+            for member in tar:
+                if member.isfile():
+                    yield (member.name, mimetypes.guess_type(member.name)[0], tar.extractfile(member),
+                           member.size)
+    except tarfile.TarError as e:
+        raise FormStreamError(f'Malformed tar stream: {e}')
+
+
+class _Prefixed(io.RawIOBase):
+    """Bytes already read from a stream, followed by the rest of it."""
+
+    def __init__(self, head, stream):
+        self._head = memoryview(head)
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._head:
+            data = self._stream.read(len(buffer))
+        else:
+            data = self._head[:len(buffer)]
+            self._head = self._head[len(data):]
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class _Claims:
+    """Content hashes stored, or being stored, by one batch.
+
+    A file whose content an earlier file of the batch is uploading waits for
+    that upload and reuses its key instead of sending the bytes again; if
+    the upload fails, the waiting file sends its own copy.
+    """
+
+    def __init__(self, find_existing=None):
+        self._find_existing = find_existing
+        self._lock = threading.Lock()
+        self._claims = {}
+
+    def upload(self, s3, stream, bucket, key_for_hash, **kwargs):
+        """stream_upload() with deduplication against the batch and `find_existing`."""
+        owned = []
+
+        def find_existing(filehash):
+            key = self._claim(filehash)
+            if key:
+                return key
+            owned.append(filehash)
+            return self._find_existing(filehash) if self._find_existing else None
+
+        key = None
+        try:
+            result = stream_upload(s3, stream, bucket, key_for_hash, find_existing=find_existing, **kwargs)
+            key = result['key']
+            return result
+        finally:
+            if owned:
+                self._release(owned[0], key)
+
+    def _claim(self, filehash):
+        """Key an earlier file of the batch stored `filehash` under; None if the caller now owns it."""
+        while True:
+            with self._lock:
+                claim = self._claims.get(filehash)
+                if claim is None:
+                    self._claims[filehash] = {'done': threading.Event(), 'key': None}
+                    return None
+            claim['done'].wait()
+            if claim['key']:
+                return claim['key']
+
+    def _release(self, filehash, key):
+        with self._lock:
+            claim = self._claims[filehash]
+            if key:
+                claim['key'] = key
+            else:
+                del self._claims[filehash]
+        claim['done'].set()
+
+
+def upload_batch(s3, files, bucket, find_existing=None, workers=BATCH_UPLOAD_WORKERS,
+                 buffer_size=BATCH_BUFFER_SIZE, max_files=BATCH_MAX_FILES):
+    """Hash and upload every file of a batch request to B2.
+
+    `files` yields (name, content_type, stream, size) as from
+    iter_form_files() or iter_tar_files(), with `size` None when unknown.
+    Files up to `buffer_size` bytes are read into memory and uploaded by
+    the shared pool of BATCH_UPLOAD_WORKERS threads while the next ones are
+    read, with at most `workers * 2` of them queued or in progress; larger
+    files are streamed through stream_upload() in order. Identical content within the batch is
+    only sent once, and `find_existing(hash)` works as for stream_upload().
+
+    Returns (results, error). `results` has one dict per file, in the order
+    they were sent, with the 'name' given, a sanitized 'filename', the
+    'content_type', and either the stream_upload() result as 'upload' or
+    an 'error' message. `error` is a FormStreamError when the body could
+    not be read to its end; `results` then covers the files before it.
+    """
+    claims = _Claims(find_existing)
+    slots = threading.BoundedSemaphore(workers * 2)
+    results = []
+    error = None
+
+    def upload_one(entry, stream, file_size):
+        filename = entry['filename']
+        try:
+            entry['upload'] = claims.upload(
+                s3,
+                stream,
+                bucket,
+                lambda filehash: f"{filehash[:8]}_{filename}",
+                file_size=file_size,
+                part_size=CHUNK_SIZE,
+                threshold=MIN_MULTIPART_SIZE,
+                content_type=entry['content_type']
+            )
+        except _BODY_ERRORS:
+            raise
+        except Exception as e:
+            logger.error(f"Batch upload failed for {filename}: {e}")
+            entry['error'] = f'Upload failed: {str(e)}'
+
+    current = None  # The file being read from the body
+    futures = []
+    try:
+        for name, content_type, stream, file_size in files:
+            if len(results) >= max_files:
+                raise FormStreamError(f'A batch may contain at most {max_files} files', 413)
+            current = {
+                'name': name,
+                'filename': secure_filename(os.path.basename(name)) or 'unnamed_file',
+                'content_type': content_type or 'application/octet-stream'
+            }
+            results.append(current)
+
+            if file_size is not None and file_size > buffer_size:
+                # Known to be large: stream it without reading ahead
+                upload_one(current, stream, file_size)
+                current = None
+                continue
+
+            # Taken before reading, so buffered files waiting for a worker are bounded
+            slots.acquire()
+            submitted = False
+            try:
+                head = read_up_to(stream, buffer_size + 1, RECEIVE_CHUNK_SIZE)
+                if not head:
+                    current['error'] = 'File is empty'
+                elif len(head) <= buffer_size:
+                    future = _pool.submit(upload_one, current, PartBody(head), len(head))
+                    future.add_done_callback(lambda future: slots.release())
+                    futures.append(future)
+                    submitted = True
+                else:
+                    upload_one(current, _Prefixed(head, stream), file_size)
+            finally:
+                if not submitted:
+                    slots.release()
+            current = None
+    except _BODY_ERRORS as e:
+        error = e if isinstance(e, FormStreamError) else FormStreamError(f'Could not read the batch: {e}')
+        logger.warning(f"Batch upload stopped after {len(results)} files: {error}")
+        if current is not None:
+            current['error'] = 'The request body ended before this file was complete'
+    finally:
+        wait(futures)
+
+    return results, error
@@ -0,0 +1,377 @@
+"""End-to-end benchmarks of app.py over HTTP, against a local S3 stand-in.
+
+The app runs in a child process (a threaded werkzeug server in a scratch
+directory) whose B2 client is replaced by benchmarks/fake_s3.py, or which
+talks to a real S3-compatible server such as MinIO when --endpoint is
+given. This process drives it over HTTP and measures:
+
+  uploads  throughput of POST /upload for each size in --upload-sizes
+  lookups  GET /f/<hash> throughput and latency at each --concurrency
+  search   GET /search latency with the table seeded to each --search-rows
+  rss      the server's peak resident memory after each phase
+
+Results are printed and, with --output, written as JSON for tracking
+regressions between commits. Client and server share one machine, so
+compare numbers from the same host only.
+
+    python benchmarks/app_suite.py --output results.json
+    python benchmarks/app_suite.py --search-rows 10000,1000000,10000000
+    python benchmarks/app_suite.py --endpoint http://localhost:9000 --bucket bench
+"""
+import os
+import sys
+import json
+import time
+import random
+import select
+import hashlib
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import http.client
+import threading
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Dummy credentials for the fake; --endpoint runs use the real B2_* variables
+FAKE_ENV = {
+    'B2_KEY_ID': 'benchmark',
+    'B2_APPLICATION_KEY': 'benchmark',
+    'B2_BUCKET': 'benchmark',
+    'B2_ENDPOINT': 'https://s3.us-east-005.backblazeb2.com',
+}
+
+WORDS = ('report', 'invoice', 'holiday', 'photo', 'backup', 'draft', 'final', 'scan',
+         'budget', 'slides', 'notes', 'contract', 'receipt', 'video', 'archive', 'design')
+EXTENSIONS = ('pdf', 'jpg', 'png', 'zip', 'mp4', 'docx', 'txt')
+
+BOUNDARY = 'benchmarkboundary7d3c1f'
+
+
+def parse_size(text):
+    """'64KB' / '16MB' / '1GB' / '100' -> bytes."""
+    text = text.strip().upper()
+    for suffix, factor in (('KB', 1024), ('MB', 1024 ** 2), ('GB', 1024 ** 3), ('B', 1)):
+        if text.endswith(suffix):
+            return int(float(text[:-len(suffix)]) * factor)
+    return int(text)
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f'{size:g}{unit}' if unit == 'B' else f'{size:.0f}{unit}'
+        size /= 1024
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def latency_summary(latencies):
+    return {
+        'count': len(latencies),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p90_ms': percentile(latencies, 90) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': statistics.mean(latencies) * 1000,
+    }
+
+
+# --- Server side (child process) -------------------------------------------
+
+def serve(args):
+    """Import the app in the current directory and serve it until killed."""
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import logging
+    from werkzeug.serving import make_server
+
+    import app as app_module
+    # Per-request and per-part INFO lines would dominate small requests
+    logging.disable(logging.INFO)
+
+    if not args.endpoint:
+        from fake_s3 import FakeS3
+        app_module.s3 = FakeS3(latency=args.s3_latency / 1000)
+        if app_module.disk_cache:
+            app_module.disk_cache.s3 = app_module.s3
+
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    print(server.server_port, flush=True)
+    server.serve_forever()
+
+
+class Server:
+    """The app in a child process, with a way to read its peak RSS."""
+
+    def __init__(self, args, workdir):
+        env = dict(os.environ)
+        if not args.endpoint:
+            env.update(FAKE_ENV)
+        else:
+            env.update(B2_ENDPOINT=args.endpoint, B2_BUCKET=args.bucket or os.getenv('B2_BUCKET', ''))
+        command = [sys.executable, os.path.abspath(__file__), '--serve',
+                   '--s3-latency', str(args.s3_latency)]
+        if args.endpoint:
+            command += ['--endpoint', args.endpoint]
+        self.process = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.PIPE, text=True)
+        ready, _, _ = select.select([self.process.stdout], [], [], 60)
+        line = self.process.stdout.readline() if ready else ''
+        if not line.strip().isdigit():
+            self.process.kill()
+            raise RuntimeError('Benchmark server failed to start')
+        self.port = int(line)
+
+    def peak_rss(self):
+        """Peak resident set size in bytes (Linux only, else None)."""
+        try:
+            with open(f'/proc/{self.process.pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait(timeout=10)
+
+
+# --- Client side ------------------------------------------------------------
+
+def request(port, method, path, body=None, headers=None, timeout=600):
+    """Send one request on a fresh connection; return (status, seconds)."""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    start = time.perf_counter()
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        response.read()
+        return response.status, time.perf_counter() - start
+    finally:
+        conn.close()
+
+
+def upload_body(filename, payload):
+    """multipart/form-data body as a list of buffers, plus its length."""
+    head = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n').encode()
+    tail = f'\r\n--{BOUNDARY}--\r\n'.encode()
+    parts = [head, *payload, tail]
+    return parts, sum(len(part) for part in parts)
+
+
+def bench_uploads(port, sizes, repeat):
+    results = []
+    for size in sizes:
+        data = memoryview(os.urandom(size))
+        times = []
+        for i in range(repeat):
+            # A fresh first block per run so deduplication never short-cuts the upload
+            unique = os.urandom(min(32, size))
+            body, length = upload_body(f'bench-{size}-{i}.bin', [unique, data[len(unique):]])
+            status, seconds = request(port, 'POST', '/upload', body=body, headers={
+                'Content-Type': f'multipart/form-data; boundary={BOUNDARY}',
+                'Content-Length': str(length),
+            })
+            if status != 200:
+                raise RuntimeError(f'Upload of {format_size(size)} failed with HTTP {status}')
+            times.append(seconds)
+        median = statistics.median(times)
+        results.append({
+            'size': size,
+            'runs': repeat,
+            'median_s': median,
+            'min_s': min(times),
+            'throughput_mb_s': size / median / 1024 ** 2,
+        })
+        print(f'  upload {format_size(size):>8}  median {median * 1000:9.1f}ms  '
+              f'{results[-1]["throughput_mb_s"]:8.1f} MB/s')
+    return results
+
+
+def run_concurrently(port, paths, concurrency):
+    """GET every path using `concurrency` threads; return (latencies, errors, seconds)."""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    queue = iter(paths)
+
+    def worker():
+        nonlocal errors
+        while True:
+            with lock:
+                path = next(queue, None)
+            if path is None:
+                return
+            status, seconds = request(port, 'GET', path)
+            with lock:
+                latencies.append(seconds)
+                if status != 200:
+                    errors += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def bench_lookups(port, hashes, levels, requests_per_level):
+    results = []
+    for concurrency in levels:
+        paths = [f'/f/{random.choice(hashes)[:random.choice((8, 12, 64))]}' for _ in range(requests_per_level)]
+        latencies, errors, elapsed = run_concurrently(port, paths, concurrency)
+        summary = latency_summary(latencies)
+        summary.update(concurrency=concurrency, errors=errors, requests_per_s=len(latencies) / elapsed)
+        results.append(summary)
+        print(f'  /f/<hash> x{concurrency:<3}  {summary["requests_per_s"]:8.0f} req/s  '
+              f'p50 {summary["p50_ms"]:7.2f}ms  p99 {summary["p99_ms"]:7.2f}ms  errors {errors}')
+    return results
+
+
+def seed(db_path, current, target, batch=50000):
+    """Insert synthetic rows (through the app's triggers) up to `target`; return new hashes."""
+    sys.path.insert(0, ROOT)
+    import db
+
+    hashes = []
+    while current < target:
+        n = min(batch, target - current)
+        rows = []
+        for i in range(current, current + n):
+            filehash = hashlib.sha256(f'seed-{i}'.encode()).hexdigest()
+            name = f'{random.choice(WORDS)}_{random.choice(WORDS)}_{i}.{random.choice(EXTENSIONS)}'
+            rows.append((f'{filehash[:8]}_{name}', name, filehash, random.randint(1, 10 ** 8),
+                         'application/octet-stream', f'https://example.invalid/{filehash[:8]}_{name}', '127.0.0.1'))
+            hashes.append(filehash)
+        with db.cursor(db_path) as c:
+            c.executemany('''INSERT INTO files
+                             (filename, original_filename, filehash, file_size, mime_type, url, upload_ip)
+                             VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+        current += n
+    return hashes
+
+
+def bench_search(port, rows, hashes, queries):
+    """Latency of each query kind against the table as currently seeded."""
+    kinds = {
+        'word': lambda: random.choice(WORDS),
+        'two_words': lambda: f'{random.choice(WORDS)} {random.choice(WORDS)}',
+        'prefix': lambda: random.choice(WORDS)[:3],
+        'hash': lambda: random.choice(hashes)[:10],
+        'miss': lambda: os.urandom(4).hex() + 'zz',
+    }
+    result = {'rows': rows}
+    for kind, make_query in kinds.items():
+        latencies, errors, _ = run_concurrently(
+            port, [f'/search?q={quote(make_query())}' for _ in range(queries)], concurrency=1)
+        result[kind] = latency_summary(latencies)
+        result[kind]['errors'] = errors
+    line = '  '.join(f'{kind} p50 {result[kind]["p50_ms"]:7.2f}ms' for kind in kinds)
+    print(f'  /search {rows:>11,} rows  {line}')
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--upload-sizes', default='4KB,1MB,16MB,128MB',
+                        help='comma-separated upload sizes (default: %(default)s)')
+    parser.add_argument('--upload-repeat', type=int, default=3, help='uploads per size')
+    parser.add_argument('--concurrency', default='1,8,32',
+                        help='comma-separated client threads for /f/<hash> (default: %(default)s)')
+    parser.add_argument('--lookups', type=int, default=2000, help='/f/<hash> requests per concurrency level')
+    parser.add_argument('--search-rows', default='10000,100000',
+                        help='comma-separated table sizes for /search (default: %(default)s)')
+    parser.add_argument('--search-queries', type=int, default=50, help='requests per query kind and size')
+    parser.add_argument('--s3-latency', type=float, default=0.0,
+                        help='milliseconds added to every fake S3 call (default: %(default)s)')
+    parser.add_argument('--endpoint', help='benchmark against this S3-compatible server instead of the fake')
+    parser.add_argument('--bucket', help='bucket for --endpoint (default: $B2_BUCKET)')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for generated names and queries')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    # Progress lines show up promptly even when piped to a file
+    sys.stdout.reconfigure(line_buffering=True)
+    random.seed(args.seed)
+    upload_sizes = [parse_size(s) for s in args.upload_sizes.split(',') if s]
+    levels = [int(n) for n in args.concurrency.split(',') if n]
+    search_rows = sorted(int(n) for n in args.search_rows.split(',') if n)
+
+    workdir = tempfile.mkdtemp(prefix='omnisora-bench-')
+    server = Server(args, workdir)
+    results = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            's3': args.endpoint or 'fake',
+            'args': {k: v for k, v in vars(args).items() if k not in ('serve', 'output')},
+        },
+        'peak_rss_bytes': {},
+    }
+    try:
+        print(f'Server on port {server.port}, working in {workdir}')
+        results['peak_rss_bytes']['startup'] = server.peak_rss()
+
+        print('Uploads')
+        results['uploads'] = bench_uploads(server.port, upload_sizes, args.upload_repeat)
+        results['peak_rss_bytes']['uploads'] = server.peak_rss()
+
+        db_path = os.path.join(workdir, 'metadata.db')
+        rows = 0
+        hashes = []
+        results['search'] = []
+        for i, target in enumerate(search_rows):
+            start = time.perf_counter()
+            hashes += seed(db_path, rows, target)
+            rows = max(rows, target)
+            print(f'Seeded {rows:,} rows in {time.perf_counter() - start:.1f}s')
+
+            if i == 0:
+                print('Lookups')
+                results['lookups'] = bench_lookups(server.port, hashes, levels, args.lookups)
+                results['lookups_rows'] = rows
+                results['peak_rss_bytes']['lookups'] = server.peak_rss()
+                print('Search')
+            results['search'].append(bench_search(server.port, rows, hashes, args.search_queries))
+        results['peak_rss_bytes']['search'] = server.peak_rss()
+    finally:
+        server.stop()
+
+    peaks = {phase: rss for phase, rss in results['peak_rss_bytes'].items() if rss}
+    if peaks:
+        print('Peak RSS  ' + '  '.join(f'{phase} {rss / 1024 ** 2:.0f}MB' for phase, rss in peaks.items()))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Wrote {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""In-memory stand-in for the subset of the boto3 S3 client the apps use.
+
+Bodies are read in full, as a real client would send them, but by default
+only their size is kept so multi-gigabyte benchmark uploads do not inflate
+the process's memory. `latency` adds a fixed delay to every call to mimic
+the round trip to B2. AsyncFakeS3 offers the same calls as coroutines, in
+place of the aiobotocore client used by asgi.py.
+"""
+import time
+import asyncio
+import uuid
+import threading
+
+
+class FakeBody:
+    """Streaming body returned by get_object."""
+
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+
+    def read(self, size=-1):
+        end = len(self._data) if size is None or size < 0 else self._pos + size
+        chunk = self._data[self._pos:end]
+        self._pos += len(chunk)
+        return chunk
+
+    def iter_chunks(self, chunk_size=1024 * 1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        pass
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class FakeS3:
+    def __init__(self, latency=0.0, store_bodies=False, missing_size=None):
+        self.latency = latency
+        self.store_bodies = store_bodies
+        # Keys never stored here (rows seeded straight into SQLite, or objects
+        # uploaded through another worker's fake) read back as this many zeros
+        self.missing_size = missing_size
+        self.objects = {}
+        self.uploads = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _consume(self, body):
+        """Read a request body in full; return its bytes, or just its size."""
+        if isinstance(body, (bytes, bytearray, memoryview)):
+            return bytes(body) if self.store_bodies else len(body)
+        chunks = []
+        size = 0
+        for chunk in iter(lambda: body.read(1024 * 1024), b''):
+            size += len(chunk)
+            if self.store_bodies:
+                chunks.append(bytes(chunk))
+        return b''.join(chunks) if self.store_bodies else size
+
+    def _object(self, key):
+        try:
+            return self.objects[key]
+        except KeyError:
+            if self.missing_size is not None:
+                return self.missing_size
+            raise NoSuchKey(key) from None
+
+    @staticmethod
+    def _size(obj):
+        return obj if isinstance(obj, int) else len(obj)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._call()
+        self.objects[Key] = self._consume(Body)
+        return {'ETag': f'"{uuid.uuid4().hex}"'}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, **kwargs):
+        self.put_object(Bucket=Bucket, Key=Key, Body=Fileobj)
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self._call()
+        obj = self._object(Key)
+        # Objects stored by size only read back as zeros
+        data = obj if isinstance(obj, bytes) else bytes(obj)
+        if Range:
+            start, end = Range[len('bytes='):].split('-')
+            data = data[int(start):int(end) + 1 if end else None]
+        return {'Body': FakeBody(data), 'ContentLength': len(data)}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call()
+        return {'ContentLength': self._size(self._object(Key))}
+
+    def head_bucket(self, Bucket, **kwargs):
+        self._call()
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._call()
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, PartNumber, UploadId, Body, **kwargs):
+        self._call()
+        part = self._consume(Body)
+        with self._lock:
+            self.uploads[UploadId][PartNumber] = part
+        return {'ETag': f'"part-{PartNumber}"'}
+
+    def upload_part_copy(self, Bucket, Key, PartNumber, UploadId, CopySource, CopySourceRange, **kwargs):
+        self._call()
+        start, end = (int(n) for n in CopySourceRange[len('bytes='):].split('-'))
+        obj = self._object(CopySource['Key'])
+        part = obj[start:end + 1] if self.store_bodies else end - start + 1
+        with self._lock:
+            self.uploads[UploadId][PartNumber] = part
+        return {'CopyPartResult': {'ETag': f'"copy-{PartNumber}"'}}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self._call()
+        with self._lock:
+            parts = self.uploads.pop(UploadId)
+        ordered = [parts[part['PartNumber']] for part in MultipartUpload['Parts']]
+        self.objects[Key] = b''.join(ordered) if self.store_bodies else sum(ordered)
+        return {'VersionId': uuid.uuid4().hex}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self._call()
+        with self._lock:
+            self.uploads.pop(UploadId, None)
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        self._call()
+        self.objects[Key] = self._object(CopySource['Key'])
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._call()
+        self.objects.pop(Key, None)
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600):
+        return f"https://fake-s3.invalid/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+
+
+class AsyncFakeBody(FakeBody):
+    """Streaming body returned by AsyncFakeS3.get_object, like aiobotocore's."""
+
+    async def read(self, size=-1):
+        return FakeBody.read(self, size)
+
+    async def iter_chunks(self, chunk_size=1024 * 1024):
+        while True:
+            chunk = FakeBody.read(self, chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class AsyncFakeS3:
+    """FakeS3 with coroutine methods; the latency is awaited, not slept."""
+
+    def __init__(self, latency=0.0, store_bodies=False, missing_size=None):
+        self.latency = latency
+        self.sync = FakeS3(store_bodies=store_bodies, missing_size=missing_size)
+
+    def __getattr__(self, name):
+        method = getattr(self.sync, name)
+
+        async def call(*args, **kwargs):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            response = method(*args, **kwargs)
+            if isinstance(response, dict) and isinstance(response.get('Body'), FakeBody):
+                response['Body'] = AsyncFakeBody(response['Body']._data)
+            return response
+        return call
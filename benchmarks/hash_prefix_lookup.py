@@ -0,0 +1,101 @@
+"""Benchmark /f/<hash> prefix lookups: LIKE 'prefix%' versus an index range scan.
+
+Grows a scratch copy of the `files` table through each size in --rows and
+times both query shapes against it. The range scan should stay flat (an
+index seek, O(log n)) while LIKE grows linearly with the table.
+
+    python benchmarks/hash_prefix_lookup.py --rows 10000,100000,1000000,10000000
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from db import prefix_range  # noqa: E402
+
+LIKE_QUERY = 'SELECT filename FROM files WHERE filehash LIKE ?'
+RANGE_QUERY = 'SELECT filename FROM files WHERE filehash >= ? AND filehash < ?'
+
+
+def grow(conn, current, target, batch=100000):
+    """Insert random hashes until the table holds `target` rows."""
+    while current < target:
+        n = min(batch, target - current)
+        rows = []
+        for i in range(current, current + n):
+            h = os.urandom(32).hex()
+            rows.append((f'{h}/file{i}.bin', h, f'https://example.com/{h}'))
+        conn.executemany('INSERT INTO files (filename, filehash, url) VALUES (?, ?, ?)', rows)
+        conn.commit()
+        current += n
+    return current
+
+
+def time_lookups(conn, query, params, repeat):
+    """Average seconds per lookup over `repeat` runs."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for p in params:
+            conn.execute(query, p).fetchall()
+    return (time.perf_counter() - start) / (repeat * len(params))
+
+
+def plan(conn, query, params):
+    return ' / '.join(row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', default='10000,100000,1000000',
+                        help='comma-separated table sizes to measure (default: %(default)s)')
+    parser.add_argument('--lookups', type=int, default=50, help='distinct prefixes per size')
+    parser.add_argument('--like-max-rows', type=int, default=1000000,
+                        help='skip the LIKE timing above this size, it is a full scan')
+    parser.add_argument('--db', help='database file (default: a temporary file)')
+    args = parser.parse_args()
+    sizes = sorted(int(s) for s in args.rows.split(','))
+
+    path = args.db or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('''CREATE TABLE IF NOT EXISTS files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        filename TEXT NOT NULL,
+        filehash TEXT NOT NULL,
+        url TEXT NOT NULL
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_filehash ON files(filehash)')
+    count = conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    print(f'{"rows":>12}  {"LIKE (ms)":>10}  {"range (ms)":>10}')
+    for size in sizes:
+        count = grow(conn, count, size)
+        conn.execute('ANALYZE')
+
+        # Half the prefixes hit an existing row, half miss
+        offsets = random.sample(range(1, count + 1), min(args.lookups // 2, count))
+        hits = [conn.execute('SELECT filehash FROM files WHERE id = ?', (i,)).fetchone()[0][:8] for i in offsets]
+        misses = [os.urandom(4).hex() for _ in range(args.lookups - len(hits))]
+        prefixes = hits + misses
+
+        range_time = time_lookups(conn, RANGE_QUERY, [prefix_range(p) for p in prefixes], repeat=5)
+        if size <= args.like_max_rows:
+            like_time = time_lookups(conn, LIKE_QUERY, [(p + '%',) for p in prefixes], repeat=1)
+            like_ms = f'{like_time * 1000:10.3f}'
+        else:
+            like_ms = f'{"skipped":>10}'
+        print(f'{count:>12,}  {like_ms}  {range_time * 1000:10.3f}')
+
+    print()
+    print(f'LIKE plan:  {plan(conn, LIKE_QUERY, ("deadbeef%",))}')
+    print(f'range plan: {plan(conn, RANGE_QUERY, prefix_range("deadbeef"))}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+"""Load test comparing the WSGI (gunicorn sync workers) and ASGI (uvicorn) modes.
+
+Each mode serves app.py's routes in a child process, from a scratch
+directory and against the in-memory S3 stand-in (with --s3-latency added to
+every call, like a round trip to B2). While --slow-clients uploads trickle
+their bodies over the whole run, --clients threads issue lookups (GET
+/f/<hash>) and downloads (GET /raw/<hash>) of seeded files for --duration
+seconds. Reported per mode: request throughput, latency and errors for the
+fast requests, how many slow uploads completed, and the server's peak RSS
+summed over its processes.
+
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --slow-clients 1000 --duration 30 --modes asgi
+    python benchmarks/load_test.py --wsgi-workers 8 --output load.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import hashlib
+import argparse
+import platform
+import threading
+import subprocess
+import tempfile
+import http.client
+from datetime import datetime, timezone
+
+from app_suite import (ROOT, FAKE_ENV, BOUNDARY, latency_summary, parse_size, format_size, upload_body,
+                       git_revision)
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+
+
+# --- Server side (imported by gunicorn / uvicorn in the child process) ------
+
+def _fake_s3(cls):
+    return cls(latency=float(os.environ['LOAD_TEST_S3_LATENCY']) / 1000,
+               missing_size=int(os.environ['LOAD_TEST_OBJECT_SIZE']))
+
+
+def wsgi_app():
+    """gunicorn entry point: the Flask app with the S3 stand-in."""
+    import logging
+    import app as app_module
+    from fake_s3 import FakeS3
+    logging.disable(logging.INFO)
+    app_module.s3 = _fake_s3(FakeS3)
+    return app_module.app
+
+
+def asgi_app():
+    """uvicorn entry point: asgi.py with the async S3 stand-in."""
+    import logging
+    from contextlib import asynccontextmanager
+    import asgi
+    from fake_s3 import AsyncFakeS3
+    logging.disable(logging.INFO)
+    s3 = _fake_s3(AsyncFakeS3)
+
+    @asynccontextmanager
+    async def create_s3():
+        yield s3
+
+    asgi.create_s3 = create_s3
+    return asgi.app
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ModeServer:
+    """One serving mode in a child process."""
+
+    def __init__(self, mode, args, workdir):
+        self.port = free_port()
+        env = dict(os.environ, **FAKE_ENV)
+        env.update(
+            PYTHONPATH=os.pathsep.join([ROOT, BENCHMARKS]),
+            LOAD_TEST_S3_LATENCY=str(args.s3_latency),
+            LOAD_TEST_OBJECT_SIZE=str(args.download_size),
+            PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, 'prometheus'),
+        )
+        if mode == 'wsgi':
+            command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+                       '--workers', str(args.wsgi_workers), '--bind', f'127.0.0.1:{self.port}',
+                       '--timeout', str(int(args.duration * 3)), '--log-level', 'warning',
+                       'load_test:wsgi_app()']
+        else:
+            os.makedirs(env['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+            command = [sys.executable, '-m', 'uvicorn', '--factory', 'load_test:asgi_app',
+                       '--host', '127.0.0.1', '--port', str(self.port), '--log-level', 'warning',
+                       '--no-access-log', '--backlog', str(max(2048, args.slow_clients * 2))]
+        self.process = subprocess.Popen(command, cwd=workdir, env=env)
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            try:
+                if request(self.port, 'GET', '/health/live', timeout=5)[0] == 200:
+                    return
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f'{mode} server failed to start')
+
+    def peak_rss(self):
+        """Sum of peak resident set sizes over the server's processes (Linux only)."""
+        total = 0
+        pids = [self.process.pid]
+        try:
+            with open(f'/proc/{self.process.pid}/task/{self.process.pid}/children') as f:
+                pids += [int(pid) for pid in f.read().split()]
+            for pid in pids:
+                with open(f'/proc/{pid}/status') as f:
+                    total += next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmHWM:'))
+        except OSError:
+            return None
+        return total
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+# --- Client side ------------------------------------------------------------
+
+def request(port, method, path, body=None, headers=None, timeout=10):
+    """Send one request on a fresh connection; return (status, seconds)."""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    start = time.perf_counter()
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        response.read()
+        return response.status, time.perf_counter() - start
+    finally:
+        conn.close()
+
+
+def seed(db_path, count, size):
+    """Insert `count` file rows of `size` bytes each; return their hashes."""
+    sys.path.insert(0, ROOT)
+    import db
+
+    rows = []
+    for i in range(count):
+        filehash = hashlib.sha256(f'load-{i}'.encode()).hexdigest()
+        name = f'load_{i}.bin'
+        rows.append((f'{filehash[:8]}_{name}', name, filehash, size, 'application/octet-stream',
+                     f'https://example.invalid/{filehash[:8]}_{name}', '127.0.0.1'))
+    with db.cursor(db_path) as c:
+        c.executemany('''INSERT INTO files
+                         (filename, original_filename, filehash, file_size, mime_type, url, upload_ip)
+                         VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+    return [row[2] for row in rows]
+
+
+class SlowUploads:
+    """Uploads whose bodies trickle in over the run, one socket per client.
+
+    All but the last few bytes of each body are sent evenly over `duration`
+    from a single thread; finish() sends the rest and counts 200 responses.
+    """
+
+    def __init__(self, port, count, size, duration):
+        self.port = port
+        self.duration = duration
+        self.uploads = []
+        for i in range(count):
+            body, length = upload_body(f'slow-{i}.bin', [os.urandom(size)])
+            head = (f'POST /upload HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n'
+                    f'Content-Type: multipart/form-data; boundary={BOUNDARY}\r\n'
+                    f'Content-Length: {length}\r\n\r\n').encode()
+            self.uploads.append({'data': head + b''.join(body), 'sent': 0, 'sock': None})
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        for upload in self.uploads:
+            sock = socket.create_connection(('127.0.0.1', self.port))
+            sock.setblocking(False)
+            upload['sock'] = sock
+        self._started = time.perf_counter()
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            fraction = min(1.0, (time.perf_counter() - self._started) / self.duration)
+            for upload in self.uploads:
+                target = int((len(upload['data']) - 64) * fraction)
+                if upload['sent'] < target:
+                    try:
+                        upload['sent'] += upload['sock'].send(upload['data'][upload['sent']:target])
+                    except (BlockingIOError, InterruptedError):
+                        pass  # The server is not reading this body yet
+                    except OSError:
+                        upload['sent'] = len(upload['data'])  # Reset by the server
+            self._stop.wait(0.05)
+
+    def finish(self, timeout=60):
+        """Send what is left of every body; return how many uploads succeeded."""
+        self._stop.set()
+        self._thread.join()
+        deadline = time.time() + timeout
+        completed = 0
+        for upload in self.uploads:
+            sock = upload['sock']
+            try:
+                sock.settimeout(max(0.1, deadline - time.time()))
+                sock.sendall(upload['data'][upload['sent']:])
+                status_line = sock.makefile('rb').readline()
+                if status_line.split()[1:2] == [b'200']:
+                    completed += 1
+            except OSError:
+                pass
+            finally:
+                sock.close()
+        return completed
+
+
+def fast_clients(port, hashes, clients, duration, timeout):
+    """Lookups and downloads from `clients` threads for `duration` seconds."""
+    results = {'lookup': ([], [0]), 'download': ([], [0])}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(seed):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            filehash = rng.choice(hashes)
+            kind = rng.choice(('lookup', 'download'))
+            path = f'/f/{filehash[:8]}' if kind == 'lookup' else f'/raw/{filehash}'
+            try:
+                status, seconds = request(port, 'GET', path, timeout=timeout)
+            except OSError:
+                status, seconds = None, timeout
+            latencies, errors = results[kind]
+            with lock:
+                latencies.append(seconds)
+                if status != 200:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    summary = {}
+    for kind, (latencies, errors) in results.items():
+        summary[kind] = latency_summary(latencies) if latencies else {'count': 0}
+        summary[kind].update(errors=errors[0], requests_per_s=len(latencies) / elapsed)
+    return summary
+
+
+def run_mode(mode, args):
+    workdir = tempfile.mkdtemp(prefix=f'omnisora-load-{mode}-')
+    server = ModeServer(mode, args, workdir)
+    try:
+        hashes = seed(os.path.join(workdir, 'metadata.db'), args.files, args.download_size)
+        slow = SlowUploads(server.port, args.slow_clients, args.slow_size, args.duration)
+        slow.start()
+        fast = fast_clients(server.port, hashes, args.clients, args.duration, args.timeout)
+        completed = slow.finish()
+        result = {
+            'mode': mode,
+            'fast': fast,
+            'slow_uploads': {'clients': args.slow_clients, 'completed': completed},
+            'peak_rss_bytes': server.peak_rss(),
+        }
+    finally:
+        server.stop()
+
+    for kind in ('lookup', 'download'):
+        stats = fast[kind]
+        latency = (f'p50 {stats["p50_ms"]:8.2f}ms  p99 {stats["p99_ms"]:8.2f}ms'
+                   if stats['count'] else 'no responses')
+        print(f'  {mode:<4} {kind:<8} {stats["requests_per_s"]:8.1f} req/s  {latency}  errors {stats["errors"]}')
+    rss = result['peak_rss_bytes']
+    print(f'  {mode:<4} slow uploads completed {completed}/{args.slow_clients}'
+          + (f'  peak RSS {rss / 1024 ** 2:.0f}MB' if rss else ''))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', default='wsgi,asgi', help='comma-separated modes to run (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load per mode')
+    parser.add_argument('--clients', type=int, default=16, help='threads issuing lookups and downloads')
+    parser.add_argument('--slow-clients', type=int, default=200, help='uploads trickled over the whole run')
+    parser.add_argument('--slow-size', default='256KB', help='body size of each slow upload (default: %(default)s)')
+    parser.add_argument('--files', type=int, default=1000, help='file rows seeded for lookups and downloads')
+    parser.add_argument('--download-size', default='256KB', help='size of each seeded file (default: %(default)s)')
+    parser.add_argument('--wsgi-workers', type=int, default=4, help='gunicorn sync workers in wsgi mode')
+    parser.add_argument('--s3-latency', type=float, default=20.0,
+                        help='milliseconds added to every fake S3 call (default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=10.0, help='client timeout per fast request, seconds')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+    args.slow_size = parse_size(args.slow_size)
+    args.download_size = parse_size(args.download_size)
+
+    sys.stdout.reconfigure(line_buffering=True)
+    print(f'{args.slow_clients} slow uploads of {format_size(args.slow_size)} over {args.duration:g}s, '
+          f'{args.clients} clients fetching {format_size(args.download_size)} files, '
+          f'{args.s3_latency:g}ms S3 latency')
+    results = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args),
+        },
+        'modes': [run_mode(mode, args) for mode in args.modes.split(',') if mode],
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Wrote {args.output}')
+
+
+if __name__ == '__main__':
+    main()
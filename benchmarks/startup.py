@@ -0,0 +1,98 @@
+"""Benchmark cold import time of each app, i.e. what every worker boot pays.
+
+Each run imports the app in a fresh interpreter inside a scratch directory
+(so SQLite files start empty on the first run and are reused afterwards,
+like a restarted container), and reports the median wall time. Pass
+--importtime to also print the slowest modules from `python -X importtime`.
+
+    python benchmarks/startup.py --runs 10 app app_modified app_simple
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Dummy credentials: nothing here talks to B2 or OpenAI during import
+ENV = {
+    'B2_KEY_ID': 'benchmark',
+    'B2_APPLICATION_KEY': 'benchmark',
+    'B2_BUCKET': 'benchmark',
+    'B2_ENDPOINT': 'https://s3.us-east-005.backblazeb2.com',
+    'OPENAI_API_KEY': 'benchmark',
+}
+
+TIMER = '''
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+'''
+
+
+def time_import(module, workdir):
+    env = dict(os.environ, **ENV)
+    out = subprocess.run([sys.executable, '-c', TIMER.format(root=ROOT, module=module)],
+                         cwd=workdir, env=env, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(module, workdir, top):
+    env = dict(os.environ, **ENV, PYTHONPATH=ROOT)
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                         cwd=workdir, env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), len(name) - len(name.lstrip()), name.strip()))
+    # Modules the app imports directly (one level below it), so nested
+    # imports are not double counted
+    app_depth = min(depth for _, depth, name in rows if name == module)
+    direct = [(us, name) for us, depth, name in rows if depth == app_depth + 2]
+    return sorted(direct, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('apps', nargs='*', default=['app', 'app_modified', 'app_simple'])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--importtime', action='store_true', help='show the slowest top-level imports')
+    parser.add_argument('--top', type=int, default=8)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = {}
+    for module in args.apps:
+        workdir = tempfile.mkdtemp(prefix=f'startup-{module}-')
+        first = time_import(module, workdir)
+        warm = [time_import(module, workdir) for _ in range(args.runs)]
+        results[module] = {
+            'first_boot_ms': round(first * 1000, 1),
+            'median_ms': round(statistics.median(warm) * 1000, 1),
+            'min_ms': round(min(warm) * 1000, 1),
+        }
+        if args.importtime:
+            results[module]['slowest_imports'] = [
+                {'module': name, 'ms': round(us / 1000, 1)} for us, name in slowest_imports(module, workdir, args.top)
+            ]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f'{"app":<14} {"first boot":>11} {"median":>9} {"min":>9}')
+    for module, r in results.items():
+        print(f'{module:<14} {r["first_boot_ms"]:>9.1f}ms {r["median_ms"]:>7.1f}ms {r["min_ms"]:>7.1f}ms')
+        for imp in r.get('slowest_imports', []):
+            print(f'    {imp["module"]:<30} {imp["ms"]:>8.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
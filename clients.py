@@ -0,0 +1,67 @@
+import os
+import threading
+from contextlib import asynccontextmanager
+
+from metrics import instrument_s3
+
+
+class LazyClient:
+    """Stand-in for an SDK client that is only built on first use.
+
+    Importing boto3 or openai and constructing a client dominates app import
+    time, so the factory (which should do its own imports) runs on the first
+    attribute access instead. The instance is per process: a worker forked
+    from a master that already built one builds its own, rather than sharing
+    connection pools across the fork.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._pid = None
+        self._client = None
+
+    def get(self):
+        """The underlying client, creating it for this process if needed."""
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._client = self._factory()
+                    self._pid = pid
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+def b2_client(endpoint_url, key_id, application_key, max_pool_connections=10):
+    """Build a boto3 S3 client for Backblaze B2 that reports failed calls."""
+    from boto3.session import Session
+    from botocore.config import Config
+    return instrument_s3(Session().client(
+        service_name='s3',
+        endpoint_url=endpoint_url,
+        aws_access_key_id=key_id,
+        aws_secret_access_key=application_key,
+        config=Config(max_pool_connections=max_pool_connections)
+    ))
+
+
+@asynccontextmanager
+async def aio_b2_client(endpoint_url, key_id, application_key, max_pool_connections=10):
+    """aiobotocore counterpart of b2_client, for the asyncio server (asgi.py).
+
+    Used as `async with aio_b2_client(...) as s3:`; the client's connection
+    pool is closed when the block exits.
+    """
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+    async with get_session().create_client(
+        service_name='s3',
+        endpoint_url=endpoint_url,
+        aws_access_key_id=key_id,
+        aws_secret_access_key=application_key,
+        config=AioConfig(max_pool_connections=max_pool_connections)
+    ) as s3:
+        yield instrument_s3(s3)
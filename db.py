@@ -0,0 +1,178 @@
+import os
+import sqlite3
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import SQLITE_LOCK_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# SQLite tuning shared by every app
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', 5.0))  # Seconds to wait on a locked database
+DB_STATEMENT_CACHE = int(os.getenv('DB_STATEMENT_CACHE', 256))  # Prepared statements kept per connection
+
+# One long-lived connection per (thread, database file). Connections are
+# never shared between threads, and ones inherited across a fork (e.g. a
+# gunicorn worker started after init_db ran in the master) are discarded.
+_local = threading.local()
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT, cached_statements=DB_STATEMENT_CACHE)
+    # WAL lets readers proceed while a write is in progress; NORMAL sync is
+    # durable across application crashes and only fsyncs at checkpoints
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}')
+    logger.debug(f"Opened SQLite connection to {path} in thread {threading.get_ident()}")
+    return conn
+
+
+def get_connection(path):
+    """Return this thread's pooled connection to `path`, opening it if needed."""
+    pid = os.getpid()
+    if getattr(_local, 'pid', None) != pid:
+        _local.pid = pid
+        _local.connections = {}
+
+    conn = _local.connections.get(path)
+    if conn is None:
+        conn = _local.connections[path] = _connect(path)
+    return conn
+
+
+class _TimedCursor(sqlite3.Cursor):
+    """Cursor that times the statement opening each write transaction.
+
+    That statement (the first INSERT/UPDATE/DELETE, or an explicit BEGIN
+    IMMEDIATE) is the one that waits for the write lock, so its duration
+    is reported as the lock wait for the database.
+    """
+
+    database = None
+
+    def execute(self, *args):
+        if self.connection.in_transaction:
+            return super().execute(*args)
+        return self._timed(super().execute, args)
+
+    def executemany(self, *args):
+        if self.connection.in_transaction:
+            return super().executemany(*args)
+        return self._timed(super().executemany, args)
+
+    def _timed(self, method, args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self.connection.in_transaction:
+                SQLITE_LOCK_WAIT_SECONDS.labels(self.database).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def cursor(path):
+    """Yield a cursor on the pooled connection and commit when the block ends.
+
+    The transaction is rolled back if the block raises. Blocks must not be
+    nested for the same database in one thread, since they share a
+    connection and the inner block would commit the outer one's work.
+    """
+    conn = get_connection(path)
+    c = conn.cursor(_TimedCursor)
+    c.database = os.path.basename(path)
+    try:
+        yield c
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        c.close()
+
+
+def prefix_range(prefix):
+    """Return (low, high) bounds for an index range scan over `prefix`.
+
+    `col >= low AND col < high` matches the same rows as `col LIKE 'prefix%'`
+    for a case-sensitive column, but SQLite only turns the former into an
+    index seek; LIKE is case-insensitive by default and scans the table.
+    """
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def close_connections():
+    """Close this thread's pooled connections."""
+    for conn in getattr(_local, 'connections', {}).values():
+        conn.close()
+    _local.connections = {}
+
+
+def init_row_counter(c, table):
+    """Maintain `table`'s row count in row_counts via triggers, using an open cursor.
+
+    Reading the counter is a primary-key lookup, where COUNT(*) has to walk
+    the whole table. The counter is seeded from COUNT(*) once, when created.
+    """
+    c.execute('''CREATE TABLE IF NOT EXISTS row_counts (
+        table_name TEXT PRIMARY KEY,
+        row_count INTEGER NOT NULL
+    )''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_count_ai AFTER INSERT ON {table} BEGIN
+        UPDATE row_counts SET row_count = row_count + 1 WHERE table_name = '{table}';
+    END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_count_ad AFTER DELETE ON {table} BEGIN
+        UPDATE row_counts SET row_count = row_count - 1 WHERE table_name = '{table}';
+    END''')
+    c.execute('SELECT 1 FROM row_counts WHERE table_name = ?', (table,))
+    if c.fetchone() is None:
+        c.execute(f'INSERT INTO row_counts (table_name, row_count) SELECT ?, COUNT(*) FROM {table}', (table,))
+
+
+def row_count(path, table):
+    """Row count maintained by init_row_counter()."""
+    with cursor(path) as c:
+        c.execute('SELECT row_count FROM row_counts WHERE table_name = ?', (table,))
+        row = c.fetchone()
+    return row[0] if row else 0
+
+
+def _schema_version(path, name):
+    try:
+        with cursor(path) as c:
+            c.execute('SELECT version FROM schema_versions WHERE name = ?', (name,))
+            row = c.fetchone()
+    except sqlite3.OperationalError:
+        # No schema_versions table yet
+        return None
+    return row[0] if row else None
+
+
+def migrate(path, name, version, apply):
+    """Run `apply(cursor)` unless schema `name` is already at `version`.
+
+    The common case, a current schema, costs one primary-key lookup, so
+    worker boots skip the CREATE/PRAGMA/ALTER checks entirely. Migrations
+    run inside BEGIN IMMEDIATE, so workers booting together apply them once.
+    Bump `version` whenever `apply` changes. Returns True if it ran.
+    """
+    if _schema_version(path, name) == version:
+        return False
+
+    with cursor(path) as c:
+        c.execute('BEGIN IMMEDIATE')
+        c.execute('''CREATE TABLE IF NOT EXISTS schema_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )''')
+        c.execute('SELECT version FROM schema_versions WHERE name = ?', (name,))
+        row = c.fetchone()
+        if row and row[0] == version:
+            return False
+        apply(c)
+        c.execute('''INSERT INTO schema_versions (name, version) VALUES (?, ?)
+                     ON CONFLICT(name) DO UPDATE SET version = excluded.version''', (name, version))
+    logger.info(f"Migrated {path} schema {name} to version {version}")
+    return True
@@ -0,0 +1,259 @@
+import os
+import errno
+import hashlib
+import logging
+import tempfile
+import time
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; single-flight is then per process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Unset disables the cache
+DISK_CACHE_DIR = os.getenv('DISK_CACHE_DIR')
+DISK_CACHE_MAX_BYTES = int(os.getenv('DISK_CACHE_MAX_BYTES', 10 * 1024 * 1024 * 1024))  # 10GB
+# Larger objects are always streamed from B2 so one video cannot flush the cache
+DISK_CACHE_MAX_OBJECT = int(os.getenv('DISK_CACHE_MAX_OBJECT', 512 * 1024 * 1024))  # 512MB
+# Eviction frees space down to this fraction of the cap, so it runs rarely
+DISK_CACHE_LOW_WATERMARK = 0.9
+# Background fills running at once per process; misses beyond it are not cached
+DISK_CACHE_FILL_WORKERS = int(os.getenv('DISK_CACHE_FILL_WORKERS', 4))
+
+FILL_CHUNK_SIZE = 1024 * 1024
+
+
+class DiskCache:
+    """Content-addressed cache of B2 objects on local disk, keyed by SHA-256.
+
+    Files are filled through a temp file that is verified against its hash and
+    renamed into place, so a reader never sees a partial object. Concurrent
+    misses for one hash download it once: threads wait on an in-process lock
+    and other worker processes on a flock. Recency is the file's mtime, which
+    hits refresh, and eviction removes the least recently used files once the
+    cache grows past `max_bytes`.
+    """
+
+    def __init__(self, directory, s3, bucket, max_bytes=DISK_CACHE_MAX_BYTES,
+                 max_object_size=DISK_CACHE_MAX_OBJECT, fill_workers=DISK_CACHE_FILL_WORKERS):
+        self.directory = directory
+        self.s3 = s3
+        self.bucket = bucket
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self.fill_workers = fill_workers
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._filling = set()
+        self._filling_lock = threading.Lock()
+        self._size_lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'tmp'), exist_ok=True)
+        os.makedirs(os.path.join(directory, 'locks'), exist_ok=True)
+        self._remove_stale_temp_files()
+        self._size = self._scan_size()
+
+    def accepts(self, size):
+        """Whether an object of `size` bytes is worth caching."""
+        return size is not None and size <= self.max_object_size
+
+    def path_for(self, filehash):
+        return os.path.join(self.directory, filehash[:2], filehash)
+
+    def get(self, filehash):
+        """Path of the cached object, or None on a miss."""
+        path = self.path_for(filehash)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def fetch(self, filehash, key):
+        """Path of the cached object, downloading it from B2 on a miss."""
+        path = self.get(filehash)
+        if path:
+            return path
+
+        with self._thread_lock(filehash), self._process_lock(filehash):
+            # Another thread or worker may have filled it while we waited
+            path = self.get(filehash)
+            if path:
+                return path
+            size = self._fill(filehash, key)
+
+        with self._size_lock:
+            self._size += size
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+        return self.path_for(filehash)
+
+    def fill_in_background(self, filehash, key):
+        """Start caching an object on a background thread, so a miss need not wait for it.
+
+        Returns False when the object is already being filled here or all
+        `fill_workers` are busy; a later miss will try again.
+        """
+        with self._filling_lock:
+            if filehash in self._filling or len(self._filling) >= self.fill_workers:
+                return False
+            self._filling.add(filehash)
+        threading.Thread(target=self._fill_in_background, args=(filehash, key),
+                         name='disk-cache-fill', daemon=True).start()
+        return True
+
+    def _fill_in_background(self, filehash, key):
+        try:
+            self.fetch(filehash, key)
+        except Exception as e:
+            logger.warning(f"Background disk cache fill failed for {key}: {e}")
+        finally:
+            with self._filling_lock:
+                self._filling.discard(filehash)
+
+    def _fill(self, filehash, key):
+        path = self.path_for(filehash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.directory, 'tmp'))
+        try:
+            hasher = hashlib.sha256()
+            size = 0
+            body = self.s3.get_object(Bucket=self.bucket, Key=key)['Body']
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in body.iter_chunks(FILL_CHUNK_SIZE):
+                        hasher.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+            finally:
+                body.close()
+
+            if hasher.hexdigest() != filehash:
+                raise ValueError(f"Object {key} does not match its hash {filehash}")
+            os.replace(tmp_path, path)
+            logger.info(f"Cached {key} on disk ({size} bytes)")
+            return size
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def evict(self):
+        """Delete least recently used files until the cache is under its low watermark."""
+        entries = []
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir() or shard.name in ('tmp', 'locks'):
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * DISK_CACHE_LOW_WATERMARK
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+
+        with self._size_lock:
+            self._size = total
+        if removed:
+            logger.info(f"Evicted {removed} files from the disk cache, {total} bytes remain")
+
+    def stats(self):
+        with self._size_lock:
+            return {'bytes': self._size, 'max_bytes': self.max_bytes}
+
+    def _remove_stale_temp_files(self, max_age=3600):
+        # Left behind by workers killed mid-fill; recent ones may still be in use
+        cutoff = time.time() - max_age
+        for entry in os.scandir(os.path.join(self.directory, 'tmp')):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _scan_size(self):
+        total = 0
+        for root, dirs, files in os.walk(self.directory):
+            dirs[:] = [d for d in dirs if d not in ('tmp', 'locks')]
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+        return total
+
+    def _thread_lock(self, filehash):
+        with self._locks_guard:
+            lock = self._locks.get(filehash)
+            if lock is None:
+                lock = self._locks[filehash] = _RefCountedLock(self._locks, self._locks_guard, filehash)
+            lock.refs += 1
+            return lock
+
+    def _process_lock(self, filehash):
+        # Lock files are striped by hash prefix so they never need cleaning up
+        return _FileLock(os.path.join(self.directory, 'locks', filehash[:4])) if fcntl else _NullLock()
+
+
+class _RefCountedLock:
+    """Per-hash lock that removes itself from the table once nobody holds it."""
+
+    def __init__(self, table, guard, key):
+        self.table = table
+        self.guard = guard
+        self.key = key
+        self.refs = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.lock.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+        with self.guard:
+            self.refs -= 1
+            if self.refs == 0:
+                self.table.pop(self.key, None)
+
+
+class _FileLock:
+    """Exclusive flock, shared by all worker processes using the cache."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.f = open(self.path, 'a')
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+
+
+class _NullLock:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
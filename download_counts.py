@@ -0,0 +1,107 @@
+import os
+import atexit
+import logging
+import threading
+
+import db
+
+logger = logging.getLogger(__name__)
+
+# Download counts are buffered in memory and written in one transaction
+# every DOWNLOAD_COUNT_FLUSH_MS or once DOWNLOAD_COUNT_FLUSH_EVENTS
+# increments are pending, whichever comes first
+DOWNLOAD_COUNT_FLUSH_MS = int(os.getenv('DOWNLOAD_COUNT_FLUSH_MS', 1000))
+DOWNLOAD_COUNT_FLUSH_EVENTS = int(os.getenv('DOWNLOAD_COUNT_FLUSH_EVENTS', 100))
+
+
+class DownloadCounter:
+    """Write-behind buffer for `download_count` increments keyed by filehash.
+
+    Page views only touch an in-process dict; a background thread folds the
+    buffered increments into the database, so reads never wait on a SQLite
+    write. Increments still buffered when a worker is killed are lost, which
+    is acceptable for a view counter. `on_flush`, if given, is called with
+    the filehashes whose counts were just committed.
+    """
+
+    def __init__(self, db_path, table='files', interval_ms=DOWNLOAD_COUNT_FLUSH_MS,
+                 max_pending=DOWNLOAD_COUNT_FLUSH_EVENTS, on_flush=None):
+        self.db_path = db_path
+        self.table = table
+        self.interval = interval_ms / 1000
+        self.max_pending = max_pending
+        self.on_flush = on_flush
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flushing = {}
+        self._events = 0
+        self._wake = threading.Event()
+        self._pid = None
+        atexit.register(self.flush)
+
+    def increment(self, filehash, n=1):
+        """Record `n` downloads and return how many are not yet in the database."""
+        self._ensure_flusher()
+        with self._lock:
+            count = self._pending[filehash] = self._pending.get(filehash, 0) + n
+            self._events += n
+            if self._events >= self.max_pending:
+                self._wake.set()
+            return count + self._flushing.get(filehash, 0)
+
+    def pending(self, filehash):
+        """Downloads of `filehash` recorded but not yet committed."""
+        with self._lock:
+            return self._pending.get(filehash, 0) + self._flushing.get(filehash, 0)
+
+    def live_count(self, filehash, stored_count):
+        """Approximate current count: the stored value plus buffered increments."""
+        return (stored_count or 0) + self.pending(filehash)
+
+    def flush(self):
+        """Write all buffered increments in a single transaction."""
+        with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending, self._events = self._pending, {}, 0
+            self._flushing = batch
+
+        try:
+            with db.cursor(self.db_path) as c:
+                c.executemany(
+                    f'UPDATE {self.table} SET download_count = COALESCE(download_count, 0) + ? WHERE filehash = ?',
+                    [(n, filehash) for filehash, n in batch.items()])
+        except Exception as e:
+            logger.error(f"Failed to flush {len(batch)} download counts, will retry: {e}")
+            with self._lock:
+                for filehash, n in batch.items():
+                    self._pending[filehash] = self._pending.get(filehash, 0) + n
+                    self._events += n
+                self._flushing = {}
+            return 0
+
+        # Readers must not combine a stale stored count with the now smaller pending one
+        if self.on_flush:
+            self.on_flush(batch)
+        with self._lock:
+            self._flushing = {}
+        logger.debug(f"Flushed download counts for {len(batch)} files")
+        return len(batch)
+
+    def _ensure_flusher(self):
+        # Threads do not survive a fork, so each worker starts its own
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            self._pending, self._flushing, self._events = {}, {}, 0
+            threading.Thread(target=self._run, name='download-count-flusher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
@@ -0,0 +1,277 @@
+import os
+import io
+import time
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Epilogue, NeedData
+
+# Bytes read from the client socket per call while parsing an upload
+RECEIVE_CHUNK_SIZE = int(os.getenv('RECEIVE_CHUNK_SIZE', 256 * 1024))  # 256KB
+# Ordinary form fields are held in memory, so they are kept small
+MAX_FIELD_SIZE = 64 * 1024
+
+
+class FormStreamError(Exception):
+    """A malformed or unacceptable upload body, with the HTTP status to return."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _MultipartReader:
+    """Decoder state shared by the blocking and asyncio form readers.
+
+    Subclasses only supply the I/O: pulling the next block of the body from
+    their stream and handing it to _feed().
+    """
+
+    def __init__(self, content_type, content_length=None, chunk_size=RECEIVE_CHUNK_SIZE):
+        mimetype, options = parse_options_header(content_type or '')
+        if mimetype != 'multipart/form-data' or not options.get('boundary'):
+            raise FormStreamError('Expected a multipart/form-data body')
+        self._decoder = MultipartDecoder(options['boundary'].encode())
+        self._delimiter = b'--' + options['boundary'].encode()
+        self._content_length = content_length
+        self._chunk_size = chunk_size
+        self._chunk = memoryview(b'')
+        self._file_done = True
+        self._done = False
+        self.fields = {}
+        self.filename = None
+        self.content_type = None
+        self.bytes_received = 0
+        self.receive_seconds = 0.0  # Time spent waiting on the client
+
+    def _feed(self, data, seconds):
+        self.receive_seconds += seconds
+        self.bytes_received += len(data)
+        # None marks the end of the body; the decoder raises if it was cut short
+        self._decoder.receive_data(data or None)
+
+    def _boundary_incomplete(self):
+        # MultipartDecoder emits the CR in front of a boundary as part data
+        # when the buffer ends between the boundary and its line break, so
+        # such a buffer is topped up before asking it for events. A buffer
+        # shorter than a delimiter line may be the start of one: for an
+        # empty part the line break ending the headers is also the one in
+        # front of the next delimiter, and decoding it alone would take it
+        # as the start of the data and the delimiter as file content.
+        buffer = self._decoder.buffer
+        if len(buffer) < len(self._delimiter) + 4:
+            return True
+        i = buffer.rfind(self._delimiter)
+        return i != -1 and buffer.find(b'\n', i) == -1
+
+    def _decode(self):
+        """The next event, or None when the decoder needs more of the body."""
+        if not self._decoder.complete and self._boundary_incomplete():
+            return None
+        try:
+            event = self._decoder.next_event()
+        except ValueError as e:
+            raise FormStreamError(f'Malformed multipart body: {e}')
+        return None if isinstance(event, NeedData) else event
+
+    def _add_field_data(self, name, value, event):
+        """Append a Data event to a field value; True once the field is complete."""
+        value += event.data
+        if len(value) > MAX_FIELD_SIZE:
+            raise FormStreamError(f'Form field {name!r} is too large', 413)
+        if event.more_data:
+            return False
+        self.fields[name] = value.decode('utf-8', 'replace')
+        return True
+
+    def _start_file(self, event, name):
+        """Handle a part header while looking for file `name` (or any file if None); True on a match."""
+        if isinstance(event, File) and (name is None or event.name == name):
+            self.filename = event.filename
+            self.content_type = event.headers.get('Content-Type')
+            self._file_done = False
+            return True
+        return False
+
+    def _take(self, size):
+        """Up to `size` bytes of the file from the current chunk."""
+        data = self._chunk[:size]
+        self._chunk = self._chunk[len(data):]
+        return data
+
+    def size_hint(self):
+        """Upper bound on the file's remaining bytes, from Content-Length; None if unknown."""
+        if self._content_length is None:
+            return None
+        consumed = self.bytes_received - len(self._decoder.buffer) - len(self._chunk)
+        return max(0, self._content_length - consumed)
+
+
+class StreamingForm(_MultipartReader, io.RawIOBase):
+    """Reads a multipart/form-data body straight off the request stream.
+
+    Unlike request.files, nothing is spooled to memory or a temp file before
+    the view runs: open_file() parses up to the file part, and the object is
+    then a readable stream of that file's bytes, decoded as they arrive from
+    the client. Fields sent before the file are in `fields` at that point;
+    finish() reads the rest of the body for any that follow it.
+    """
+
+    def __init__(self, stream, content_type, content_length=None, chunk_size=RECEIVE_CHUNK_SIZE):
+        super().__init__(content_type, content_length, chunk_size)
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def _next_event(self):
+        while True:
+            event = self._decode()
+            if event is not None:
+                return event
+            start = time.perf_counter()
+            data = self._stream.read(self._chunk_size)
+            self._feed(data, time.perf_counter() - start)
+
+    def _read_field(self, name):
+        value = bytearray()
+        while not self._add_field_data(name, value, self._next_event()):
+            pass
+
+    def _skip_file(self):
+        while self._next_event().more_data:
+            pass
+
+    def _skip_part(self, event):
+        """Consume a part that is not the file being read; True at the end of the body."""
+        if isinstance(event, Field):
+            self._read_field(event.name)
+        elif isinstance(event, File):
+            self._skip_file()
+        elif isinstance(event, Epilogue):
+            self._done = True
+        return self._done
+
+    def open_file(self, name='file'):
+        """Read up to the start of the next file field `name`; False if the body has none.
+
+        Any unread rest of the current file is skipped first, so calling this
+        again moves on to the next file; `name=None` matches every file field.
+        """
+        self._skip_rest_of_file()
+        while not self._done:
+            event = self._next_event()
+            if self._start_file(event, name):
+                return True
+            self._skip_part(event)
+        return False
+
+    def _skip_rest_of_file(self):
+        self._chunk = memoryview(b'')
+        while not self._file_done:
+            self._file_done = not self._next_event().more_data
+
+    def at_eof(self):
+        """Whether the file part has no more bytes (e.g. an empty upload)."""
+        self._fill()
+        return not self._chunk
+
+    def _fill(self):
+        while not self._chunk and not self._file_done:
+            event = self._next_event()
+            self._chunk = memoryview(event.data)
+            self._file_done = not event.more_data
+
+    def readinto(self, buffer):
+        self._fill()
+        data = self._take(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def finish(self):
+        """Read the rest of the body, collecting any fields that follow the file."""
+        self._skip_rest_of_file()
+        while not self._done:
+            self._skip_part(self._next_event())
+        return self.fields
+
+
+class AsyncStreamingForm(_MultipartReader):
+    """StreamingForm for asyncio servers, reading an async iterator of body chunks.
+
+    `chunks` is e.g. Starlette's request.stream(), which ends with an empty
+    chunk. The methods mirror StreamingForm's as coroutines; read() returns
+    the file's bytes as memoryviews into the decoded chunks instead of
+    filling a caller's buffer.
+    """
+
+    def __init__(self, chunks, content_type, content_length=None):
+        super().__init__(content_type, content_length)
+        self._chunks = chunks.__aiter__()
+
+    async def _next_event(self):
+        while True:
+            event = self._decode()
+            if event is not None:
+                return event
+            start = time.perf_counter()
+            try:
+                data = await self._chunks.__anext__()
+            except StopAsyncIteration:
+                data = b''
+            self._feed(data, time.perf_counter() - start)
+
+    async def _read_field(self, name):
+        value = bytearray()
+        while not self._add_field_data(name, value, await self._next_event()):
+            pass
+
+    async def _skip_file(self):
+        while (await self._next_event()).more_data:
+            pass
+
+    async def _skip_part(self, event):
+        if isinstance(event, Field):
+            await self._read_field(event.name)
+        elif isinstance(event, File):
+            await self._skip_file()
+        elif isinstance(event, Epilogue):
+            self._done = True
+        return self._done
+
+    async def open_file(self, name='file'):
+        """Read up to the start of the next file field `name`; False if the body has none."""
+        await self._skip_rest_of_file()
+        while not self._done:
+            event = await self._next_event()
+            if self._start_file(event, name):
+                return True
+            await self._skip_part(event)
+        return False
+
+    async def _skip_rest_of_file(self):
+        self._chunk = memoryview(b'')
+        while not self._file_done:
+            self._file_done = not (await self._next_event()).more_data
+
+    async def at_eof(self):
+        """Whether the file part has no more bytes (e.g. an empty upload)."""
+        await self._fill()
+        return not self._chunk
+
+    async def _fill(self):
+        while not self._chunk and not self._file_done:
+            event = await self._next_event()
+            self._chunk = memoryview(event.data)
+            self._file_done = not event.more_data
+
+    async def read(self, size):
+        """Up to `size` bytes of the file; empty once the file part has ended."""
+        await self._fill()
+        return self._take(size)
+
+    async def finish(self):
+        """Read the rest of the body, collecting any fields that follow the file."""
+        await self._skip_rest_of_file()
+        while not self._done:
+            await self._skip_part(await self._next_event())
+        return self.fields
@@ -7,6 +7,7 @@ import { Textarea } from './components/ui/textarea';
 import { Badge } from './components/ui/badge';
 import { Alert, AlertDescription } from './components/ui/alert';
 import { Progress } from './components/ui/progress';
+import { uploadResumable, waitForTags } from './lib/upload';
 import './App.css';
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:5000';
@@ -16,6 +17,7 @@ function App() {
   const [description, setDescription] = useState('');
   const [uploading, setUploading] = useState(false);
   const [uploadProgress, setUploadProgress] = useState(0);
+  const [uploadPhase, setUploadPhase] = useState('uploading');
   const [uploadResult, setUploadResult] = useState(null);
   const [error, setError] = useState(null);
   const [recentUploads, setRecentUploads] = useState([]);
@@ -40,44 +42,38 @@ function App() {
     setError(null);
     setUploadProgress(0);
 
-    const formData = new FormData();
-    formData.append('file', file);
-    formData.append('description', description);
-
     try {
-      const xhr = new XMLHttpRequest();
-      
-      xhr.upload.addEventListener('progress', (e) => {
-        if (e.lengthComputable) {
-          const percentComplete = (e.loaded / e.total) * 100;
-          setUploadProgress(percentComplete);
-        }
-      });
-
-      xhr.addEventListener('load', () => {
-        if (xhr.status === 200) {
-          const result = JSON.parse(xhr.responseText);
-          setUploadResult(result);
-          setFile(null);
-          setDescription('');
-          document.getElementById('file-input').value = '';
-          fetchRecentUploads();
-        } else {
-          const errorData = JSON.parse(xhr.responseText);
-          setError(errorData.error || 'Upload failed');
-        }
-        setUploading(false);
-      });
-
-      xhr.addEventListener('error', () => {
-        setError('Network error occurred');
-        setUploading(false);
+      const result = await uploadResumable(file, {
+        apiUrl: API_URL,
+        description,
+        onHashProgress: (percent) => {
+          setUploadPhase('hashing');
+          setUploadProgress(percent);
+        },
+        onProgress: (percent) => {
+          setUploadPhase('uploading');
+          setUploadProgress(percent);
+        },
       });
+      setUploadResult(result);
+      setFile(null);
+      setDescription('');
+      document.getElementById('file-input').value = '';
+      fetchRecentUploads();
 
-      xhr.open('POST', `${API_URL}/api/upload`);
-      xhr.send(formData);
+      if (result.tagging === 'pending') {
+        waitForTags(result.hash, { apiUrl: API_URL }).then((tagged) => {
+          setUploadResult((current) =>
+            current && current.hash === result.hash
+              ? { ...current, tags: tagged ? tagged.tags : [], tagging: tagged ? tagged.status : 'timeout' }
+              : current
+          );
+          if (tagged) fetchRecentUploads();
+        });
+      }
     } catch (err) {
-      setError(err.message);
+      setError(`${err.message}. Select the same file again to resume.`);
+    } finally {
       setUploading(false);
     }
   };
@@ -169,7 +165,7 @@ function App() {
               {uploading && (
                 <div className="space-y-2">
                   <div className="flex items-center justify-between text-sm">
-                    <span>Uploading...</span>
+                    <span>{uploadPhase === 'hashing' ? 'Checking file...' : 'Uploading...'}</span>
                     <span>{Math.round(uploadProgress)}%</span>
                   </div>
                   <Progress value={uploadProgress} className="h-2" />
@@ -218,6 +214,13 @@ function App() {
                   <p className="text-sm text-muted-foreground">File: {uploadResult.filename}</p>
                   <p className="text-sm text-muted-foreground">Size: {uploadResult.size}</p>
                   
+                  {uploadResult.tagging === 'pending' && (
+                    <p className="text-sm text-muted-foreground flex items-center gap-2">
+                      <Tag className="w-4 h-4" />
+                      Generating tags...
+                    </p>
+                  )}
+
                   {uploadResult.tags && uploadResult.tags.length > 0 && (
                     <div className="space-y-2">
                       <p className="text-sm font-medium flex items-center gap-2">
@@ -0,0 +1,173 @@
+// Resumable uploads against the /api/upload/sessions API: the file is sent
+// as numbered parts, so a dropped connection only retries the current part
+// and a reload can resume a session that is still active on the server.
+// New uploads are hashed in a Web Worker first, and content the server
+// already has completes without sending any bytes. Small files are one-part
+// sessions, so they resume the same way.
+
+const MAX_PART_ATTEMPTS = 5;
+
+const resumeKey = (file) => `omnisora-upload:${file.name}:${file.size}:${file.lastModified}`;
+
+const readJSON = async (response) => {
+  const data = await response.json();
+  if (!response.ok) {
+    throw new Error(data.error || `Request failed (${response.status})`);
+  }
+  return data;
+};
+
+const findSavedSession = async (apiUrl, file) => {
+  const savedId = localStorage.getItem(resumeKey(file));
+  if (!savedId) return null;
+
+  const response = await fetch(`${apiUrl}/api/upload/sessions/${savedId}`);
+  if (response.ok) {
+    const session = await response.json();
+    if (session.status === 'active') {
+      return session;
+    }
+  }
+  localStorage.removeItem(resumeKey(file));
+  return null;
+};
+
+export const hashFile = (file, onProgress = () => {}) =>
+  new Promise((resolve, reject) => {
+    const worker = new Worker(new URL('../workers/hash.worker.js', import.meta.url), { type: 'module' });
+    worker.onmessage = ({ data }) => {
+      if (data.type === 'progress') {
+        onProgress((data.loaded / file.size) * 100);
+        return;
+      }
+      worker.terminate();
+      if (data.type === 'done') {
+        resolve(data.sha256);
+      } else {
+        reject(new Error(data.message || 'Hashing failed'));
+      }
+    };
+    worker.onerror = (e) => {
+      worker.terminate();
+      reject(new Error(e.message || 'Hashing failed'));
+    };
+    worker.postMessage({ file });
+  });
+
+const preflight = async (apiUrl, sha256, size) =>
+  readJSON(await fetch(`${apiUrl}/api/upload/preflight?sha256=${sha256}&size=${size}`));
+
+const startSession = async (apiUrl, file, description, sha256) => {
+  const session = await readJSON(
+    await fetch(`${apiUrl}/api/upload/sessions`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        filename: file.name,
+        size: file.size,
+        contentType: file.type,
+        description,
+        sha256,
+      }),
+    })
+  );
+  if (session.sessionId) {
+    localStorage.setItem(resumeKey(file), session.sessionId);
+  }
+  return session;
+};
+
+const putPart = (url, blob, onProgress) =>
+  new Promise((resolve, reject) => {
+    const xhr = new XMLHttpRequest();
+    xhr.upload.addEventListener('progress', (e) => onProgress(e.loaded));
+    xhr.addEventListener('load', () => {
+      if (xhr.status === 200) {
+        resolve(JSON.parse(xhr.responseText));
+      } else {
+        const error = new Error(JSON.parse(xhr.responseText).error || 'Upload failed');
+        error.retryable = xhr.status >= 500;
+        reject(error);
+      }
+    });
+    xhr.addEventListener('error', () => {
+      const error = new Error('Network error occurred');
+      error.retryable = true;
+      reject(error);
+    });
+    xhr.open('PUT', url);
+    xhr.send(blob);
+  });
+
+const putPartWithRetry = async (url, blob, onProgress) => {
+  for (let attempt = 1; ; attempt++) {
+    try {
+      return await putPart(url, blob, onProgress);
+    } catch (err) {
+      if (!err.retryable || attempt >= MAX_PART_ATTEMPTS) {
+        throw err;
+      }
+      onProgress(0);
+      await new Promise((resolve) => setTimeout(resolve, 1000 * 2 ** (attempt - 1)));
+    }
+  }
+};
+
+export async function uploadResumable(
+  file,
+  { apiUrl, description = '', onProgress = () => {}, onHashProgress = () => {} }
+) {
+  // A session saved by an interrupted attempt resumes without re-hashing
+  let session = await findSavedSession(apiUrl, file);
+  if (!session) {
+    const sha256 = await hashFile(file, onHashProgress);
+    const known = await preflight(apiUrl, sha256, file.size);
+    if (known.exists) {
+      return known;
+    }
+    session = await startSession(apiUrl, file, description, sha256);
+    if (session.status === 'complete') {
+      return session;
+    }
+  }
+
+  const completedParts = new Set(session.completedParts);
+  let uploaded = session.bytesReceived;
+  onProgress((uploaded / file.size) * 100);
+
+  for (let partNumber = 1; partNumber <= session.partCount; partNumber++) {
+    if (completedParts.has(partNumber)) continue;
+
+    const start = (partNumber - 1) * session.partSize;
+    const blob = file.slice(start, Math.min(start + session.partSize, file.size));
+    await putPartWithRetry(
+      `${apiUrl}/api/upload/sessions/${session.sessionId}/parts/${partNumber}`,
+      blob,
+      (loaded) => onProgress(((uploaded + loaded) / file.size) * 100)
+    );
+    uploaded += blob.size;
+  }
+
+  const result = await readJSON(
+    await fetch(`${apiUrl}/api/upload/sessions/${session.sessionId}/complete`, { method: 'POST' })
+  );
+  localStorage.removeItem(resumeKey(file));
+  return result;
+}
+
+// AI tags are generated in the background after an upload; poll until the
+// tagging job settles or we give up.
+export async function waitForTags(hash, { apiUrl, interval = 2000, timeout = 60000 }) {
+  const deadline = Date.now() + timeout;
+  while (Date.now() < deadline) {
+    const response = await fetch(`${apiUrl}/api/files/${hash}/tags`);
+    if (response.ok) {
+      const data = await response.json();
+      if (data.status !== 'pending' && data.status !== 'running') {
+        return data;
+      }
+    }
+    await new Promise((resolve) => setTimeout(resolve, interval));
+  }
+  return null;
+}
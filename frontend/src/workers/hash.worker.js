@@ -0,0 +1,19 @@
+// Hashes a File off the main thread, reading it in fixed-size slices so
+// memory use does not grow with the file size.
+import { Sha256 } from '../lib/sha256';
+
+const READ_CHUNK_SIZE = 4 * 1024 * 1024;
+
+self.onmessage = async ({ data: { file } }) => {
+  try {
+    const hasher = new Sha256();
+    for (let offset = 0; offset < file.size; offset += READ_CHUNK_SIZE) {
+      const chunk = await file.slice(offset, offset + READ_CHUNK_SIZE).arrayBuffer();
+      hasher.update(new Uint8Array(chunk));
+      self.postMessage({ type: 'progress', loaded: Math.min(offset + READ_CHUNK_SIZE, file.size) });
+    }
+    self.postMessage({ type: 'done', sha256: hasher.hexDigest() });
+  } catch (err) {
+    self.postMessage({ type: 'error', message: err.message });
+  }
+};
@@ -0,0 +1,20 @@
+import os
+import shutil
+import tempfile
+
+# Each worker writes its metrics to files here and /metrics sums them (see
+# metrics.py). It must be set before any worker imports prometheus_client
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'prometheus_multiproc'))
+
+
+def on_starting(server):
+    """Start from an empty metrics directory so old runs are not counted."""
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def child_exit(server, worker):
+    """Drop a dead worker's live gauges (e.g. uploads in flight) from /metrics."""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,87 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background readiness checks
+HEALTH_CHECK_INTERVAL = float(os.getenv('HEALTH_CHECK_INTERVAL', 15))
+
+
+class HealthMonitor:
+    """Runs readiness checks on a background thread and caches the last result.
+
+    `checks` maps a name to a callable that raises on failure and may return
+    a value to report (e.g. a row count). Probes read the cached snapshot, so
+    they cost no I/O however often the load balancer calls them.
+    """
+
+    def __init__(self, checks, interval=HEALTH_CHECK_INTERVAL):
+        self.checks = checks
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last = None
+        self._pid = None
+
+    def run_checks(self):
+        """Run every check now and cache the result."""
+        results = {}
+        for name, check in self.checks.items():
+            start = time.perf_counter()
+            try:
+                value = check()
+                results[name] = {'ok': True}
+                if value is not None:
+                    results[name]['value'] = value
+            except Exception as e:
+                logger.warning(f"Readiness check {name} failed: {e}")
+                results[name] = {'ok': False, 'error': str(e)}
+            results[name]['latency_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+        snapshot = {
+            'healthy': all(r['ok'] for r in results.values()),
+            'checks': results,
+            'checked_at': datetime.utcnow().isoformat(),
+            'monotonic': time.monotonic()
+        }
+        with self._lock:
+            self._last = snapshot
+        return snapshot
+
+    def snapshot(self):
+        """The cached result, or a fresh one if no check has completed yet.
+
+        A snapshot older than three intervals means the checker thread has
+        stalled, and is reported as unhealthy.
+        """
+        self._ensure_checker()
+        with self._lock:
+            last = self._last
+        if last is None:
+            last = self.run_checks()
+
+        age = time.monotonic() - last['monotonic']
+        result = {k: v for k, v in last.items() if k != 'monotonic'}
+        result['age_seconds'] = round(age, 1)
+        if age > self.interval * 3:
+            result['healthy'] = False
+            result['error'] = 'Health checks are stale'
+        return result
+
+    def _ensure_checker(self):
+        # Threads do not survive a fork, so each worker starts its own
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            threading.Thread(target=self._run, name='health-checker', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self.run_checks()
+            time.sleep(self.interval)
@@ -0,0 +1,70 @@
+import os
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest, multiprocess)
+
+# When set (gunicorn.conf.py does so before any worker imports the app),
+# prometheus_client keeps each worker's samples in files in this directory
+# and /metrics adds them up across processes
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+# Uploads range from kilobytes to terabytes, so stages span ms to minutes
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+MB = 1024 * 1024
+PART_SIZE_BUCKETS = (MB, 5 * MB, 10 * MB, 25 * MB, 50 * MB, 100 * MB, 250 * MB, 500 * MB, 1024 * MB, 5120 * MB)
+PART_COUNT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2500, 5000, 10000)
+LOCK_WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# receive: waiting on the client for the request body; hash: SHA-256 of each
+# part; upload_part: each PUT to B2 (a small file's single PUT counts as one
+# part); complete: CompleteMultipartUpload; move: the server-side copy from
+# the temporary to the hash-derived key; db_write: SQLite writes recording
+# the upload
+UPLOAD_STAGE_SECONDS = Histogram('upload_stage_seconds', 'Time spent in each upload stage',
+                                 ['stage'], buckets=STAGE_BUCKETS)
+UPLOAD_BYTES = Counter('upload_bytes', 'Upload bytes read from clients and sent to B2',
+                       ['direction'])
+UPLOADS_IN_FLIGHT = Gauge('uploads_in_flight', 'Uploads currently being processed',
+                          multiprocess_mode='livesum')
+UPLOAD_PARTS_IN_FLIGHT = Gauge('upload_parts_in_flight', 'Part PUTs to B2 currently in progress',
+                               multiprocess_mode='livesum')
+
+# The plan chosen for each upload as it starts, by method (single PUT,
+# multipart or resumable session); uploads of unknown size have no part count
+UPLOAD_PART_SIZE_BYTES = Histogram('upload_part_size_bytes', 'Part size chosen for each upload',
+                                   ['method'], buckets=PART_SIZE_BUCKETS)
+UPLOAD_PART_COUNT = Histogram('upload_part_count', 'Number of parts planned for each upload',
+                              ['method'], buckets=PART_COUNT_BUCKETS)
+
+# Duration of the statement that opens each write transaction, which is
+# almost entirely the wait for SQLite's write lock under contention
+SQLITE_LOCK_WAIT_SECONDS = Histogram('sqlite_lock_wait_seconds', 'Time to acquire the SQLite write lock',
+                                     ['database'], buckets=LOCK_WAIT_BUCKETS)
+
+B2_ERRORS = Counter('b2_errors', 'Failed B2 API calls', ['operation', 'code'])
+
+
+def instrument_s3(s3):
+    """Count failed calls made by a boto3 client in B2_ERRORS."""
+    def after_call(http_response, parsed, model, **kwargs):
+        if http_response.status_code >= 400:
+            code = parsed.get('Error', {}).get('Code') or str(http_response.status_code)
+            B2_ERRORS.labels(model.name, code).inc()
+
+    def after_call_error(event_name, exception, **kwargs):
+        # Connection failures and timeouts, after botocore's own retries
+        B2_ERRORS.labels(event_name.rsplit('.', 1)[-1], type(exception).__name__).inc()
+
+    s3.meta.events.register('after-call.s3', after_call)
+    s3.meta.events.register('after-call-error.s3', after_call_error)
+    return s3
+
+
+def render():
+    """Return (body, content_type) for a /metrics response."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,93 @@
+import json
+import base64
+import binascii
+
+import db
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+EXPORT_BATCH_SIZE = 1000
+
+
+class InvalidCursor(ValueError):
+    """A pagination cursor that could not be decoded."""
+
+
+def encode_cursor(sort_value, row_id):
+    """Opaque token for the position after (sort_value, row_id)."""
+    raw = json.dumps([sort_value, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor(); raises InvalidCursor on a malformed token."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        sort_value, row_id = json.loads(raw)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise InvalidCursor('Invalid cursor') from e
+    if not isinstance(row_id, int):
+        raise InvalidCursor('Invalid cursor')
+    return sort_value, row_id
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    """Parse a ?limit= argument, clamped to 1..MAX_PAGE_SIZE."""
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return default
+
+
+def fetch_page(db_path, table, columns, sort_column, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Return (rows, next_cursor) for one page, newest first.
+
+    Seeks past the cursor on the ({sort_column}, id) index instead of using
+    OFFSET, so page 10,000 costs the same as page 1. Each row is `columns`
+    followed by the sort value and id; next_cursor is None on the last page.
+    """
+    sql = f'SELECT {columns}, {sort_column}, id FROM {table}'
+    params = []
+    if cursor:
+        sql += f' WHERE ({sort_column}, id) < (?, ?)'
+        params.extend(decode_cursor(cursor))
+    sql += f' ORDER BY {sort_column} DESC, id DESC LIMIT ?'
+    params.append(limit + 1)
+
+    with db.cursor(db_path) as c:
+        c.execute(sql, params)
+        rows = c.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][-2], rows[-1][-1])
+    return rows, next_cursor
+
+
+def iter_rows(db_path, table, columns, sort_column, batch_size=EXPORT_BATCH_SIZE):
+    """Yield every row newest first, one keyset page at a time.
+
+    Only one batch is held in memory, and no transaction stays open between
+    batches, so an export of millions of rows does not block writers.
+    """
+    cursor = None
+    while True:
+        rows, cursor = fetch_page(db_path, table, columns, sort_column, cursor, batch_size)
+        yield from rows
+        if cursor is None:
+            return
+
+
+def ndjson_lines(records):
+    """Serialize an iterable of dicts as newline-delimited JSON."""
+    for record in records:
+        yield json.dumps(record) + '\n'
+
+
+def json_array(records):
+    """Serialize an iterable of dicts as a streamed JSON array."""
+    yield '['
+    for i, record in enumerate(records):
+        yield (',' if i else '') + json.dumps(record)
+    yield ']\n'
@@ -0,0 +1,50 @@
+import os
+import time
+import logging
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+PRESIGNED_URL_EXPIRY = int(os.getenv('PRESIGNED_URL_EXPIRY', 3600))  # Seconds a signed URL is valid
+# A cached URL is handed out again only while at least this fraction of its
+# lifetime remains, so clients always get a usable window
+PRESIGNED_URL_MIN_REMAINING = float(os.getenv('PRESIGNED_URL_MIN_REMAINING', 0.5))
+PRESIGNED_URL_CACHE_SIZE = int(os.getenv('PRESIGNED_URL_CACHE_SIZE', 10000))
+
+
+class PresignedUrlCache:
+    """Reuses presigned GET URLs per object key instead of re-signing each request."""
+
+    def __init__(self, s3, bucket, expires_in=PRESIGNED_URL_EXPIRY,
+                 min_remaining=PRESIGNED_URL_MIN_REMAINING, maxsize=PRESIGNED_URL_CACHE_SIZE):
+        self.s3 = s3
+        self.bucket = bucket
+        self.expires_in = expires_in
+        # Entries expire from the cache once less than min_remaining is left
+        self._cache = LRUCache(maxsize, ttl=expires_in * (1 - min_remaining))
+
+    def sign(self, key):
+        """Return (url, expires_at) for `key`, signing only on a cache miss."""
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        expires_at = int(time.time()) + self.expires_in
+        url = self.s3.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': key},
+            ExpiresIn=self.expires_in
+        )
+        self._cache.set(key, (url, expires_at))
+        return url, expires_at
+
+    def sign_many(self, keys):
+        """Return {key: (url, expires_at)} for every key."""
+        return {key: self.sign(key) for key in keys}
+
+    def invalidate(self, key):
+        self._cache.invalidate(key)
+
+    def stats(self):
+        return self._cache.stats()
@@ -0,0 +1,163 @@
+import os
+import logging
+from urllib.parse import quote
+
+from flask import Response, send_file
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.http import parse_range_header
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from B2 and written to the client per iteration of a stream
+RAW_CHUNK_SIZE = int(os.getenv('RAW_CHUNK_SIZE', 256 * 1024))  # 256KB
+
+# Content addressed by its SHA-256 never changes
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def _etag_matches(header, etag):
+    """True if an If-None-Match / If-Range value names `etag` (or is *)."""
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+def _byte_range(header, size):
+    """Return (start, end) for a satisfiable single Range, None for the whole
+    object, or False if the range cannot be satisfied."""
+    ranges = parse_range_header(header)
+    if ranges is None or ranges.units != 'bytes' or len(ranges.ranges) != 1:
+        # Missing, malformed or multi-range requests get the full body
+        return None
+    bounds = ranges.range_for_length(size)
+    if bounds is None:
+        return False
+    start, stop = bounds
+    return start, stop - 1
+
+
+def _iter_body(body, chunk_size):
+    try:
+        for chunk in body.iter_chunks(chunk_size):
+            yield chunk
+    finally:
+        body.close()
+
+
+def object_headers(filehash, filename=None):
+    """Caching headers for content served by its SHA-256."""
+    headers = {
+        'ETag': f'"{filehash}"',
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL,
+        'Accept-Ranges': 'bytes'
+    }
+    if filename:
+        headers['Content-Disposition'] = f"inline; filename*=UTF-8''{quote(filename)}"
+    return headers
+
+
+def not_modified(request_headers, headers):
+    """Whether If-None-Match already names the object's ETag."""
+    return _etag_matches(request_headers.get('If-None-Match'), headers['ETag'])
+
+
+def plan_range(request_headers, size, headers):
+    """Status and B2 GetObject Range for a request, honouring Range and If-Range.
+
+    Adds Content-Range / Content-Length to `headers`. A 416 status means no
+    body is sent; otherwise the Range is None for the whole object.
+    """
+    byte_range = None
+    if_range = request_headers.get('If-Range')
+    if if_range is None or if_range.strip() == headers['ETag']:
+        byte_range = _byte_range(request_headers.get('Range'), size)
+    if byte_range is False:
+        headers['Content-Range'] = f'bytes */{size}'
+        return 416, None
+
+    if not byte_range:
+        headers['Content-Length'] = str(size)
+        return 200, None
+    start, end = byte_range
+    headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    headers['Content-Length'] = str(end - start + 1)
+    return 206, f'bytes={start}-{end}'
+
+
+def object_response(s3, bucket, key, filehash, size, request, content_type=None,
+                    filename=None, chunk_size=RAW_CHUNK_SIZE):
+    """Stream an object through the app with Range and conditional GET support.
+
+    The SHA-256 is a strong ETag, so If-None-Match revalidation costs no B2
+    call and responses can be cached forever. Only one chunk of the body is
+    in memory at a time.
+    """
+    headers = object_headers(filehash, filename)
+    if not_modified(request.headers, headers):
+        return Response(status=304, headers=headers)
+
+    if size is None:
+        size = s3.head_object(Bucket=bucket, Key=key)['ContentLength']
+
+    status, byte_range = plan_range(request.headers, size, headers)
+    if status == 416 or request.method == 'HEAD':
+        return Response(status=status, headers=headers, content_type=content_type)
+
+    params = {'Bucket': bucket, 'Key': key}
+    if byte_range:
+        params['Range'] = byte_range
+    obj = s3.get_object(**params)
+    return Response(
+        _iter_body(obj['Body'], chunk_size),
+        status=status,
+        headers=headers,
+        content_type=content_type or obj.get('ContentType') or 'application/octet-stream',
+        direct_passthrough=True
+    )
+
+
+def cached_object_response(disk_cache, s3, bucket, key, filehash, size, request, content_type=None,
+                           filename=None):
+    """object_response(), served from `disk_cache` when it holds the object.
+
+    Revalidations and HEAD requests are answered from the stored metadata
+    without touching the cache or B2. A full GET that misses the cache is
+    streamed from B2 while the cache fills in the background; Range
+    requests never start a fill, they are served from the cache once it has
+    the object.
+    """
+    if (disk_cache and disk_cache.accepts(size) and request.method != 'HEAD'
+            and not not_modified(request.headers, object_headers(filehash))):
+        path = disk_cache.get(filehash)
+        if path:
+            return cached_file_response(path, filehash, content_type=content_type, filename=filename)
+        if 'Range' not in request.headers:
+            disk_cache.fill_in_background(filehash, key)
+
+    return object_response(s3, bucket, key, filehash, size, request, content_type=content_type, filename=filename)
+
+
+def cached_file_response(path, filehash, content_type=None, filename=None):
+    """Serve a locally cached copy of an object with the same caching headers.
+
+    send_file handles Range and conditional requests itself, and hands the
+    file to the server's wsgi.file_wrapper so servers that support it (e.g.
+    gunicorn's sync workers) transmit it with sendfile().
+    """
+    try:
+        response = send_file(
+            path,
+            mimetype=content_type or 'application/octet-stream',
+            download_name=filename or filehash,
+            etag=filehash,
+            conditional=True,
+            max_age=31536000
+        )
+    except RequestedRangeNotSatisfiable as e:
+        # Carries Content-Range: bytes */<size>, like object_response's 416
+        return e.get_response()
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    if filename:
+        response.headers['Content-Disposition'] = f"inline; filename*=UTF-8''{quote(filename)}"
+    return response
@@ -0,0 +1,98 @@
+import ctypes
+import ctypes.util
+import hashlib
+import logging
+
+import _hashlib
+
+logger = logging.getLogger(__name__)
+
+
+class _SHA256_CTX(ctypes.Structure):
+    # SHA256_CTX from openssl/sha.h, a plain struct in libcrypto's public ABI
+    _fields_ = [
+        ('h', ctypes.c_uint * 8),
+        ('Nl', ctypes.c_uint),
+        ('Nh', ctypes.c_uint),
+        ('data', ctypes.c_uint * 16),
+        ('num', ctypes.c_uint),
+        ('md_len', ctypes.c_uint)
+    ]
+
+
+def _load_libcrypto():
+    """The libcrypto hashlib uses, with its SHA-256 calls checked; None if unusable."""
+    # Symbols of hashlib's own OpenSSL resolve through its extension module
+    for path in (_hashlib.__file__, ctypes.util.find_library('crypto')):
+        if not path:
+            continue
+        try:
+            lib = ctypes.CDLL(path)
+            for name in ('SHA256_Init', 'SHA256_Update', 'SHA256_Final'):
+                getattr(lib, name).restype = ctypes.c_int
+            lib.SHA256_Update.argtypes = [ctypes.POINTER(_SHA256_CTX), ctypes.c_void_p, ctypes.c_size_t]
+            lib.SHA256_Final.argtypes = [ctypes.c_char_p, ctypes.POINTER(_SHA256_CTX)]
+            lib.SHA256_Init.argtypes = [ctypes.POINTER(_SHA256_CTX)]
+        except (OSError, AttributeError):
+            continue
+        if _self_test(lib):
+            return lib
+    logger.warning("OpenSSL SHA-256 state is not accessible; resumable uploads will be hashed from B2")
+    return None
+
+
+def _self_test(lib):
+    ctx = _SHA256_CTX()
+    lib.SHA256_Init(ctypes.byref(ctx))
+    lib.SHA256_Update(ctypes.byref(ctx), b'ab', 2)
+    ctx = _SHA256_CTX.from_buffer_copy(bytes(ctx))
+    lib.SHA256_Update(ctypes.byref(ctx), b'c', 1)
+    digest = ctypes.create_string_buffer(32)
+    lib.SHA256_Final(digest, ctypes.byref(ctx))
+    return digest.raw == hashlib.sha256(b'abc').digest()
+
+
+_libcrypto = _load_libcrypto()
+
+# Whether ResumableSha256 can be used in this process
+AVAILABLE = _libcrypto is not None
+
+
+class ResumableSha256:
+    """SHA-256 whose running state can be saved and restored in another process.
+
+    hashlib cannot export a hash's state, so a file sent in pieces to several
+    workers could only be hashed where all of its bytes passed through. This
+    drives OpenSSL's SHA256_CTX through its (deprecated but still exported)
+    SHA256_* calls instead: state() is a small blob to store between pieces,
+    and ResumableSha256(state) carries on from it. The blob is only
+    meaningful to OpenSSL, so callers check AVAILABLE before using one and
+    treat a ValueError on restore as having no state.
+    """
+
+    def __init__(self, state=None):
+        if state is None:
+            self._ctx = _SHA256_CTX()
+            _libcrypto.SHA256_Init(ctypes.byref(self._ctx))
+        elif len(state) != ctypes.sizeof(_SHA256_CTX):
+            raise ValueError(f"SHA-256 state must be {ctypes.sizeof(_SHA256_CTX)} bytes, got {len(state)}")
+        else:
+            self._ctx = _SHA256_CTX.from_buffer_copy(state)
+
+    def update(self, data):
+        view = memoryview(data).cast('B')
+        if view.readonly:
+            buffer = ctypes.c_char_p(view.tobytes())
+        else:
+            buffer = (ctypes.c_char * len(view)).from_buffer(view)
+        # ctypes releases the GIL for the call, as hashlib does for large inputs
+        _libcrypto.SHA256_Update(ctypes.byref(self._ctx), buffer, len(view))
+
+    def state(self):
+        return bytes(self._ctx)
+
+    def hexdigest(self):
+        ctx = _SHA256_CTX.from_buffer_copy(bytes(self._ctx))
+        digest = ctypes.create_string_buffer(32)
+        _libcrypto.SHA256_Final(digest, ctypes.byref(ctx))
+        return digest.raw.hex()
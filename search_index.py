@@ -0,0 +1,62 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Queries that look like (part of) a SHA-256 are answered from the hash
+# index instead of the full-text index
+HASH_QUERY = re.compile(r'[0-9a-fA-F]{8,64}')
+
+
+def init_fts(c, table, columns, key='id'):
+    """Create `<table>_fts` over `columns` and the triggers that keep it in sync.
+
+    The index is an external-content FTS5 table: it stores only the tokens
+    and reads column values back from `table`, keyed by rowid `key`. An index
+    created against a table that already has rows is backfilled.
+    """
+    fts = f'{table}_fts'
+    cols = ', '.join(columns)
+    new_cols = ', '.join(f'new.{col}' for col in columns)
+    old_cols = ', '.join(f'old.{col}' for col in columns)
+
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,))
+    exists = c.fetchone() is not None
+
+    c.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+        {cols}, content='{table}', content_rowid='{key}',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+        INSERT INTO {fts}(rowid, {cols}) VALUES (new.{key}, {new_cols});
+    END''')
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+        INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.{key}, {old_cols});
+    END''')
+    # Only fires for the indexed columns, so download counters and the like
+    # do not rewrite the index
+    c.execute(f'''CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN
+        INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.{key}, {old_cols});
+        INSERT INTO {fts}(rowid, {cols}) VALUES (new.{key}, {new_cols});
+    END''')
+
+    if not exists:
+        c.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+        logger.info(f"Built full-text index {fts}")
+
+
+def is_hash_query(query):
+    """True if `query` should be looked up as a hash prefix."""
+    return HASH_QUERY.fullmatch(query) is not None
+
+
+def match_expression(query):
+    """Turn free text into an FTS5 MATCH expression, or None if it has no terms.
+
+    Every word becomes a quoted prefix term, so "quart rep" matches
+    "quarterly_report.pdf" and FTS5 operators in user input are inert.
+    """
+    terms = re.findall(r'\w+', query)
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
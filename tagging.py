@@ -0,0 +1,280 @@
+import os
+import re
+import json
+import hashlib
+import time
+import random
+import logging
+import threading
+
+import db
+
+logger = logging.getLogger(__name__)
+
+TAGGING_WORKERS = int(os.getenv('TAGGING_WORKERS', 2))  # Background threads per process
+TAGGING_MAX_ATTEMPTS = int(os.getenv('TAGGING_MAX_ATTEMPTS', 5))
+TAGGING_RETRY_DELAY = float(os.getenv('TAGGING_RETRY_DELAY', 5))  # Seconds before the first retry, doubled each time
+# A job left 'running' this long belongs to a worker that died and is retried
+TAGGING_LEASE_TIMEOUT = int(os.getenv('TAGGING_LEASE_TIMEOUT', 300))
+# Pending jobs sent to the model in one request
+TAGGING_BATCH_SIZE = int(os.getenv('TAGGING_BATCH_SIZE', 10))
+
+TAGGING_MODEL = os.getenv('TAGGING_MODEL', 'gpt-3.5-turbo')
+MAX_TAGS = 8
+
+TAG_PROMPT = """Given this file description and filename, generate 5-8 relevant tags that would help categorize and find this file later.
+
+Filename: {filename}
+Description: {description}
+
+Return only the tags as a JSON array of strings, nothing else."""
+
+BATCH_TAG_PROMPT = """For each file below, generate 5-8 relevant tags that would help categorize and find it later.
+
+Files (a JSON array of objects with "filename" and "description"):
+{files}
+
+Return only a JSON array with exactly {count} elements, one per file in the same order, where each element is a JSON array of tag strings. Nothing else."""
+
+
+def _clean_tags(tags):
+    if not isinstance(tags, list):
+        raise ValueError(f"Expected a JSON array of tags, got {type(tags).__name__}")
+    return [str(tag) for tag in tags][:MAX_TAGS]
+
+
+def openai_tagger(client, model=TAGGING_MODEL):
+    """Build a batch tagger that asks an OpenAI-compatible `client` for tags.
+
+    The tagger takes a list of (filename, description) pairs and returns one
+    tag list per pair. A single file uses the one-file prompt; several are
+    packed into one request whose JSON reply is split back per file. It
+    raises on API errors and malformed replies so the queue can retry them.
+    Any object exposing `chat.completions.create` works, which is how tests
+    substitute a local stub for the OpenAI client.
+    """
+    def complete(prompt, max_tokens):
+        response = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant that generates relevant tags for files."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.7,
+            max_tokens=max_tokens
+        )
+        return json.loads(response.choices[0].message.content.strip())
+
+    def tag(items):
+        if len(items) == 1:
+            filename, description = items[0]
+            return [_clean_tags(complete(TAG_PROMPT.format(filename=filename, description=description), 100))]
+
+        files = json.dumps([{'filename': f, 'description': d} for f, d in items], ensure_ascii=False)
+        results = complete(BATCH_TAG_PROMPT.format(files=files, count=len(items)), 100 * len(items))
+        if not isinstance(results, list) or len(results) != len(items):
+            raise ValueError(f"Expected {len(items)} tag lists in the batch reply")
+        return [_clean_tags(tags) for tags in results]
+    return tag
+
+
+def tag_cache_key(filename, description):
+    """Cache key for tagging inputs, ignoring case and whitespace differences."""
+    def normalize(text):
+        return re.sub(r'\s+', ' ', (text or '').strip().lower())
+    return hashlib.sha256(f"{normalize(filename)}\n{normalize(description)}".encode()).hexdigest()
+
+
+def init_tagging_jobs(c):
+    """Create the tagging job table using an open cursor."""
+    c.execute('''CREATE TABLE IF NOT EXISTS tagging_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        file_hash TEXT UNIQUE NOT NULL,
+        filename TEXT NOT NULL,
+        description TEXT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        tags TEXT,
+        last_error TEXT,
+        run_after REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tagging_jobs_due ON tagging_jobs(status, run_after)')
+    # Tags already generated for a normalized (filename, description) pair
+    c.execute('''CREATE TABLE IF NOT EXISTS tag_cache (
+        key TEXT PRIMARY KEY,
+        tags TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )''')
+
+
+class TaggingQueue:
+    """SQLite-backed queue of AI tagging jobs, drained by background threads.
+
+    Jobs move pending -> running -> done, or back to pending with exponential
+    backoff on failure until `max_attempts`, then failed. Claims are a
+    conditional UPDATE, so several worker processes can share the table.
+    Workers claim up to `batch_size` due jobs at a time; inputs already in
+    tag_cache are answered from it, and the rest go to `tagger` in a single
+    call. `on_tags(file_hash, tags)` stores the result once a job succeeds.
+    """
+
+    def __init__(self, db_path, tagger, on_tags, workers=TAGGING_WORKERS,
+                 max_attempts=TAGGING_MAX_ATTEMPTS, retry_delay=TAGGING_RETRY_DELAY,
+                 lease_timeout=TAGGING_LEASE_TIMEOUT, batch_size=TAGGING_BATCH_SIZE,
+                 poll_interval=5.0):
+        self.db_path = db_path
+        self.tagger = tagger
+        self.on_tags = on_tags
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_timeout = lease_timeout
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wake = threading.Condition()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def enqueue(self, file_hash, filename, description):
+        """Queue (or re-queue) tagging for a file."""
+        now = time.time()
+        with db.cursor(self.db_path) as c:
+            c.execute('''INSERT INTO tagging_jobs (file_hash, filename, description, run_after, updated_at)
+                         VALUES (?, ?, ?, ?, ?)
+                         ON CONFLICT(file_hash) DO UPDATE SET
+                           filename = excluded.filename, description = excluded.description,
+                           status = 'pending', attempts = 0, last_error = NULL,
+                           run_after = excluded.run_after, updated_at = excluded.updated_at''',
+                      (file_hash, filename, description, now, now))
+        self.start()
+        with self._wake:
+            self._wake.notify()
+
+    def status(self, file_hash):
+        """Job state for a file, or None if it was never queued."""
+        with db.cursor(self.db_path) as c:
+            c.execute('''SELECT status, attempts, tags, last_error FROM tagging_jobs
+                         WHERE file_hash = ?''', (file_hash,))
+            row = c.fetchone()
+        if not row:
+            return None
+        return {
+            'status': row[0],
+            'attempts': row[1],
+            'tags': json.loads(row[2]) if row[2] else [],
+            'error': row[3]
+        }
+
+    def start(self):
+        """Start this process's worker threads if they are not running yet."""
+        # Threads do not survive a fork, so each worker process starts its own
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._pid = pid
+            for i in range(self.workers):
+                threading.Thread(target=self._run, name=f'tagging-worker-{i}', daemon=True).start()
+
+    def run_pending(self):
+        """Process due jobs in the calling thread until none are left; returns the count."""
+        done = 0
+        while True:
+            processed = self._process_batch()
+            if not processed:
+                return done
+            done += processed
+
+    def _run(self):
+        while True:
+            try:
+                if self._process_batch():
+                    continue
+            except Exception as e:
+                logger.error(f"Tagging worker error: {e}")
+            with self._wake:
+                self._wake.wait(self.poll_interval)
+
+    def _claim(self):
+        now = time.time()
+        with db.cursor(self.db_path) as c:
+            # Jobs whose worker died mid-run become claimable again. Being a
+            # write, this also opens the transaction that makes the claim below
+            # atomic across processes
+            c.execute('''UPDATE tagging_jobs SET status = 'pending'
+                         WHERE status = 'running' AND updated_at < ?''', (now - self.lease_timeout,))
+            c.execute('''SELECT id, file_hash, filename, description, attempts FROM tagging_jobs
+                         WHERE status = 'pending' AND run_after <= ?
+                         ORDER BY run_after LIMIT ?''', (now, self.batch_size))
+            rows = c.fetchall()
+            if not rows:
+                return []
+            ids = [row[0] for row in rows]
+            c.execute(f'''UPDATE tagging_jobs SET status = 'running', attempts = attempts + 1, updated_at = ?
+                          WHERE id IN ({', '.join('?' * len(ids))}) AND status = 'pending' ''', (now, *ids))
+        return [{'id': row[0], 'file_hash': row[1], 'filename': row[2], 'description': row[3],
+                 'attempts': row[4] + 1, 'key': tag_cache_key(row[2], row[3])} for row in rows]
+
+    def _cached_tags(self, keys):
+        with db.cursor(self.db_path) as c:
+            c.execute(f"SELECT key, tags FROM tag_cache WHERE key IN ({', '.join('?' * len(keys))})", keys)
+            return {key: json.loads(tags) for key, tags in c.fetchall()}
+
+    def _process_batch(self):
+        jobs = self._claim()
+        if not jobs:
+            return 0
+        claimed = len(jobs)
+
+        keys = list(dict.fromkeys(job['key'] for job in jobs))
+        tags_by_key = self._cached_tags(keys)
+        missing = [key for key in keys if key not in tags_by_key]
+        if missing:
+            inputs = {job['key']: (job['filename'], job['description']) for job in jobs}
+            try:
+                generated = dict(zip(missing, self.tagger([inputs[key] for key in missing])))
+            except Exception as e:
+                # The whole request failed; only the uncached jobs need a retry
+                for job in jobs:
+                    if job['key'] not in tags_by_key:
+                        self._fail(job, e)
+                jobs = [job for job in jobs if job['key'] in tags_by_key]
+                generated = {}
+
+            if generated:
+                now = time.time()
+                with db.cursor(self.db_path) as c:
+                    c.executemany('''INSERT OR REPLACE INTO tag_cache (key, tags, created_at) VALUES (?, ?, ?)''',
+                                  [(key, json.dumps(tags), now) for key, tags in generated.items()])
+                tags_by_key.update(generated)
+                logger.info(f"Tagged {len(generated)} inputs in one request, {len(keys) - len(missing)} from cache")
+
+        for job in jobs:
+            tags = tags_by_key[job['key']]
+            try:
+                self.on_tags(job['file_hash'], tags)
+            except Exception as e:
+                self._fail(job, e)
+                continue
+            with db.cursor(self.db_path) as c:
+                c.execute('''UPDATE tagging_jobs SET status = 'done', tags = ?, last_error = NULL, updated_at = ?
+                             WHERE id = ?''', (json.dumps(tags), time.time(), job['id']))
+            logger.info(f"Tagged {job['file_hash'][:8]}: {tags}")
+        return claimed
+
+    def _fail(self, job, error):
+        now = time.time()
+        if job['attempts'] >= self.max_attempts:
+            status, run_after = 'failed', now
+            logger.error(f"Tagging {job['file_hash'][:8]} failed after {job['attempts']} attempts: {error}")
+        else:
+            # Exponential backoff with jitter so retries do not arrive in lockstep
+            delay = self.retry_delay * 2 ** (job['attempts'] - 1)
+            status, run_after = 'pending', now + delay * random.uniform(0.8, 1.2)
+            logger.warning(f"Tagging {job['file_hash'][:8]} attempt {job['attempts']} failed, retrying in {delay:.0f}s: {error}")
+        with db.cursor(self.db_path) as c:
+            c.execute('''UPDATE tagging_jobs SET status = ?, last_error = ?, run_after = ?, updated_at = ?
+                         WHERE id = ?''', (status, str(error), run_after, now, job['id']))
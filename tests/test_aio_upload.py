@@ -0,0 +1,27 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aio_upload import upload_reservation
+from upload_pipeline import plan_upload
+
+MB = 1024 * 1024
+
+
+def plan(file_size):
+    return plan_upload(file_size, part_size=100 * MB, threshold=100 * MB, workers=4, memory_budget=200 * MB)
+
+
+def test_unknown_size_reserves_head_and_parts_in_flight():
+    # The head read to size up the file stays alive while two 100MB parts are sent
+    assert upload_reservation(plan(None)) == (100 * MB + 1) + 2 * 100 * MB
+
+
+def test_known_large_file_reserves_parts_in_flight():
+    assert upload_reservation(plan(10 * 1024 * MB)) == 2 * 100 * MB
+    assert upload_reservation(plan(150 * MB)) == 150 * MB + 1
+
+
+def test_small_file_reserves_its_size():
+    assert upload_reservation(plan(5000)) == 5001
@@ -0,0 +1,84 @@
+import io
+import os
+import sys
+import asyncio
+
+import pytest
+from werkzeug.test import EnvironBuilder
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from form_stream import StreamingForm, AsyncStreamingForm
+
+# Each layout is sent with werkzeug's encoder, which lets the line break
+# ending an empty part's headers double as the one before the next delimiter
+LAYOUTS = [
+    [('empty.txt', b'')],
+    [('a.bin', b'x'), ('empty.txt', b''), ('b.bin', b'yy')],
+    [('empty.txt', b''), ('also-empty.txt', b'')],
+    [('crlf.bin', b'\r\n\r\n'), ('large.bin', os.urandom(5000))],
+]
+READ_SIZES = [1, 3, 7, 64, 1024 * 1024]
+
+
+class ChunkedReader(io.RawIOBase):
+    """Request stream that returns at most `n` bytes per read, like a slow socket."""
+
+    def __init__(self, data, n):
+        self._data = io.BytesIO(data)
+        self._n = n
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._data.read(self._n if size < 0 else min(size, self._n))
+
+
+def encode(files):
+    environ = EnvironBuilder(method='POST', data={
+        'description': 'before',
+        'file': [(io.BytesIO(data), name) for name, data in files],
+        'tag': 'after'
+    }).get_environ()
+    return environ['wsgi.input'].read(), environ['CONTENT_TYPE']
+
+
+@pytest.mark.parametrize('files', LAYOUTS)
+@pytest.mark.parametrize('n', READ_SIZES)
+def test_streaming_form_reads_every_file(files, n):
+    body, content_type = encode(files)
+    form = StreamingForm(ChunkedReader(body, n), content_type, len(body))
+    received = []
+    while form.open_file(None):
+        received.append((form.filename, form.read()))
+    assert received == files
+    assert form.finish() == {'description': 'before', 'tag': 'after'}
+
+
+@pytest.mark.parametrize('files', LAYOUTS)
+@pytest.mark.parametrize('n', READ_SIZES)
+def test_async_streaming_form_reads_every_file(files, n):
+    body, content_type = encode(files)
+
+    async def chunks():
+        for i in range(0, len(body), n):
+            yield body[i:i + n]
+        yield b''
+
+    async def receive():
+        form = AsyncStreamingForm(chunks(), content_type, len(body))
+        received = []
+        while await form.open_file(None):
+            data = bytearray()
+            while True:
+                chunk = await form.read(64 * 1024)
+                if not chunk:
+                    break
+                data += chunk
+            received.append((form.filename, bytes(data)))
+        return received, await form.finish()
+
+    received, fields = asyncio.run(receive())
+    assert received == files
+    assert fields == {'description': 'before', 'tag': 'after'}
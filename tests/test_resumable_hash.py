@@ -0,0 +1,39 @@
+import os
+import sys
+import hashlib
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import resumable_hash
+from resumable_hash import ResumableSha256
+
+pytestmark = pytest.mark.skipif(not resumable_hash.AVAILABLE, reason='OpenSSL SHA-256 state is not accessible')
+
+DATA = os.urandom(300000)
+# Piece boundaries inside, on and across SHA-256's 64-byte blocks
+SPLITS = [[], [1], [63, 64, 65], [64, 128], [1000, 1001, 150000]]
+
+
+@pytest.mark.parametrize('splits', SPLITS)
+def test_state_carries_over_between_hashers(splits):
+    state = ResumableSha256().state()
+    for start, end in zip([0] + splits, splits + [len(DATA)]):
+        hasher = ResumableSha256(state)
+        hasher.update(DATA[start:end])
+        state = hasher.state()
+    assert ResumableSha256(state).hexdigest() == hashlib.sha256(DATA).hexdigest()
+
+
+def test_accepts_writable_buffers_and_keeps_state_after_digest():
+    hasher = ResumableSha256()
+    hasher.update(memoryview(bytearray(DATA))[10:])
+    assert hasher.hexdigest() == hashlib.sha256(DATA[10:]).hexdigest()
+    hasher.update(b'more')
+    assert hasher.hexdigest() == hashlib.sha256(DATA[10:] + b'more').hexdigest()
+
+
+def test_rejects_state_of_the_wrong_size():
+    with pytest.raises(ValueError):
+        ResumableSha256(ResumableSha256().state()[:-1])
@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from tagging import TaggingQueue, init_tagging_jobs, openai_tagger
+
+
+class FakeOpenAI:
+    """Stands in for the OpenAI client: tags each file with its name, failing the first `fail` calls."""
+
+    def __init__(self, fail=0, reply=None):
+        self.fail = fail
+        self.reply = reply
+        self.prompts = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, messages, **kwargs):
+        prompt = messages[-1]['content']
+        self.prompts.append(prompt)
+        if len(self.prompts) <= self.fail:
+            raise RuntimeError('rate limited')
+        if self.reply is not None:
+            content = self.reply
+        elif 'Files (a JSON array' in prompt:
+            files = json.loads(prompt.split('\n')[3])
+            content = json.dumps([[f['filename']] for f in files])
+        else:
+            content = json.dumps([prompt.split('\n')[2].split(': ', 1)[1]])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'tagging.db')
+    with db.cursor(path) as c:
+        init_tagging_jobs(c)
+    return path
+
+
+def make_queue(db_path, client, stored=None, **kwargs):
+    stored = {} if stored is None else stored
+    # No background threads: jobs run in the test's thread through run_pending()
+    return TaggingQueue(db_path, openai_tagger(client), stored.__setitem__, workers=0, **kwargs)
+
+
+def job_row(db_path, file_hash):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute('SELECT status, attempts, run_after FROM tagging_jobs WHERE file_hash = ?',
+                            (file_hash,)).fetchone()
+    finally:
+        conn.close()
+
+
+def test_claimed_job_is_not_claimed_again_until_its_lease_expires(db_path):
+    queue = make_queue(db_path, FakeOpenAI(), lease_timeout=60)
+    queue.enqueue('h1', 'a.txt', 'notes')
+
+    jobs = queue._claim()
+    assert [job['file_hash'] for job in jobs] == ['h1']
+    assert job_row(db_path, 'h1')[:2] == ('running', 1)
+    assert make_queue(db_path, FakeOpenAI(), lease_timeout=60)._claim() == []
+
+    # The worker that claimed it died: after the lease another one takes over
+    with db.cursor(db_path) as c:
+        c.execute('UPDATE tagging_jobs SET updated_at = ?', (time.time() - 61,))
+    jobs = make_queue(db_path, FakeOpenAI(), lease_timeout=60)._claim()
+    assert [job['attempts'] for job in jobs] == [2]
+
+
+def test_failed_attempts_back_off_exponentially(db_path):
+    client = FakeOpenAI(fail=2)
+    stored = {}
+    queue = make_queue(db_path, client, stored, retry_delay=10)
+    queue.enqueue('h1', 'a.txt', 'notes')
+
+    before = time.time()
+    queue.run_pending()
+    status, attempts, run_after = job_row(db_path, 'h1')
+    assert (status, attempts) == ('pending', 1)
+    assert before + 8 <= run_after <= time.time() + 12
+    # Not due yet, so nothing is sent
+    assert queue.run_pending() == 0
+    assert len(client.prompts) == 1
+
+    with db.cursor(db_path) as c:
+        c.execute('UPDATE tagging_jobs SET run_after = 0')
+    before = time.time()
+    queue.run_pending()
+    status, attempts, run_after = job_row(db_path, 'h1')
+    assert (status, attempts) == ('pending', 2)
+    assert before + 16 <= run_after <= time.time() + 24
+
+    with db.cursor(db_path) as c:
+        c.execute('UPDATE tagging_jobs SET run_after = 0')
+    queue.run_pending()
+    assert queue.status('h1') == {'status': 'done', 'attempts': 3, 'tags': ['a.txt'], 'error': None}
+    assert stored == {'h1': ['a.txt']}
+
+
+@pytest.mark.parametrize('client', [FakeOpenAI(fail=99), FakeOpenAI(reply='not json')])
+def test_job_fails_after_max_attempts(db_path, client):
+    stored = {}
+    queue = make_queue(db_path, client, stored, retry_delay=0, max_attempts=3)
+    queue.enqueue('h1', 'a.txt', 'notes')
+
+    queue.run_pending()
+    status = queue.status('h1')
+    assert status['status'] == 'failed'
+    assert status['attempts'] == 3
+    assert status['error']
+    assert len(client.prompts) == 3
+    assert stored == {}
+
+
+def test_due_jobs_are_tagged_in_one_request_and_repeats_come_from_the_cache(db_path):
+    client = FakeOpenAI()
+    stored = {}
+    queue = make_queue(db_path, client, stored, batch_size=10)
+    # 12 jobs over 6 distinct inputs; case and spacing do not make an input distinct
+    for i in range(12):
+        queue.enqueue(f'h{i}', f'file{i % 6}.jpg', 'Holiday  photos' if i % 2 else 'holiday photos')
+
+    assert queue.run_pending() == 12
+    assert len(client.prompts) == 1
+    assert stored == {f'h{i}': [f'file{i % 6}.jpg'] for i in range(12)}
+
+    queue.enqueue('again', 'FILE0.JPG', ' holiday photos ')
+    queue.run_pending()
+    assert len(client.prompts) == 1
+    assert stored['again'] == ['file0.jpg']
+
+
+def test_failed_batch_only_retries_uncached_jobs(db_path):
+    queue = make_queue(db_path, FakeOpenAI())
+    queue.enqueue('h1', 'a.txt', 'notes')
+    queue.run_pending()
+
+    client = FakeOpenAI(fail=1)
+    queue = make_queue(db_path, client, retry_delay=0)
+    queue.enqueue('cached', 'a.txt', 'notes')
+    queue.enqueue('new', 'b.txt', 'other')
+    queue.run_pending()
+
+    assert queue.status('cached')['attempts'] == 1
+    assert queue.status('new') == {'status': 'done', 'attempts': 2, 'tags': ['b.txt'], 'error': None}
+    assert len(client.prompts) == 2
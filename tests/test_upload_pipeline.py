@@ -0,0 +1,54 @@
+import os
+import sys
+import io
+import time
+import tracemalloc
+import weakref
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from fake_s3 import FakeS3
+from upload_pipeline import multipart_upload, stream_upload
+
+
+class Part(bytearray):
+    """Part buffer that can be watched with a weak reference."""
+
+
+class SlowS3(FakeS3):
+    def upload_part(self, **kwargs):
+        time.sleep(0.02)
+        return super().upload_part(**kwargs)
+
+
+def test_multipart_upload_holds_at_most_max_in_flight_parts():
+    alive = set()
+    most_alive = 0
+
+    def parts():
+        nonlocal most_alive
+        for n in range(12):
+            part = Part(1000)
+            alive.add(n)
+            weakref.finalize(part, alive.discard, n)
+            most_alive = max(most_alive, len(alive))
+            yield part
+            del part
+
+    response = multipart_upload(SlowS3(), parts(), 'bkt', 'key', part_size=1000, workers=2, memory_budget=2000)
+    assert response['size'] == 12000
+    assert most_alive <= 2
+
+
+def test_small_upload_of_unknown_size_does_not_allocate_the_threshold():
+    tracemalloc.start()
+    try:
+        response = stream_upload(FakeS3(), io.BytesIO(b'x' * 1000), 'bkt', lambda filehash: filehash,
+                                 threshold=64 * 1024 * 1024)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert response['size'] == 1000
+    assert peak < 8 * 1024 * 1024
@@ -0,0 +1,93 @@
+import io
+import os
+import sys
+import hashlib
+import sqlite3
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import upload_pipeline
+import upload_sessions
+from fake_s3 import FakeS3
+
+
+class DroppedConnection(io.RawIOBase):
+    """Request body that fails after `n` bytes, like a client going away mid-part."""
+
+    def __init__(self, data, n):
+        self._data = io.BytesIO(data[:n])
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self._data.readinto(buffer)
+        if not n:
+            raise ConnectionResetError('client went away')
+        return n
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    # Parts of a few hundred bytes instead of B2's 5MB minimum
+    monkeypatch.setattr(upload_pipeline, 'MIN_PART_SIZE', 1)
+    monkeypatch.setattr(upload_pipeline, 'PART_ALIGNMENT', 1)
+    monkeypatch.setattr(upload_sessions, 'plan_upload',
+                        lambda size: upload_pipeline.plan_upload(size, part_size=300, threshold=600))
+    path = str(tmp_path / 'sessions.db')
+    conn = sqlite3.connect(path)
+    upload_sessions.init_upload_sessions(conn.cursor())
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.mark.parametrize('file_size, part_count', [(500, 1), (1000, 4)])
+def test_session_resumes_after_a_dropped_part(db_path, file_size, part_count):
+    s3 = FakeS3(store_bodies=True)
+    data = os.urandom(file_size)
+    session = upload_sessions.create_session(db_path, s3, 'bkt', 'f.bin', file_size)
+    assert session['part_count'] == part_count
+    part_size = session['part_size']
+
+    def send(part_number, stream=None):
+        start = (part_number - 1) * part_size
+        upload_sessions.upload_part(db_path, s3, 'bkt', session['id'], part_number,
+                                    stream or io.BytesIO(data[start:start + part_size]))
+
+    # The connection drops halfway through the last part
+    for part_number in range(1, part_count):
+        send(part_number)
+    start = (part_count - 1) * part_size
+    with pytest.raises(ConnectionResetError):
+        send(part_count, DroppedConnection(data[start:], 10))
+
+    # The client asks what is stored and sends only the rest
+    resumed = upload_sessions.get_session(db_path, session['id'])
+    assert [part['part_number'] for part in resumed['parts']] == list(range(1, part_count))
+    send(part_count)
+
+    calls = s3.calls
+    result = upload_sessions.complete_session(db_path, s3, 'bkt', session['id'], lambda filehash: filehash)
+    assert result['hash'] == hashlib.sha256(data).hexdigest()
+    assert s3.objects[result['hash']] == data
+    # Parts sent in order are hashed as they arrive, not read back from B2
+    assert s3.calls - calls == 3  # complete, copy, delete
+
+
+def test_parts_sent_out_of_order_are_hashed_from_b2(db_path):
+    s3 = FakeS3(store_bodies=True)
+    data = os.urandom(1000)
+    session = upload_sessions.create_session(db_path, s3, 'bkt', 'f.bin', len(data))
+    part_size = session['part_size']
+    for part_number in reversed(range(1, session['part_count'] + 1)):
+        start = (part_number - 1) * part_size
+        upload_sessions.upload_part(db_path, s3, 'bkt', session['id'], part_number,
+                                    io.BytesIO(data[start:start + part_size]))
+
+    result = upload_sessions.complete_session(db_path, s3, 'bkt', session['id'], lambda filehash: filehash)
+    assert result['hash'] == hashlib.sha256(data).hexdigest()
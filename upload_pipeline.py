@@ -0,0 +1,489 @@
+import os
+import io
+import hashlib
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import (UPLOAD_STAGE_SECONDS, UPLOAD_BYTES, UPLOADS_IN_FLIGHT, UPLOAD_PARTS_IN_FLIGHT,
+                     UPLOAD_PART_SIZE_BYTES, UPLOAD_PART_COUNT)
+
+logger = logging.getLogger(__name__)
+
+# B2 multipart upload configuration (preferred values, see plan_upload)
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', 100 * 1024 * 1024))  # 100MB chunks for multipart uploads
+MIN_MULTIPART_SIZE = int(os.getenv('MIN_MULTIPART_SIZE', 100 * 1024 * 1024))  # Use multipart for files > 100MB
+
+# Hard limits of the S3-compatible B2 API
+MIN_PART_SIZE = 5 * 1024 * 1024  # 5MB, except for the last part
+MAX_PART_SIZE = 5 * 1024 * 1024 * 1024  # 5GB
+MAX_PARTS = 10000
+MAX_OBJECT_SIZE = 10 * 1024 * 1024 * 1024 * 1024  # 10TB
+PART_ALIGNMENT = 1024 * 1024
+MAX_COPY_SIZE = 5 * 1024 * 1024 * 1024  # CopyObject is limited to 5GB, larger objects need a multipart copy
+
+# Parallel part uploads: number of concurrent PUTs and the bytes of parts each
+# upload may hold while they are read, queued or sent. Parts shrink so that all
+# workers fit; an upload of unknown size also holds the head it read ahead
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', 4))
+UPLOAD_MEMORY_BUDGET = int(os.getenv('UPLOAD_MEMORY_BUDGET', 2 * CHUNK_SIZE))  # 200MB
+
+# Large uploads land here until their hash (and therefore final key) is known
+TEMP_KEY_PREFIX = '_incoming/'
+
+
+def format_file_size(size_bytes):
+    """Format file size in human readable format."""
+    if size_bytes is None:
+        return "Unknown"
+
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size_bytes < 1024.0:
+            return f"{size_bytes:.1f} {unit}"
+        size_bytes /= 1024.0
+    return f"{size_bytes:.1f} PB"
+
+
+def plan_upload(file_size, part_size=CHUNK_SIZE, threshold=MIN_MULTIPART_SIZE,
+                workers=None, memory_budget=None):
+    """Choose the upload method, part size and concurrency for a file.
+
+    `part_size` and `threshold` are preferences. The plan keeps parts within
+    B2's 5MB-5GB range and under 10,000 parts, shrinks them so small
+    multipart files still keep every worker busy, caps them so `workers`
+    parts fit in `memory_budget`, and evens them out so the last part is
+    not a sliver. An unknown `file_size` gets the preferred part size.
+    """
+    workers = workers or UPLOAD_WORKERS
+    memory_budget = memory_budget or UPLOAD_MEMORY_BUDGET
+    threshold = max(MIN_PART_SIZE, min(threshold, memory_budget))
+
+    if file_size is not None and file_size > MAX_OBJECT_SIZE:
+        raise ValueError(f"File too large: {format_file_size(file_size)} exceeds the {format_file_size(MAX_OBJECT_SIZE)} limit")
+
+    plan = {
+        'file_size': file_size,
+        'multipart': file_size is None or file_size > threshold,
+        'threshold': threshold,
+        'part_size': file_size or 0,
+        'part_count': 1,
+        'workers': 1,
+        'max_in_flight': 1
+    }
+    if not plan['multipart']:
+        return plan
+
+    target = min(part_size, memory_budget // workers)
+    if file_size is not None:
+        target = min(target, -(-file_size // workers))
+        target = max(target, -(-file_size // MAX_PARTS))
+    size = min(max(target, MIN_PART_SIZE), MAX_PART_SIZE)
+
+    if file_size is not None:
+        # Spread the bytes evenly over the parts we need anyway
+        part_count = -(-file_size // size)
+        size = -(-file_size // part_count)
+        size = min(-(-size // PART_ALIGNMENT) * PART_ALIGNMENT, MAX_PART_SIZE)
+        plan['part_count'] = -(-file_size // size)
+    else:
+        plan['part_count'] = None
+
+    plan['part_size'] = size
+    plan['max_in_flight'] = max(1, memory_budget // size)
+    plan['workers'] = min(workers, plan['max_in_flight'], plan['part_count'] or workers)
+    return plan
+
+
+def describe_plan(plan):
+    """One-line summary of an upload plan for the logs."""
+    if not plan['multipart']:
+        return f"single PUT ({format_file_size(plan['file_size'])})"
+    return (f"multipart: {plan['part_count'] or '?'} parts of {format_file_size(plan['part_size'])}, "
+            f"{plan['workers']} workers, {plan['max_in_flight']} parts in flight")
+
+
+def observe_plan(plan, method=None):
+    """Record a plan's part size and part count in the upload metrics."""
+    method = method or ('multipart' if plan['multipart'] else 'single')
+    if plan['part_size']:
+        UPLOAD_PART_SIZE_BYTES.labels(method).observe(plan['part_size'])
+    if plan['part_count']:
+        UPLOAD_PART_COUNT.labels(method).observe(plan['part_count'])
+
+
+def head_size(plan):
+    """Bytes to read before choosing between a single PUT and multipart.
+
+    One byte past the expected size tells a small upload from a large one;
+    0 when the plan is multipart for a known size and nothing is read ahead.
+    """
+    file_size = plan['file_size']
+    if plan['multipart'] and file_size is not None:
+        return 0
+    return (plan['threshold'] if file_size is None else min(file_size, plan['threshold'])) + 1
+
+
+def is_single_put(plan, head):
+    """Whether `head`, read as head_size(plan) says, is the whole file and goes in one PUT."""
+    return len(head) <= plan['threshold'] and not (plan['multipart'] and plan['file_size'])
+
+
+def upload_result(filehash, key, size, plan, deduplicated=False):
+    """Result of stream_upload() and its asyncio counterpart."""
+    return {'hash': filehash, 'key': key, 'size': size, 'plan': plan, 'deduplicated': deduplicated}
+
+
+def existing_result(filehash, existing_key, size, plan, uploaded=False):
+    """Result for content `find_existing` reported as stored; None if it is new.
+
+    `uploaded` says whether a copy was already sent and is being discarded.
+    """
+    if not existing_key:
+        return None
+    if uploaded:
+        logger.info(f"Content already stored as {existing_key}, discarding the new copy")
+    else:
+        logger.info(f"Content already stored as {existing_key}, skipping upload")
+    return upload_result(filehash, existing_key, size, plan, deduplicated=True)
+
+
+def copy_part_ranges(size, part_size=CHUNK_SIZE):
+    """(part number, CopySourceRange) pairs for a multipart copy of `size` bytes."""
+    copy_part_size = max(part_size, 1024 * 1024 * 1024, -(-size // MAX_PARTS))
+    return [(part_number, f"bytes={start}-{min(start + copy_part_size, size) - 1}")
+            for part_number, start in enumerate(range(0, size, copy_part_size), start=1)]
+
+
+def normalize_sha256(value):
+    """Return a lowercase hex SHA-256 digest, or None if `value` is not one."""
+    value = (value or '').strip().lower()
+    if len(value) == 64 and all(ch in '0123456789abcdef' for ch in value):
+        return value
+    return None
+
+
+@UPLOADS_IN_FLIGHT.track_inprogress()
+def stream_upload(s3, file_obj, bucket, key_for_hash, file_size=None,
+                  part_size=CHUNK_SIZE, threshold=MIN_MULTIPART_SIZE, content_type=None,
+                  workers=None, memory_budget=None, find_existing=None):
+    """Hash and upload a file in a single pass over its bytes.
+
+    Files that plan_upload() keeps below the multipart threshold are read
+    once, hashed and sent with a single PUT straight to their final key.
+    Larger files are hashed part by part while being sent to a temporary
+    key with the multipart API; once the hash is known the object is
+    copied server-side to `key_for_hash(hash)` and the temporary object is
+    removed.
+
+    `find_existing(hash)` may return the key content with that hash is
+    already stored under. Small files then skip the PUT entirely, and large
+    ones drop their temporary object instead of copying it.
+
+    Returns a dict with the hash, final key, number of bytes uploaded, the
+    upload plan that was used and whether existing content was reused.
+    """
+    hasher = hashlib.sha256()
+    extra_args = {'ContentType': content_type} if content_type else {}
+    plan = plan_upload(file_size, part_size=part_size, threshold=threshold,
+                       workers=workers, memory_budget=memory_budget)
+    logger.info(f"Upload plan: {describe_plan(plan)}")
+    observe_plan(plan)
+
+    # Most uploads of unknown size are far below the threshold, so their head grows with the data
+    read_head = read_part if file_size is not None else read_up_to
+    head = read_head(file_obj, head_size(plan))
+    if is_single_put(plan, head):
+        UPLOAD_BYTES.labels('received').inc(len(head))
+        with UPLOAD_STAGE_SECONDS.labels('hash').time():
+            hasher.update(head)
+        filehash = hasher.hexdigest()
+        existing = existing_result(filehash, find_existing(filehash) if find_existing else None, len(head), plan)
+        if existing:
+            return existing
+
+        key = key_for_hash(filehash)
+        logger.info(f"Using regular upload for file ({format_file_size(len(head))})")
+        with UPLOAD_STAGE_SECONDS.labels('upload_part').time():
+            s3.put_object(Bucket=bucket, Key=key, Body=PartBody(head), **extra_args)
+        UPLOAD_BYTES.labels('sent').inc(len(head))
+        return upload_result(filehash, key, len(head), plan)
+
+    logger.info(f"Using multipart upload for large file ({format_file_size(file_size)})")
+    temp_key = f"{TEMP_KEY_PREFIX}{uuid.uuid4().hex}"
+    parts = iter_parts(file_obj, plan['part_size'], head=head, hasher=hasher)
+    # The head is copied into the first parts; once they are read its buffer
+    # must not outlive them, or unknown-size uploads hold an extra threshold
+    del head
+    response = multipart_upload(
+        s3, parts, bucket, temp_key,
+        file_size=file_size, part_size=plan['part_size'], content_type=content_type,
+        workers=plan['workers'], memory_budget=memory_budget
+    )
+    bytes_uploaded = response['size']
+    filehash = hasher.hexdigest()
+
+    with UPLOAD_STAGE_SECONDS.labels('move').time():
+        try:
+            existing = existing_result(filehash, find_existing(filehash) if find_existing else None,
+                                       bytes_uploaded, plan, uploaded=True)
+            if existing:
+                return existing
+
+            key = key_for_hash(filehash)
+            copy_object(s3, bucket, temp_key, key, bytes_uploaded, part_size=plan['part_size'], content_type=content_type)
+        finally:
+            delete_object(s3, bucket, temp_key, response.get('VersionId'))
+
+    logger.info(f"Multipart upload completed: {key}")
+    return upload_result(filehash, key, bytes_uploaded, plan)
+
+
+class PartBody(io.RawIOBase):
+    """Seekable, read-only file over a memoryview.
+
+    Lets boto3 send (and rewind on retry) a part straight out of its
+    buffer without first copying it into a bytes object.
+    """
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), len(self._view) - self._pos)
+        buffer[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        else:
+            self._pos = len(self._view) + offset
+        self._pos = max(0, min(self._pos, len(self._view)))
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def __len__(self):
+        return len(self._view)
+
+
+def read_part(file_obj, size, head=None):
+    """Fill a fresh `size`-byte buffer from `head` and then `file_obj`.
+
+    Returns a memoryview of the filled portion; reads go straight into the
+    buffer with readinto() where the stream supports it, so each part is
+    held in memory exactly once.
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    filled = 0
+    if head is not None and len(head):
+        filled = min(len(head), size)
+        view[:filled] = head[:filled]
+
+    readinto = getattr(file_obj, 'readinto', None)
+    while filled < size:
+        if readinto is not None:
+            n = readinto(view[filled:])
+        else:
+            data = file_obj.read(size - filled)
+            n = len(data) if data else 0
+            view[filled:filled + n] = data or b''
+        if not n:
+            break
+        filled += n
+    return view[:filled]
+
+
+def read_up_to(file_obj, size, chunk_size=PART_ALIGNMENT):
+    """Read at most `size` bytes, growing the buffer with the data rather than up front.
+
+    Returns a memoryview like read_part(); used where `size` is only a bound.
+    """
+    buffer = bytearray()
+    while len(buffer) < size:
+        data = file_obj.read(min(size - len(buffer), chunk_size))
+        if not data:
+            break
+        buffer += data
+    return memoryview(buffer)
+
+
+def iter_parts(file_obj, part_size, head=b'', hasher=None):
+    """Yield consecutive `part_size` chunks of a stream, hashing them in order.
+
+    Chunks are memoryviews over one buffer per part; `head` (bytes already
+    read from the stream) is consumed first, its whole parts sent straight
+    out of it and only the remainder copied into the next part's buffer.
+    """
+    head = memoryview(head) if len(head) else None
+    while True:
+        if head is not None and len(head) >= part_size:
+            chunk_data, head = head[:part_size], head[part_size:]
+        else:
+            chunk_data = read_part(file_obj, part_size, head)
+            if head is not None:
+                head.release()
+                head = None
+        if head is not None and not len(head):
+            # Even an empty view keeps the whole head buffer alive
+            head.release()
+            head = None
+        if not len(chunk_data):
+            return
+        UPLOAD_BYTES.labels('received').inc(len(chunk_data))
+        if hasher is not None:
+            with UPLOAD_STAGE_SECONDS.labels('hash').time():
+                hasher.update(chunk_data)
+        yield chunk_data
+        # Not kept while the next part is read; the caller decides how long it lives
+        del chunk_data
+
+
+def multipart_upload(s3, parts, bucket, key, file_size=None, part_size=CHUNK_SIZE, content_type=None,
+                     workers=None, memory_budget=None):
+    """Upload an iterable of part payloads to `key` with B2's multipart API.
+
+    Up to `workers` parts are PUT concurrently. The reader is throttled so
+    no more than `memory_budget` bytes of parts are queued or in flight at
+    once, and ETags are collected in part order for the completion call.
+
+    Returns the complete_multipart_upload response plus the uploaded size.
+    """
+    workers = workers or UPLOAD_WORKERS
+    memory_budget = memory_budget or UPLOAD_MEMORY_BUDGET
+    max_in_flight = max(1, memory_budget // part_size)
+
+    extra_args = {'ContentType': content_type} if content_type else {}
+    response = s3.create_multipart_upload(Bucket=bucket, Key=key, **extra_args)
+    upload_id = response['UploadId']
+    logger.info(f"Started multipart upload: {upload_id} ({workers} workers, {max_in_flight} parts in flight)")
+
+    slots = threading.BoundedSemaphore(max_in_flight)
+    failed = threading.Event()
+    progress_lock = threading.Lock()
+    bytes_uploaded = 0
+
+    def upload_one(part_number, chunk_data):
+        nonlocal bytes_uploaded
+        try:
+            if failed.is_set():
+                raise RuntimeError('Multipart upload aborted')
+            logger.info(f"Uploading part {part_number} ({format_file_size(len(chunk_data))})")
+            with UPLOAD_PARTS_IN_FLIGHT.track_inprogress(), UPLOAD_STAGE_SECONDS.labels('upload_part').time():
+                response = s3.upload_part(
+                    Bucket=bucket,
+                    Key=key,
+                    PartNumber=part_number,
+                    UploadId=upload_id,
+                    Body=PartBody(chunk_data) if isinstance(chunk_data, memoryview) else chunk_data
+                )
+            UPLOAD_BYTES.labels('sent').inc(len(chunk_data))
+            with progress_lock:
+                bytes_uploaded += len(chunk_data)
+                if file_size:
+                    progress = (bytes_uploaded / file_size) * 100
+                    logger.info(f"Upload progress: {progress:.1f}% ({format_file_size(bytes_uploaded)}/{format_file_size(file_size)})")
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        except Exception:
+            failed.set()
+            raise
+        finally:
+            slots.release()
+
+    try:
+        futures = []
+        parts = iter(parts)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='b2-part') as pool:
+            while True:
+                # A slot is taken before reading, so at most max_in_flight parts exist
+                slots.acquire()
+                chunk_data = None if failed.is_set() else next(parts, None)
+                if chunk_data is None:
+                    slots.release()
+                    break
+                futures.append(pool.submit(upload_one, len(futures) + 1, chunk_data))
+                del chunk_data
+
+        # Results are gathered in submission order, which is part order
+        completed_parts = [future.result() for future in futures]
+
+        with UPLOAD_STAGE_SECONDS.labels('complete').time():
+            response = s3.complete_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': completed_parts}
+            )
+    except Exception as e:
+        failed.set()
+        logger.error(f"Multipart upload failed: {e}")
+        try:
+            s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            logger.info(f"Aborted multipart upload: {upload_id}")
+        except Exception:
+            pass
+        raise
+
+    response['size'] = bytes_uploaded
+    return response
+
+
+def copy_object(s3, bucket, source_key, dest_key, size, part_size=CHUNK_SIZE, content_type=None):
+    """Server-side copy within the bucket, using a multipart copy above 5GB."""
+    source = {'Bucket': bucket, 'Key': source_key}
+    if size <= MAX_COPY_SIZE:
+        s3.copy_object(Bucket=bucket, Key=dest_key, CopySource=source)
+        return
+
+    extra_args = {'ContentType': content_type} if content_type else {}
+    response = s3.create_multipart_upload(Bucket=bucket, Key=dest_key, **extra_args)
+    upload_id = response['UploadId']
+    try:
+        parts = []
+        for part_number, copy_range in copy_part_ranges(size, part_size):
+            response = s3.upload_part_copy(
+                Bucket=bucket,
+                Key=dest_key,
+                PartNumber=part_number,
+                UploadId=upload_id,
+                CopySource=source,
+                CopySourceRange=copy_range
+            )
+            parts.append({'PartNumber': part_number, 'ETag': response['CopyPartResult']['ETag']})
+
+        s3.complete_multipart_upload(
+            Bucket=bucket,
+            Key=dest_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+    except Exception:
+        try:
+            s3.abort_multipart_upload(Bucket=bucket, Key=dest_key, UploadId=upload_id)
+        except Exception:
+            pass
+        raise
+
+
+def delete_object(s3, bucket, key, version_id=None):
+    """Delete an object, removing the stored version itself when B2 reported one."""
+    try:
+        if version_id:
+            s3.delete_object(Bucket=bucket, Key=key, VersionId=version_id)
+        else:
+            s3.delete_object(Bucket=bucket, Key=key)
+    except Exception as e:
+        logger.warning(f"Failed to delete temporary object {key}: {e}")
@@ -0,0 +1,342 @@
+import os
+import hashlib
+import logging
+import uuid
+
+import db
+import resumable_hash
+from metrics import UPLOAD_STAGE_SECONDS, UPLOAD_BYTES, UPLOAD_PARTS_IN_FLIGHT
+from resumable_hash import ResumableSha256
+from upload_pipeline import plan_upload, observe_plan, copy_object, delete_object, read_part, PartBody, TEMP_KEY_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# Sessions idle for longer than this are aborted and their parts discarded
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', 24 * 60 * 60))  # 24 hours
+
+# Parts arriving in order advance the file's running SHA-256, whose state is
+# stored on the session row so that any worker can take the next part. Parts
+# may also arrive out of order or in parallel; completion then, or wherever
+# resumable_hash is unavailable, re-reads the assembled object from B2.
+
+
+class UploadSessionError(Exception):
+    """A client-facing upload session error with the HTTP status to return."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def init_upload_sessions(c):
+    """Create the upload session tables using an open cursor."""
+    c.execute('''CREATE TABLE IF NOT EXISTS upload_sessions (
+        id TEXT PRIMARY KEY,
+        upload_id TEXT NOT NULL,
+        temp_key TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        file_size INTEGER NOT NULL,
+        part_size INTEGER NOT NULL,
+        part_count INTEGER NOT NULL,
+        mime_type TEXT,
+        description TEXT,
+        upload_ip TEXT,
+        status TEXT NOT NULL DEFAULT 'active',
+        filehash TEXT,
+        final_key TEXT,
+        hashed_parts INTEGER NOT NULL DEFAULT 0,
+        hash_state BLOB,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS upload_session_parts (
+        session_id TEXT NOT NULL,
+        part_number INTEGER NOT NULL,
+        etag TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        sha256 TEXT NOT NULL,
+        PRIMARY KEY (session_id, part_number)
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated ON upload_sessions(status, updated_at)')
+
+
+def _row_to_session(row):
+    return {
+        'id': row[0],
+        'upload_id': row[1],
+        'temp_key': row[2],
+        'filename': row[3],
+        'file_size': row[4],
+        'part_size': row[5],
+        'part_count': row[6],
+        'mime_type': row[7],
+        'description': row[8],
+        'upload_ip': row[9],
+        'status': row[10],
+        'filehash': row[11],
+        'final_key': row[12],
+        'hashed_parts': row[13],
+        'hash_state': row[14]
+    }
+
+
+def _load_session(c, session_id):
+    c.execute('''SELECT id, upload_id, temp_key, filename, file_size, part_size, part_count,
+                        mime_type, description, upload_ip, status, filehash, final_key,
+                        hashed_parts, hash_state
+                 FROM upload_sessions WHERE id = ?''', (session_id,))
+    row = c.fetchone()
+    if not row:
+        raise UploadSessionError('Upload session not found', 404)
+    return _row_to_session(row)
+
+
+def _session_parts(c, session_id):
+    c.execute('''SELECT part_number, etag, size, sha256 FROM upload_session_parts
+                 WHERE session_id = ? ORDER BY part_number''', (session_id,))
+    return [{'part_number': row[0], 'etag': row[1], 'size': row[2], 'sha256': row[3]} for row in c.fetchall()]
+
+
+def expected_part_size(session, part_number):
+    """Size a given part must have; only the last part may be shorter."""
+    if part_number < session['part_count']:
+        return session['part_size']
+    return session['file_size'] - session['part_size'] * (session['part_count'] - 1)
+
+
+def create_session(db_path, s3, bucket, filename, file_size, mime_type=None,
+                   description=None, upload_ip=None):
+    """Start a B2 multipart upload and record it as a resumable session."""
+    if not file_size or file_size <= 0:
+        raise UploadSessionError('File is empty')
+
+    expire_sessions(db_path, s3, bucket)
+
+    plan = plan_upload(file_size)
+    part_size = plan['part_size'] if plan['multipart'] else file_size
+    part_count = plan['part_count'] if plan['multipart'] else 1
+
+    session_id = uuid.uuid4().hex
+    temp_key = f"{TEMP_KEY_PREFIX}{session_id}"
+    extra_args = {'ContentType': mime_type} if mime_type else {}
+    response = s3.create_multipart_upload(Bucket=bucket, Key=temp_key, **extra_args)
+    hash_state = ResumableSha256().state() if resumable_hash.AVAILABLE else None
+
+    with db.cursor(db_path) as c:
+        c.execute('''INSERT INTO upload_sessions
+                     (id, upload_id, temp_key, filename, file_size, part_size, part_count,
+                      mime_type, description, upload_ip, hash_state)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                  (session_id, response['UploadId'], temp_key, filename, file_size, part_size,
+                   part_count, mime_type, description, upload_ip, hash_state))
+        session = _load_session(c, session_id)
+
+    logger.info(f"Created upload session {session_id}: {filename} ({part_count} parts of {part_size} bytes)")
+    observe_plan(plan, 'session')
+    return session
+
+
+def get_session(db_path, session_id):
+    """Return a session together with the parts B2 has already accepted."""
+    with db.cursor(db_path) as c:
+        session = _load_session(c, session_id)
+        session['parts'] = _session_parts(c, session_id)
+    session['bytes_received'] = sum(part['size'] for part in session['parts'])
+    return session
+
+
+def _running_hash(session):
+    """The session's running SHA-256, or None if it has none this process can use."""
+    if not resumable_hash.AVAILABLE or session['hash_state'] is None:
+        return None
+    try:
+        return ResumableSha256(session['hash_state'])
+    except ValueError as e:
+        logger.warning(f"Ignoring the running hash of upload session {session['id']}: {e}")
+        return None
+
+
+def upload_part(db_path, s3, bucket, session_id, part_number, stream):
+    """Read one part from `stream`, send it to B2 and record its ETag.
+
+    Parts may arrive in any order, and a part may be sent again, e.g. when
+    its response was lost. The part that follows those already hashed
+    advances the session's running hash.
+    """
+    with db.cursor(db_path) as c:
+        session = _load_session(c, session_id)
+
+    if session['status'] != 'active':
+        raise UploadSessionError(f"Upload session is {session['status']}", 409)
+    if part_number < 1 or part_number > session['part_count']:
+        raise UploadSessionError(f"Part number must be between 1 and {session['part_count']}")
+
+    expected = expected_part_size(session, part_number)
+    with UPLOAD_STAGE_SECONDS.labels('receive').time():
+        data = read_part(stream, expected + 1)
+    UPLOAD_BYTES.labels('received').inc(len(data))
+    if len(data) != expected:
+        raise UploadSessionError(f"Part {part_number} must be exactly {expected} bytes, got {len(data)}")
+
+    with UPLOAD_STAGE_SECONDS.labels('hash').time():
+        part_hash = hashlib.sha256(data).hexdigest()
+        hash_state = None
+        hasher = _running_hash(session) if part_number == session['hashed_parts'] + 1 else None
+        if hasher is not None:
+            hasher.update(data)
+            hash_state = hasher.state()
+    with UPLOAD_PARTS_IN_FLIGHT.track_inprogress(), UPLOAD_STAGE_SECONDS.labels('upload_part').time():
+        response = s3.upload_part(
+            Bucket=bucket,
+            Key=session['temp_key'],
+            PartNumber=part_number,
+            UploadId=session['upload_id'],
+            Body=PartBody(data)
+        )
+    UPLOAD_BYTES.labels('sent').inc(len(data))
+
+    with UPLOAD_STAGE_SECONDS.labels('db_write').time(), db.cursor(db_path) as c:
+        c.execute('BEGIN IMMEDIATE')
+        c.execute('SELECT sha256 FROM upload_session_parts WHERE session_id = ? AND part_number = ?',
+                  (session_id, part_number))
+        row = c.fetchone()
+        if row and row[0] != part_hash:
+            # Different bytes replace a part the running hash may already cover
+            c.execute('''UPDATE upload_sessions SET hash_state = NULL
+                         WHERE id = ? AND hashed_parts >= ?''', (session_id, part_number))
+        if hash_state is not None:
+            # Only advances from the state this part was hashed onto, so a
+            # concurrent copy of the same part cannot apply it twice
+            c.execute('''UPDATE upload_sessions SET hashed_parts = ?, hash_state = ?
+                         WHERE id = ? AND hashed_parts = ? AND hash_state IS NOT NULL''',
+                      (part_number, hash_state, session_id, part_number - 1))
+        c.execute('UPDATE upload_sessions SET updated_at = CURRENT_TIMESTAMP WHERE id = ?', (session_id,))
+        c.execute('''INSERT OR REPLACE INTO upload_session_parts (session_id, part_number, etag, size, sha256)
+                     VALUES (?, ?, ?, ?, ?)''',
+                  (session_id, part_number, response['ETag'], len(data), part_hash))
+
+    return {'part_number': part_number, 'etag': response['ETag'], 'size': len(data)}
+
+
+def _hash_object(s3, bucket, key):
+    """Hash an object by streaming it back from B2."""
+    hasher = hashlib.sha256()
+    body = s3.get_object(Bucket=bucket, Key=key)['Body']
+    for chunk in body.iter_chunks(chunk_size=1024 * 1024):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def complete_session(db_path, s3, bucket, session_id, key_for_hash, find_existing=None):
+    """Assemble the parts, move the object to its hash-derived key and close the session.
+
+    When `find_existing(hash)` returns a key, the content is already stored
+    there and the assembled copy is discarded instead of moved. Completing
+    an already completed session returns the stored result, so clients can
+    safely retry after a dropped response.
+    """
+    with db.cursor(db_path) as c:
+        session = _load_session(c, session_id)
+        if session['status'] == 'complete':
+            return {'hash': session['filehash'], 'key': session['final_key'],
+                    'size': session['file_size'], 'session': session, 'already_completed': True,
+                    'deduplicated': False}
+        if session['status'] != 'active':
+            raise UploadSessionError(f"Upload session is {session['status']}", 409)
+
+        parts = _session_parts(c, session_id)
+        missing = sorted(set(range(1, session['part_count'] + 1)) - {part['part_number'] for part in parts})
+        if missing:
+            raise UploadSessionError(f"Missing parts: {missing[:20]}", 409)
+
+        c.execute('''UPDATE upload_sessions SET status = 'completing', updated_at = CURRENT_TIMESTAMP
+                     WHERE id = ? AND status = 'active' ''', (session_id,))
+        if c.rowcount != 1:
+            raise UploadSessionError('Upload session is already being completed', 409)
+
+    try:
+        with UPLOAD_STAGE_SECONDS.labels('complete').time():
+            response = s3.complete_multipart_upload(
+                Bucket=bucket,
+                Key=session['temp_key'],
+                UploadId=session['upload_id'],
+                MultipartUpload={'Parts': [{'PartNumber': part['part_number'], 'ETag': part['etag']} for part in parts]}
+            )
+    except Exception:
+        _set_status(db_path, session_id, 'active')
+        raise
+
+    try:
+        hasher = _running_hash(session) if session['hashed_parts'] == session['part_count'] else None
+        if hasher is not None:
+            filehash = hasher.hexdigest()
+        elif session['part_count'] == 1:
+            filehash = parts[0]['sha256']
+        else:
+            logger.info(f"Hashing upload session {session_id} from B2 (its parts were not all hashed in order)")
+            with UPLOAD_STAGE_SECONDS.labels('hash').time():
+                filehash = _hash_object(s3, bucket, session['temp_key'])
+
+        existing_key = find_existing(filehash) if find_existing else None
+        if existing_key:
+            logger.info(f"Upload session {session_id} matches stored content {existing_key}")
+            key = existing_key
+        else:
+            key = key_for_hash(filehash)
+            with UPLOAD_STAGE_SECONDS.labels('move').time():
+                copy_object(s3, bucket, session['temp_key'], key, session['file_size'],
+                            part_size=session['part_size'], content_type=session['mime_type'])
+    except Exception:
+        # The multipart upload is already assembled, so it cannot be resumed
+        _set_status(db_path, session_id, 'failed')
+        raise
+    finally:
+        delete_object(s3, bucket, session['temp_key'], response.get('VersionId'))
+
+    with db.cursor(db_path) as c:
+        c.execute('''UPDATE upload_sessions SET status = 'complete', filehash = ?, final_key = ?,
+                     updated_at = CURRENT_TIMESTAMP WHERE id = ?''', (filehash, key, session_id))
+        c.execute('DELETE FROM upload_session_parts WHERE session_id = ?', (session_id,))
+
+    logger.info(f"Completed upload session {session_id}: {key}")
+    return {'hash': filehash, 'key': key, 'size': session['file_size'], 'session': session,
+            'already_completed': False, 'deduplicated': bool(existing_key)}
+
+
+def abort_session(db_path, s3, bucket, session_id):
+    """Abort the B2 multipart upload behind a session and forget its parts."""
+    with db.cursor(db_path) as c:
+        session = _load_session(c, session_id)
+
+    if session['status'] == 'complete':
+        raise UploadSessionError('Upload session is already complete', 409)
+
+    try:
+        s3.abort_multipart_upload(Bucket=bucket, Key=session['temp_key'], UploadId=session['upload_id'])
+    except Exception as e:
+        logger.warning(f"Failed to abort multipart upload for session {session_id}: {e}")
+
+    with db.cursor(db_path) as c:
+        c.execute('DELETE FROM upload_session_parts WHERE session_id = ?', (session_id,))
+        c.execute('''UPDATE upload_sessions SET status = 'aborted', updated_at = CURRENT_TIMESTAMP
+                     WHERE id = ?''', (session_id,))
+
+    logger.info(f"Aborted upload session {session_id}")
+
+
+def expire_sessions(db_path, s3, bucket, max_age=UPLOAD_SESSION_TTL):
+    """Abort sessions that have not received a part within `max_age` seconds."""
+    with db.cursor(db_path) as c:
+        c.execute('''SELECT id FROM upload_sessions
+                     WHERE status IN ('active', 'completing')
+                     AND updated_at < datetime('now', ?)''', (f'-{int(max_age)} seconds',))
+        expired = [row[0] for row in c.fetchall()]
+
+    for session_id in expired:
+        abort_session(db_path, s3, bucket, session_id)
+
+
+def _set_status(db_path, session_id, status):
+    with db.cursor(db_path) as c:
+        c.execute('UPDATE upload_sessions SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                  (status, session_id))